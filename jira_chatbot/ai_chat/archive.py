@@ -0,0 +1,170 @@
+"""
+Cold-storage archival for inactive chat sessions.
+
+Messages of sessions idle for longer than CHAT_ARCHIVE_AFTER_DAYS are packed
+into one compressed JSON payload per session (zstd when the zstandard package
+is installed, gzip otherwise) and removed from ChatMessage. The ChatSession
+row stays as a stub so the sidebar keeps working, and the messages are put
+back with their original ids the next time the chat is opened.
+"""
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from datetime import timedelta
+from .models import ChatSession, ChatMessage, ArchivedChatSession
+from .session_listing import invalidate_session_listing
+from .request_cache import invalidate_chat_session
+import gzip
+import json
+import logging
+import uuid
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_FIELDS = ('id', 'message_uid', 'user_message', 'bot_response', 'intent_detected', 'created_at', 'response_type')
+
+
+def default_codec():
+    return 'zstd' if zstandard else 'gzip'
+
+
+def compress(data, codec):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def decompress(data, codec):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("Archive was written with zstd but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def _pack(rows, codec):
+    for row in rows:
+        row['created_at'] = row['created_at'].isoformat()
+        row['message_uid'] = str(row['message_uid']) if row['message_uid'] else None
+    raw = json.dumps(rows, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return raw, compress(raw, codec)
+
+
+def archive_sessions(older_than_days, chunk_size=100, codec=None, limit=None):
+    """Archive inactive sessions in chunks, one transaction per chunk; returns totals"""
+    codec = codec or default_codec()
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    candidates = (
+        ChatSession.objects.filter(archived_at__isnull=True, last_activity__lt=cutoff)
+        .annotate(message_count=Count('chatmessage'))
+        .filter(message_count__gt=0)
+        .order_by('last_activity')
+        .values_list('pk', flat=True)
+    )
+    if limit:
+        candidates = candidates[:limit]
+    session_pks = list(candidates)
+
+    stats = {'sessions': 0, 'messages': 0, 'raw_bytes': 0, 'stored_bytes': 0, 'codec': codec}
+    for start in range(0, len(session_pks), chunk_size):
+        chunk_stats = _archive_chunk(session_pks[start:start + chunk_size], codec, cutoff)
+        for key in ('sessions', 'messages', 'raw_bytes', 'stored_bytes'):
+            stats[key] += chunk_stats[key]
+        logger.info(f"Archived {stats['sessions']}/{len(session_pks)} chat sessions")
+    return stats
+
+
+def _archive_chunk(session_pks, codec, cutoff):
+    stats = {'sessions': 0, 'messages': 0, 'raw_bytes': 0, 'stored_bytes': 0}
+    with transaction.atomic():
+        # Re-check inside the transaction; a session may have become active since it was selected
+        sessions = list(
+            ChatSession.objects.select_for_update()
+            .filter(pk__in=session_pks, archived_at__isnull=True, last_activity__lt=cutoff)
+        )
+        if not sessions:
+            return stats
+
+        messages = {}
+        rows = ChatMessage.objects.filter(session__in=sessions).order_by('session_id', 'created_at', 'id').values(
+            'session_id', *MESSAGE_FIELDS
+        )
+        for row in rows.iterator(chunk_size=2000):
+            messages.setdefault(row.pop('session_id'), []).append(row)
+
+        archives = []
+        untitled = []
+        for session in sessions:
+            session_messages = messages.get(session.pk)
+            if not session_messages:
+                continue
+            if not session.title:
+                session.title = ChatSession.title_from_message(session_messages[0]['user_message'])
+                untitled.append(session)
+            raw, payload = _pack(session_messages, codec)
+            archives.append(ArchivedChatSession(
+                session=session,
+                codec=codec,
+                payload=payload,
+                message_count=len(session_messages),
+                first_message_at=parse_datetime(session_messages[0]['created_at']),
+                last_message_at=parse_datetime(session_messages[-1]['created_at']),
+            ))
+            stats['sessions'] += 1
+            stats['messages'] += len(session_messages)
+            stats['raw_bytes'] += len(raw)
+            stats['stored_bytes'] += len(payload)
+
+        archived_pks = [archive.session_id for archive in archives]
+        ArchivedChatSession.objects.bulk_create(archives)
+        ChatMessage.objects.filter(session_id__in=archived_pks).delete()
+        if untitled:
+            ChatSession.objects.bulk_update(untitled, ['title'])
+        # update() keeps last_activity as it was
+        ChatSession.objects.filter(pk__in=archived_pks).update(archived_at=timezone.now())
+
+    for user_id in {session.user_id for session in sessions}:
+        invalidate_session_listing(user_id)
+    for session in sessions:
+        invalidate_chat_session(session.session_id)
+    return stats
+
+
+def rehydrate_session(session):
+    """Restore an archived session's messages into ChatMessage; returns the number restored"""
+    if not session.archived_at:
+        return 0
+
+    with transaction.atomic():
+        archive = ArchivedChatSession.objects.select_for_update().filter(session=session).first()
+        restored = 0
+        if archive is not None:
+            rows = json.loads(decompress(bytes(archive.payload), archive.codec))
+            ChatMessage.objects.bulk_create([
+                ChatMessage(
+                    session=session,
+                    id=row['id'],
+                    message_uid=uuid.UUID(row['message_uid']) if row['message_uid'] else None,
+                    user_message=row['user_message'],
+                    bot_response=row['bot_response'],
+                    intent_detected=row['intent_detected'],
+                    created_at=parse_datetime(row['created_at']),
+                    response_type=row['response_type'],
+                )
+                for row in rows
+            ], batch_size=500, ignore_conflicts=True)
+            restored = len(rows)
+            archive.delete()
+        ChatSession.objects.filter(pk=session.pk).update(archived_at=None)
+        session.archived_at = None
+
+    invalidate_session_listing(session.user_id)
+    invalidate_chat_session(session.session_id)
+    logger.info(f"Rehydrated {restored} messages for archived chat session {session.session_id}")
+    return restored
@@ -0,0 +1,191 @@
+"""
+Namespaced caching shared by every worker process.
+
+Each namespace in settings.CACHE_NAMESPACES maps to its own cache alias with
+its own TTL and entry limit (file-based by default, so all gunicorn workers
+on a host share it). get_or_set() is single-flight: one caller computes a
+missing value while concurrent callers wait for it. Hit and miss counters
+are kept per process and merged into the shared cache periodically so
+`python manage.py cache_stats` can report hit rates across workers.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from collections import Counter
+import atexit
+import logging
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+STATS_FLUSH_INTERVAL = 30  # Seconds between merges of local counters into the shared totals
+GENERATION_TTL = 2  # Seconds a worker trusts its copy of a namespace generation
+
+
+class NamespacedCache:
+    """Cache namespace with TTL, size limit, single-flight loading and hit-rate counters"""
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self.stats = Counter()
+        self._flushed = Counter()
+        self._last_flush = time.monotonic()
+        self._generation = None
+        self._generation_read_at = 0.0
+        self._lock = threading.Lock()
+        self._local_locks = {}
+
+    @property
+    def backend(self):
+        alias = self.namespace if self.namespace in settings.CACHES else 'default'
+        return caches[alias]
+
+    def _version(self):
+        """Generation of the namespace; moving to a new one invalidates every key at once
+
+        Generations are random tokens rather than a counter. The generation key
+        lives in the same culled cache, so when it is evicted a fresh token is
+        started, which orphans every key instead of bringing back cleared ones.
+        """
+        now = time.monotonic()
+        if self._generation is None or now - self._generation_read_at > GENERATION_TTL:
+            generation = self.backend.get('__generation__', version=0)
+            if generation is None:
+                self.backend.add('__generation__', uuid.uuid4().hex, None, version=0)
+                # Another worker may have started a generation first
+                generation = self.backend.get('__generation__', version=0) or uuid.uuid4().hex
+            self._generation = generation
+            self._generation_read_at = now
+        return self._generation
+
+    def get(self, key, default=None):
+        value = self.backend.get(key, _MISSING, version=self._version())
+        self._count('hits' if value is not _MISSING else 'misses')
+        return default if value is _MISSING else value
+
+    def set(self, key, value, timeout=None):
+        """Store a value; timeout defaults to the namespace TTL"""
+        kwargs = {} if timeout is None else {'timeout': timeout}
+        self.backend.set(key, value, version=self._version(), **kwargs)
+        self._count('sets')
+
+    def add(self, key, value, timeout=None):
+        """Store a value only if the key is missing; returns True if it was stored"""
+        kwargs = {} if timeout is None else {'timeout': timeout}
+        return self.backend.add(key, value, version=self._version(), **kwargs)
+
+    def delete(self, key):
+        self.backend.delete(key, version=self._version())
+
+    def delete_many(self, keys):
+        self.backend.delete_many(keys, version=self._version())
+
+    def clear(self):
+        """Invalidate every key in the namespace by moving to a new generation"""
+        generation = uuid.uuid4().hex
+        self.backend.set('__generation__', generation, None, version=0)
+        self._generation = generation
+        self._generation_read_at = time.monotonic()
+
+    def get_or_set(self, key, producer, timeout=None, wait=30):
+        """Return the cached value or compute it once, even with many concurrent callers"""
+        version = self._version()
+        value = self.backend.get(key, _MISSING, version=version)
+        if value is not _MISSING:
+            self._count('hits')
+            return value
+        self._count('misses')
+
+        # Threads of this process queue on a local lock; other processes on a lock key
+        with self._lock:
+            local_lock = self._local_locks.setdefault(key, threading.Lock())
+        with local_lock:
+            value = self.backend.get(key, _MISSING, version=version)
+            if value is not _MISSING:
+                self._count('coalesced')
+                return value
+
+            lock_key = f"{key}:lock"
+            token = uuid.uuid4().hex
+            deadline = time.monotonic() + wait
+            delay = 0.01
+            while not self.backend.add(lock_key, token, wait, version=version):
+                if time.monotonic() > deadline:
+                    logger.warning(f"Cache lock wait timed out for {self.namespace}:{key}")
+                    break
+                time.sleep(delay)
+                delay = min(delay * 2, 0.2)
+                value = self.backend.get(key, _MISSING, version=version)
+                if value is not _MISSING:
+                    self._count('coalesced')
+                    return value
+
+            try:
+                value = producer()
+                self.set(key, value, timeout)
+                return value
+            finally:
+                if self.backend.get(lock_key, version=version) == token:
+                    self.backend.delete(lock_key, version=version)
+                with self._lock:
+                    self._local_locks.pop(key, None)
+
+    def _count(self, name):
+        self.stats[name] += 1
+        if time.monotonic() - self._last_flush > STATS_FLUSH_INTERVAL:
+            self.flush_stats()
+
+    def flush_stats(self):
+        """Merge this process's counters into the shared totals (approximate under concurrency)"""
+        with self._lock:
+            delta = self.stats - self._flushed
+            self._flushed = self.stats.copy()
+            self._last_flush = time.monotonic()
+        if not delta:
+            return
+        try:
+            stats_cache = caches['default']
+            key = f"cache_stats:{self.namespace}"
+            totals = Counter(stats_cache.get(key, {}))
+            totals.update(delta)
+            stats_cache.set(key, dict(totals), None)
+        except Exception as e:
+            logger.warning(f"Failed to record cache stats for {self.namespace}: {str(e)}")
+
+
+_namespaces = {}
+_namespaces_lock = threading.Lock()
+
+
+def get_cache(namespace):
+    """Return the shared NamespacedCache for a namespace"""
+    if namespace not in _namespaces:
+        with _namespaces_lock:
+            _namespaces.setdefault(namespace, NamespacedCache(namespace))
+    return _namespaces[namespace]
+
+
+def flush_all_stats():
+    """Merge every namespace's local counters into the shared totals"""
+    for cache in list(_namespaces.values()):
+        cache.flush_stats()
+
+
+atexit.register(flush_all_stats)
+
+
+def shared_stats():
+    """Totals across workers as {namespace: {'hits': ..., 'misses': ..., 'hit_rate': ...}}"""
+    flush_all_stats()
+    report = {}
+    for namespace in settings.CACHE_NAMESPACES:
+        totals = caches['default'].get(f"cache_stats:{namespace}", {})
+        lookups = totals.get('hits', 0) + totals.get('misses', 0)
+        report[namespace] = dict(totals, hit_rate=totals.get('hits', 0) / lookups if lookups else 0.0)
+    return report
+
+
+def reset_shared_stats():
+    caches['default'].delete_many([f"cache_stats:{namespace}" for namespace in settings.CACHE_NAMESPACES])
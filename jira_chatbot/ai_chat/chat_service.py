@@ -1,92 +1,266 @@
-from .ollama_api import generate_response
+from django.conf import settings
+from django.db import connection, transaction
+from .ollama_api import generate_response, generate_cached
 from .jira_service import JiraService
-from .models import ChatSession, ChatMessage
+from .knowledge_index import knowledge_index
+from .html_text import truncate_tokens
+from .models import ChatSession, ChatMessage, LLMUsage
+from .session_listing import invalidate_session_listing
+from .write_behind import write_behind
+from .conversation_summary import conversation_summarizer
+from .archive import rehydrate_session
+from .request_cache import get_chat_session, cache_chat_session, get_assignee, get_jira_profile
+from .metrics import MessageTimer
+from .llm_usage import collect_usage, usage_rows
+from .tracing import debug_enabled
+from .profiling import profiling
+import contextvars
 import json
+import logging
+import queue
 import re
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Shown while a message is handled, before any of the reply is ready
+INTENT_STATUS = {
+    'bulk_close_tickets': "Finding the tickets to close…",
+    'resolve_ticket': "Resolving the ticket in Jira…",
+    'update_ticket_status': "Updating the ticket status in Jira…",
+    'add_ticket_comment': "Adding your comment in Jira…",
+    'get_ticket_details': "Looking up the ticket in Jira…",
+    'get_ticket_solution': "Looking up the ticket and working out a solution…",
+    'create_ticket': "Drafting the ticket…",
+    'create_confluence_page': "Drafting the Confluence page…",
+    'search_tickets': "Searching Jira…",
+    'search_confluence': "Searching Confluence…",
+    'list_confluence_pages': "Listing Confluence pages…",
+    'search_knowledge': "Searching documentation and tickets…",
+    'general_chat': "Thinking…",
+}
+
+_FINISHED = object()
 
 class ChatService:
-    def __init__(self, session_id, user=None, auto_assign=False):
+    def __init__(self, session_id, user=None, auto_assign=False, jira_api_token=None):
         self.session_id = session_id
         self.user = user
         self.auto_assign = auto_assign
-        self.jira_service = JiraService()
+        self._assignee = None
+        self._emit = None  # Set by stream_message to receive status, token and result_card events
+        self.message_uid = None
+        self.intent = None
+        self.timings = {}
+        self.jira_service = self._get_jira_service(jira_api_token)
         self.session = self._get_or_create_session()
     
     def _get_or_create_session(self):
-        session, created = ChatSession.objects.get_or_create(
-            session_id=self.session_id,
-            defaults={'user': self.user}
-        )
+        session = get_chat_session(self.session_id, self.user)
+
+        # Messages of an archived session come back before the conversation continues
+        if session.archived_at:
+            rehydrate_session(session)
+            cache_chat_session(session)
 
-        # Update user if session exists but user wasn't set
-        if not session.user and self.user:
-            session.user = self.user
-            session.save()
+        # Attach the user if the session exists without one; written with the message
+        if not session.user_id and self.user and self.user.is_authenticated:
+            session.stage(user=self.user)
 
         return session
+
+    def _get_jira_service(self, jira_api_token):
+        """JiraService acting as the user when their API token from login is available"""
+        profile = None
+        if jira_api_token and self.user and self.user.is_authenticated:
+            profile = get_jira_profile(self.user)
+        return JiraService(user_profile=profile, user_api_token=jira_api_token)
+
+    def _get_assignee(self):
+        """Jira assignee for auto-assign, resolved once per message from the cached profile"""
+        if not (self.auto_assign and self.user and self.user.is_authenticated):
+            return None
+        if self._assignee is None:
+            try:
+                # Prefer account ID, fallback to username/email
+                self._assignee = get_assignee(self.user, self.jira_service)
+            except Exception:
+                self._assignee = self.user.email  # Fallback to email
+        return self._assignee
     
     def process_message(self, user_message):
         """Process user message and generate response"""
-        # Get conversation context
-        context = self._get_conversation_context()
+        timer = MessageTimer()
+        try:
+            # Get conversation context
+            with timer.stage('context'):
+                context = self._get_conversation_context()
+
+            # Detect intent
+            with timer.stage('intent'):
+                intent = self._detect_intent(user_message)
+            timer.intent = self.intent = intent
+            self._event('status', text=INTENT_STATUS.get(intent, "Working…"), intent=intent)
+
+            with timer.stage('handler'), collect_usage() as llm_usage:
+                response = self._handle_intent(intent, user_message, context)
+
+            with timer.stage('persist'):
+                message_uid = self._save_exchange(user_message, response, intent, llm_usage)
+            self.message_uid = str(message_uid)
+
+            return response
+        finally:
+            timer.finish()
+            self.timings = timer.timings()
+
+    def stream_message(self, user_message, heartbeat=15, poll=None):
+        """Process a message on a worker thread, yielding (event, data) pairs as the reply is produced
+
+        status: what the bot is doing; token: pieces of the reply, which join up to the full
+        text; result_card: structured ticket data; error: the message failed; done: the
+        message_id, intent and stage timings. 'ping' is yielded after `heartbeat` idle
+        seconds so proxies keep the connection open. With `poll`, 'idle' is yielded after
+        that many quiet seconds, for framing.frame_events to send text it is holding back.
+        """
+        events = queue.Queue()
+        streamed = []
 
-        # Detect intent
-        intent = self._detect_intent(user_message)
+        def emit(event, data):
+            if event == 'token':
+                streamed.append(data['text'])
+            events.put((event, data))
 
+        def run():
+            try:
+                response = self.process_message(user_message)
+                # Handlers that do not stream their reply send it as one piece at the end
+                text = ''.join(streamed)
+                if not response.startswith(text):
+                    logger.warning(f"Streamed tokens do not match the {self.intent} reply; sending it again")
+                    text = ''
+                if response[len(text):]:
+                    events.put(('token', {'text': response[len(text):]}))
+                events.put(('done', {'message_id': self.message_uid, 'intent': self.intent, 'timings': self.timings}))
+            except Exception as e:
+                logger.exception(f"Failed to process chat message in session {self.session_id}")
+                events.put(('error', {'message': f"Sorry, something went wrong: {str(e)}"}))
+
+        def run_in_thread():
+            try:
+                run()
+            finally:
+                # The worker thread has its own database connection
+                connection.close()
+                events.put(_FINISHED)
+
+        self._emit = emit
+        if profiling():
+            # cProfile only records the thread that enabled it, so a profiled message is processed here
+            run()
+            events.put(_FINISHED)
+        else:
+            # Runs with the request's correlation ID and other context
+            context = contextvars.copy_context()
+            threading.Thread(target=context.run, args=(run_in_thread,), name='chat-stream', daemon=True).start()
+
+        last_event = time.monotonic()
+        while True:
+            try:
+                item = events.get(timeout=min(poll or heartbeat, heartbeat))
+            except queue.Empty:
+                if time.monotonic() - last_event >= heartbeat:
+                    last_event = time.monotonic()
+                    yield 'ping', {}
+                else:
+                    yield 'idle', {}
+                continue
+            if item is _FINISHED:
+                return
+            last_event = time.monotonic()
+            yield item
+
+    def _event(self, event, **data):
+        """Send an event to a streaming client, if there is one"""
+        if self._emit is not None:
+            self._emit(event, data)
+
+    def _handle_intent(self, intent, user_message, context):
+        """Run the handler for an intent"""
         # Handle different intents
         if intent == 'bulk_close_tickets':
-            response = self._handle_bulk_close_tickets(user_message)
+            return self._handle_bulk_close_tickets(user_message)
         elif intent == 'resolve_ticket':
-            response = self._handle_resolve_ticket(user_message)
+            return self._handle_resolve_ticket(user_message)
         elif intent == 'update_ticket_status':
-            response = self._handle_update_ticket_status(user_message)
+            return self._handle_update_ticket_status(user_message)
         elif intent == 'add_ticket_comment':
-            response = self._handle_add_ticket_comment(user_message)
+            return self._handle_add_ticket_comment(user_message)
         elif intent == 'get_ticket_details':
-            response = self._handle_get_ticket_details(user_message)
+            return self._handle_get_ticket_details(user_message)
         elif intent == 'get_ticket_solution':
-            response = self._handle_get_ticket_solution(user_message)
+            return self._handle_get_ticket_solution(user_message)
         elif intent == 'create_ticket':
-            response = self._handle_ticket_creation(user_message)
+            return self._handle_ticket_creation(user_message)
         elif intent == 'create_confluence_page':
-            response = self._handle_confluence_page_creation(user_message)
+            return self._handle_confluence_page_creation(user_message)
         elif intent == 'search_tickets':
-            response = self._handle_ticket_search(user_message)
+            return self._handle_ticket_search(user_message)
         elif intent == 'search_confluence':
-            response = self._handle_confluence_search(user_message)
+            return self._handle_confluence_search(user_message)
         elif intent == 'list_confluence_pages':
-            response = self._handle_list_confluence_pages(user_message)
+            return self._handle_list_confluence_pages(user_message)
         elif intent == 'search_knowledge':
-            response = self._handle_knowledge_search(user_message)
+            return self._handle_knowledge_search(user_message)
         else:
-            response = self._handle_general_chat(user_message, context)
-
-        # Save conversation
-        ChatMessage.objects.create(
-            session=self.session,
-            user_message=user_message,
-            bot_response=response,
-            intent_detected=intent
-        )
-
-        # Generate title for new sessions
-        if not self.session.title:
-            self.session.generate_title()
+            return self._handle_general_chat(user_message, context)
+
+    def _save_exchange(self, user_message, response, intent, llm_usage=()):
+        """Persist a finished exchange and the LLM usage of its generations; returns its message_uid"""
+        if settings.CHAT_WRITE_BEHIND:
+            # Persisted in the background after the reply has been streamed; the batch
+            # writer bumps last_activity, sets the title and appends the turn to the context
+            if self.session.flush(touch=False):
+                cache_chat_session(self.session)
+            message_uid = write_behind.enqueue(self.session, user_message, response, intent, llm_usage)
+        else:
+            # Save conversation in one short transaction, after all Jira/LLM work is done
+            message_uid = uuid.uuid4()
+            with transaction.atomic():
+                ChatMessage.objects.create(
+                    session=self.session,
+                    message_uid=message_uid,
+                    user_message=user_message,
+                    bot_response=response,
+                    intent_detected=intent
+                )
+                if llm_usage:
+                    LLMUsage.objects.bulk_create(
+                        usage_rows(llm_usage, self.session.pk, self.session.user_id, intent, message_uid)
+                    )
 
-        return response
+                # Title for new sessions, then one UPDATE for all staged session fields
+                if not self.session.title:
+                    self.session.stage(title=ChatSession.title_from_message(user_message))
+                self.session.flush()
+                state = conversation_summarizer.append_exchanges(
+                    self.session.pk, [(message_uid, user_message, response)]
+                )
+                if state is not None:
+                    self.session.conversation_context = state
+            cache_chat_session(self.session)
 
-    def _get_conversation_context(self):
-        """Get recent conversation history for context"""
-        recent_messages = ChatMessage.objects.filter(
-            session=self.session
-        ).order_by('-created_at')[:5]  # Last 5 messages
+            invalidate_session_listing(self.session.user_id)
 
-        context = ""
-        for msg in reversed(recent_messages):
-            context += f"User: {msg.user_message}\n"
-            context += f"Bot: {msg.bot_response[:100]}...\n\n"
+        return message_uid
 
-        return context
+    def _get_conversation_context(self):
+        """Get the rolling summary and recent turns for context"""
+        # Turns answered by any worker whose batch has not been written yet
+        pending = write_behind.pending_messages(self.session.pk) if settings.CHAT_WRITE_BEHIND else ()
+        return conversation_summarizer.context_for(self.session, pending)
     
     def _detect_intent(self, message):
         """Enhanced intent detection"""
@@ -214,27 +388,19 @@ class ChatService:
 
             json_str = '\n'.join(clean_lines)
 
-            # Debug logging
-            print(f"DEBUG: AI Response: {ai_response[:500]}")
-            print(f"DEBUG: Parsed JSON: {json_str}")
-
             ticket_data = json.loads(json_str)
-            print(f"DEBUG: Ticket data: {ticket_data}")
 
             # Create ticket
-            assignee = None
-            if self.auto_assign and self.user and self.user.is_authenticated:
-                # Get user's JIRA info from their profile
-                try:
-                    from jiraAuth.models import UserJiraProfile
-                    profile = UserJiraProfile.objects.get(user=self.user)
-                    # Prefer account ID, fallback to username/email
-                    assignee = profile.jira_account_id or profile.jira_username
-                except:
-                    assignee = self.user.email  # Fallback to email
+            assignee = self._get_assignee()
+
+            self._event('status', text="Creating the ticket in Jira…")
 
-            print(f"DEBUG: Creating ticket with data: {ticket_data}")
-            print(f"DEBUG: Assignee: {assignee}")
+            if debug_enabled(logger):
+                logger.debug(
+                    f"Creating ticket from AI response ({len(ai_response)} chars): "
+                    f"summary={ticket_data.get('summary', '')[:120]!r} priority={ticket_data.get('priority')} "
+                    f"assignee={assignee}"
+                )
 
             ticket = self.jira_service.create_ticket(
                 project_key=ticket_data.get('project_key', 'SUP'),
@@ -245,7 +411,12 @@ class ChatService:
                 assignee=assignee
             )
 
-            print(f"DEBUG: Ticket created successfully: {ticket.ticket_key}")
+            logger.info(f"Created ticket {ticket.ticket_key} from chat session {self.session_id}")
+            self._event(
+                'result_card', type='ticket', created=True, key=ticket.ticket_key, summary=ticket.summary,
+                status='To Do', priority=ticket_data.get('priority', 'Medium'), assignee=assignee,
+                url=f"{settings.JIRA_SERVER}/browse/{ticket.ticket_key}",
+            )
 
             assignment_msg = f"\nAssigned to: {assignee}" if assignee else "\nAssigned to: Unassigned"
             return f"**✅ Ticket Created Successfully**\n\n**{ticket.ticket_key}**: {ticket.summary}\n\nStatus: To Do | Priority: {ticket_data.get('priority', 'Medium')}{assignment_msg}\n\nYour ticket has been created and is ready for processing."
@@ -277,15 +448,7 @@ class ChatService:
             failed_tickets = []
 
             # Get assignee if auto-assign is enabled
-            assignee = None
-            if self.auto_assign and self.user and self.user.is_authenticated:
-                try:
-                    from jiraAuth.models import UserJiraProfile
-                    profile = UserJiraProfile.objects.get(user=self.user)
-                    # Prefer account ID, fallback to username/email
-                    assignee = profile.jira_account_id or profile.jira_username
-                except:
-                    assignee = self.user.email  # Fallback to email
+            assignee = self._get_assignee()
 
             # Close each ticket
             for ticket in tickets:
@@ -391,6 +554,13 @@ class ChatService:
 
         try:
             issue = self.jira_service.jira.issue(ticket_key)
+            self._event(
+                'result_card', type='ticket', key=ticket_key, summary=issue.fields.summary,
+                status=issue.fields.status.name,
+                priority=issue.fields.priority.name if issue.fields.priority else None,
+                assignee=issue.fields.assignee.displayName if issue.fields.assignee else None,
+                url=f"{settings.JIRA_SERVER}/browse/{ticket_key}",
+            )
             response = f"**🎫 Ticket Details: {ticket_key}**\n\n"
             response += f"**{issue.fields.summary}**\n\n"
             response += f"Status: {issue.fields.status.name} | Priority: {issue.fields.priority.name if issue.fields.priority else 'Not set'}\n"
@@ -439,11 +609,9 @@ class ChatService:
             Make the response practical and actionable.
             """
 
-            # Get AI response
-            ai_response = ""
+            # Get AI response; the same ticket state gives the same prompt, so it is cached
             try:
-                for chunk in generate_response(prompt):
-                    ai_response += chunk
+                ai_response = generate_cached(prompt)
             except Exception as e:
                 return f"Sorry, I couldn't generate a solution. Error: {str(e)}"
 
@@ -472,15 +640,7 @@ class ChatService:
 
         try:
             # Get assignee if auto-assign is enabled
-            assignee = None
-            if self.auto_assign and self.user and self.user.is_authenticated:
-                try:
-                    from jiraAuth.models import UserJiraProfile
-                    profile = UserJiraProfile.objects.get(user=self.user)
-                    # Prefer account ID, fallback to username/email
-                    assignee = profile.jira_account_id or profile.jira_username
-                except:
-                    assignee = self.user.email  # Fallback to email
+            assignee = self._get_assignee()
 
             result = self.jira_service.resolve_ticket(ticket_key, resolution_comment, assignee=assignee)
             response = f"✅ **Ticket {ticket_key} has been resolved!**\n\n"
@@ -622,17 +782,14 @@ class ChatService:
             json_str = json_str.replace('{ ', '{').replace(' }', '}').replace('[ ', '[').replace(' ]', ']')
             page_data = json.loads(json_str)
 
-            # Get available spaces to use a default one (prefer IT-support)
-            spaces = self.jira_service.get_confluence_spaces()
-            default_space = 'ITSUPPORT'  # Default to IT-support space
-            for space in spaces:
-                if space['key'] == 'ITSUPPORT':
-                    default_space = 'ITSUPPORT'
-                    break
+            # Use the requested space if it exists, otherwise default to IT-support
+            space_key = page_data.get('space_key') or 'ITSUPPORT'
+            if not self.jira_service.has_confluence_space(space_key):
+                space_key = 'ITSUPPORT'
 
             # Create Confluence page
             page = self.jira_service.create_confluence_page(
-                space_key=page_data.get('space_key', default_space),
+                space_key=space_key,
                 title=page_data['title'],
                 content=page_data['content']
             )
@@ -660,6 +817,13 @@ class ChatService:
         tickets = self.jira_service.search_tickets(search_terms)
 
         if tickets:
+            self._event('result_card', type='ticket_list', items=[
+                {
+                    'key': ticket['key'], 'summary': ticket['summary'], 'status': ticket['status'],
+                    'priority': ticket['priority'], 'url': f"{settings.JIRA_SERVER}/browse/{ticket['key']}",
+                }
+                for ticket in tickets[:5]
+            ])
             response = f"**🎫 Ticket Search Results ({len(tickets)} found)**\n\n"
             for i, ticket in enumerate(tickets[:5], 1):  # Limit to 5 results
                 response += f"{i}. **{ticket['key']}**: {ticket['summary']}\n"
@@ -681,6 +845,11 @@ class ChatService:
         if not search_terms or len(search_terms) < 3:
             search_terms = message
 
+        # Answer from the local retrieval index when it has relevant passages
+        knowledge_hits = knowledge_index.search(message, k=5)
+        if knowledge_hits:
+            return self._answer_from_knowledge(message, knowledge_hits)
+
         # Search both tickets and Confluence
         tickets = self.jira_service.search_tickets(search_terms)
         confluence_pages = self.jira_service.search_confluence(search_terms)
@@ -695,7 +864,7 @@ class ChatService:
                 response += "**📚 From Confluence Documentation:**\n\n"
                 for i, page in enumerate(confluence_pages[:3], 1):
                     response += f"{i}. **{page['title']}**\n"
-                    response += f"   {page['content'][:150]}...\n"
+                    response += f"   {truncate_tokens(page['content'], 40)}\n"
                     response += f"   [View full page]({page['url']})\n\n"
 
             if tickets:
@@ -723,9 +892,7 @@ class ChatService:
             Keep it concise and actionable.
             """
 
-            ai_advice = ""
-            for chunk in generate_response(prompt):
-                ai_advice += chunk
+            ai_advice = generate_cached(prompt)
 
             response += f"**💡 Recommended Next Steps:**\n{ai_advice}"
 
@@ -753,14 +920,45 @@ class ChatService:
             Keep the response helpful and professional.
             """
 
-            ai_advice = ""
-            for chunk in generate_response(prompt):
-                ai_advice += chunk
+            ai_advice = generate_cached(prompt)
 
             response += ai_advice
 
         return response
     
+    def _answer_from_knowledge(self, message, hits):
+        """Build a retrieval-augmented answer from indexed documentation and resolved tickets"""
+        response = "**📚 Relevant Knowledge:**\n\n"
+        seen_sources = set()
+        for entry, score in hits:
+            if (entry.source_type, entry.source_id) in seen_sources:
+                continue
+            seen_sources.add((entry.source_type, entry.source_id))
+            icon = "🎫" if entry.source_type == 'ticket' else "📄"
+            response += f"{len(seen_sources)}. {icon} **{entry.title}**\n"
+            if entry.url:
+                response += f"   [View source]({entry.url})\n"
+            response += "\n"
+
+        passages = "\n\n".join(
+            f"[{entry.source_type} {entry.source_id}] {entry.title}\n{entry.content}" for entry, _ in hits
+        )
+        prompt = f"""
+        User is asking: {message}
+
+        Relevant passages from our documentation and resolved tickets:
+        {passages}
+
+        Using only these passages where they apply, provide 2-3 practical next steps or recommendations.
+        Mention which ticket or page each step comes from. Keep it concise and actionable.
+        """
+
+        self._event('status', text="Writing recommendations…")
+        ai_advice = generate_cached(prompt)
+
+        response += f"**💡 Recommended Next Steps:**\n{ai_advice}"
+        return response
+
     def _handle_list_confluence_pages(self, message):
         """Handle requests to list available Confluence pages"""
         if not self.jira_service.confluence_available:
@@ -775,7 +973,7 @@ class ChatService:
                 for i, page in enumerate(all_pages[:10], 1):  # Limit to 10 results
                     response += f"{i}. **{page['title']}**\n"
                     if page['content']:
-                        response += f"   Preview: {page['content'][:100]}...\n"
+                        response += f"   Preview: {truncate_tokens(page['content'], 25)}\n"
                     response += f"   [View page]({page['url']})\n\n"
 
                 if len(all_pages) > 10:
@@ -807,7 +1005,7 @@ class ChatService:
             response += f"Search term: `{search_terms}`\n\n"
             for i, page in enumerate(confluence_pages[:5], 1):  # Limit to 5 results
                 response += f"{i}. **{page['title']}**\n"
-                response += f"   {page['content'][:200]}...\n"
+                response += f"   {truncate_tokens(page['content'], 50)}\n"
                 response += f"   [View page]({page['url']})\n\n"
         else:
             response = f"**📚 No Confluence pages found**\n\n"
@@ -834,6 +1032,8 @@ class ChatService:
         response = ""
         for chunk in generate_response(prompt):
             response += chunk
+            if chunk:
+                self._event('token', text=chunk)
 
         return response
 
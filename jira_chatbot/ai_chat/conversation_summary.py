@@ -0,0 +1,219 @@
+"""
+Rolling conversation summary kept in ChatSession.conversation_context.
+
+The context holds a compact LLM-written summary of older turns plus the last
+few turns verbatim, so prompt size stays constant however long a session
+grows and reading it costs no more than the session row. Each finished turn
+is appended in the transaction that saves its message (the write-behind
+batch, or the synchronous save); until then it is read from the write-behind
+journals. Folding the oldest turns into the summary, which needs an LLM call,
+runs on a background thread. Both write with a compare-and-swap on
+ChatSession.context_version, so concurrent workers never overwrite each
+other's turns.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from django.db import connection, transaction
+from .html_text import truncate_tokens
+from .models import ChatSession, ChatMessage
+from .ollama_api import generate_response
+from .request_cache import invalidate_chat_session
+from .tracing import current_request_id, traced
+from .llm_usage import collect_usage, save_usage
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+RECENT_TURNS = 4  # Turns kept verbatim; older ones are folded into the summary
+USER_TURN_TOKENS = 60
+BOT_TURN_TOKENS = 80
+SUMMARY_TOKENS = 200
+
+
+def _turn(turn_id, user_message, bot_response):
+    return {
+        'id': str(turn_id),
+        'user': truncate_tokens(user_message, USER_TURN_TOKENS),
+        'bot': truncate_tokens(bot_response, BOT_TURN_TOKENS),
+    }
+
+
+def render_context(summary, turns):
+    """Format a summary and recent turns as prompt text"""
+    context = ""
+    if summary:
+        context += f"Summary of earlier conversation: {summary}\n\n"
+    for turn in turns:
+        context += f"User: {turn['user']}\n"
+        context += f"Bot: {turn['bot']}\n\n"
+    return context
+
+
+class ConversationSummarizer:
+    """Keeps the rolling summary stored on each chat session up to date"""
+
+    def __init__(self):
+        self._executor = None
+        self._scheduled = set()
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # One worker keeps each session's compactions in order
+                    self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='chat-summary')
+        return self._executor
+
+    def append_exchanges(self, session_pk, exchanges):
+        """Append (message_uid, user_message, bot_response) exchanges to the stored context
+
+        Called in the transaction that saves their messages, by the write-behind
+        batch writer or the synchronous save; folding old turns into the summary
+        is scheduled for after the commit. Returns the stored state, or None.
+        """
+        turns = [_turn(*exchange) for exchange in exchanges]
+        turn_ids = {turn['id'] for turn in turns}
+
+        def append(state):
+            recent = state.get('recent')
+            if recent is None:
+                # Session from before rolling summaries; start from its latest messages
+                recent = [t for t in self._recent_from_messages(session_pk) if t['id'] not in turn_ids]
+            stored_ids = {t['id'] for t in recent}
+            new = [turn for turn in turns if turn['id'] not in stored_ids]
+            if not new:
+                return None
+            state.update({
+                'summary': state.get('summary', ''),
+                'recent': recent + new,
+                'summarized_turns': state.get('summarized_turns', 0),
+            })
+            return state
+
+        try:
+            # A savepoint, so a failed update never costs the messages themselves
+            with transaction.atomic():
+                state = ChatSession.update_context(session_pk, append)
+        except Exception as e:
+            logger.error(f"Failed to store conversation turns for session {session_pk}: {str(e)}")
+            return None
+        if state is not None and len(state['recent']) > RECENT_TURNS:
+            transaction.on_commit(lambda: self._schedule(session_pk))
+        return state
+
+    def _schedule(self, session_pk):
+        with self._lock:
+            if session_pk in self._scheduled:
+                return
+            self._scheduled.add(session_pk)
+        self._get_executor().submit(self._compact_for_request, session_pk, current_request_id())
+
+    def _compact_for_request(self, session_pk, request_id):
+        # Logs and LLM calls of the update carry the ID of the request that queued it
+        with traced(request_id):
+            self._compact(session_pk)
+
+    def drain(self, timeout=30):
+        """Wait for queued updates and close the worker's DB connection (benchmarks, tests)"""
+        deadline = time.monotonic() + timeout
+        while self._executor is not None:
+            # Queued behind every update submitted so far, and runs on the worker thread
+            self._executor.submit(lambda: connection.close()).result(timeout)
+            with self._lock:
+                if not self._scheduled or time.monotonic() > deadline:
+                    return
+
+    def context_for(self, session, pending_messages=()):
+        """Prompt context from the session row plus messages that are answered but not saved yet"""
+        state = session.conversation_context or {}
+        pending = [_turn(msg.message_uid, msg.user_message, msg.bot_response) for msg in pending_messages]
+
+        if 'recent' not in state and not pending:
+            # Session from before rolling summaries; use its latest messages once
+            return render_context('', self._recent_from_messages(session.pk))
+
+        turns = list(state.get('recent', []))
+        seen = {turn['id'] for turn in turns}
+        for turn in pending:
+            if turn['id'] not in seen:
+                seen.add(turn['id'])
+                turns.append(turn)
+        return render_context(state.get('summary', ''), turns)
+
+    def _compact(self, session_pk):
+        """Fold the turns beyond RECENT_TURNS into the summary"""
+        try:
+            row = ChatSession.objects.filter(pk=session_pk).values_list(
+                'conversation_context', 'session_id', 'user_id'
+            ).first()
+            if row is None:
+                return  # Session deleted in the meantime
+            state = row[0] or {}
+            recent = state.get('recent', [])
+            if len(recent) <= RECENT_TURNS:
+                return
+            evicted = recent[:-RECENT_TURNS]
+            evicted_ids = [turn['id'] for turn in evicted]
+            with collect_usage() as llm_usage:
+                summary = self._summarize(state.get('summary', ''), evicted)
+
+            def fold(current):
+                # Turns appended meanwhile stay; a summary another worker stored first wins
+                if current.get('summary', '') != state.get('summary', ''):
+                    return None
+                if [turn['id'] for turn in current.get('recent', [])[:len(evicted)]] != evicted_ids:
+                    return None
+                current.update({
+                    'summary': summary,
+                    'recent': current['recent'][len(evicted):],
+                    'summarized_turns': current.get('summarized_turns', 0) + len(evicted),
+                })
+                return current
+
+            ChatSession.update_context(session_pk, fold)
+            invalidate_chat_session(row[1])
+            save_usage(llm_usage, session_pk, row[2], 'summary')
+        except Exception as e:
+            logger.error(f"Failed to update conversation summary for session {session_pk}: {str(e)}")
+        finally:
+            with self._lock:
+                self._scheduled.discard(session_pk)
+
+    def _summarize(self, summary, turns):
+        """Fold turns into the running summary with the LLM, falling back to plain concatenation"""
+        prompt = f"""Update the running summary of a support conversation between a user and a Jira assistant.
+        Keep ticket keys, Confluence page titles, decisions and open questions. Use at most 120 words.
+        Return only the updated summary.
+
+        Current summary:
+        {summary or '(none)'}
+
+        New turns:
+        {render_context('', turns)}
+        Updated summary:"""
+
+        try:
+            updated = "".join(generate_response(prompt)).strip()
+            if updated:
+                return truncate_tokens(updated, SUMMARY_TOKENS)
+        except Exception as e:
+            logger.warning(f"Summary generation failed, keeping a plain transcript: {str(e)}")
+
+        # Keep the newest text within the budget (roughly 3 words per 4 tokens)
+        words = (summary + ' ' + render_context('', turns)).split()
+        return ' '.join(words[-(SUMMARY_TOKENS * 3 // 4):])
+
+    @staticmethod
+    def _recent_from_messages(session_pk):
+        messages = ChatMessage.objects.filter(session_id=session_pk).order_by('-created_at').values(
+            'message_uid', 'id', 'user_message', 'bot_response'
+        )[:RECENT_TURNS]
+        return [
+            _turn(msg['message_uid'] or msg['id'], msg['user_message'], msg['bot_response'])
+            for msg in reversed(list(messages))
+        ]
+
+
+conversation_summarizer = ConversationSummarizer()
@@ -0,0 +1,131 @@
+"""
+Framing between ChatService.stream_message and the HTTP response.
+
+LLM tokens are a few characters each, and a reply built in one piece can be
+several KB. Writing either one event or one character at a time costs a WSGI
+write, a proxy flush and a browser parse per piece. TokenCoalescer sends the
+first piece at once (so the first words appear without delay), then gathers
+text until CHAT_STREAM_CHUNK_SIZE characters or CHAT_STREAM_MAX_DELAY_MS have
+built up, cutting at the end of a sentence where it can, else at a word.
+Non-token events (status, cards, done) go out immediately, after any text
+gathered before them.
+
+gzip_stream() optionally compresses the framed stream, flushing the compressor
+after every chunk so compression never holds text back.
+"""
+from django.conf import settings
+import time
+import zlib
+
+# Preferred cut points, best first: end of a paragraph or sentence, then any whitespace
+_SENTENCE_ENDS = ('\n', '. ', '! ', '? ', '.\n', '!\n', '?\n')
+
+
+def _cut_point(text, limit):
+    """Index to cut text at, at most limit characters in"""
+    if len(text) <= limit:
+        window = text
+        if window.endswith(('.', '!', '?', '\n')):
+            return len(text)
+    else:
+        window = text[:limit]
+    ends = (window.rfind(end) for end in _SENTENCE_ENDS)
+    best = max((index + len(end) for index, end in zip(ends, _SENTENCE_ENDS) if index >= 0), default=0)
+    if best > limit // 4:
+        return best
+    space = window.rfind(' ') + 1
+    if space > limit // 4:
+        return space
+    return len(window)
+
+
+class TokenCoalescer:
+    """Gathers streamed text into chunks by size and age, cut at sentence boundaries"""
+
+    def __init__(self, chunk_size=None, max_delay=None):
+        self.chunk_size = max(1, chunk_size or settings.CHAT_STREAM_CHUNK_SIZE)
+        if max_delay is None:
+            max_delay = settings.CHAT_STREAM_MAX_DELAY_MS / 1000
+        self.max_delay = max_delay
+        self._pending = ''
+        self._since = None  # When the oldest pending text arrived
+        self._sent_any = False
+
+    def add(self, text):
+        """Buffer text; returns the chunks that should be sent now"""
+        if not text:
+            return []
+        if not self._pending:
+            self._since = time.monotonic()
+        self._pending += text
+        if not self._sent_any:
+            # The first words go out at once; perceived latency matters most here
+            return self.flush() if self.chunk_size > 1 else self._split()
+        if len(self._pending) >= self.chunk_size:
+            return self._split()
+        return self.due()
+
+    def due(self):
+        """Chunks whose time has come; call when no new text arrived for a while"""
+        if not self._pending or time.monotonic() - self._since < self.max_delay:
+            return []
+        cut = _cut_point(self._pending, len(self._pending))
+        return self._take(cut)
+
+    def flush(self):
+        """Everything still buffered, e.g. before another event or at the end of the reply"""
+        if not self._pending:
+            return []
+        if len(self._pending) > self.chunk_size:
+            return self._split(everything=True)
+        return self._take(len(self._pending))
+
+    def _split(self, everything=False):
+        chunks = []
+        while len(self._pending) >= self.chunk_size or (everything and self._pending):
+            chunks.extend(self._take(_cut_point(self._pending, self.chunk_size)))
+        return chunks
+
+    def _take(self, cut):
+        chunk, self._pending = self._pending[:cut], self._pending[cut:]
+        self._since = time.monotonic() if self._pending else None
+        self._sent_any = True
+        return [chunk] if chunk else []
+
+
+def frame_events(events, chunk_size=None, max_delay=None):
+    """Coalesce the token events of a ChatService.stream_message(poll=...) stream
+
+    'idle' events from the stream are consumed here to send text that has waited
+    long enough; every other event passes through unchanged.
+    """
+    coalescer = TokenCoalescer(chunk_size, max_delay)
+    for event, data in events:
+        if event == 'token':
+            chunks = coalescer.add(data['text'])
+        elif event == 'idle':
+            chunks = coalescer.due()
+        else:
+            chunks = coalescer.flush()
+        for text in chunks:
+            yield 'token', {'text': text}
+        if event not in ('token', 'idle'):
+            yield event, data
+    for text in coalescer.flush():
+        yield 'token', {'text': text}
+
+
+def gzip_stream(chunks, level=6):
+    """gzip-encode a stream of str or bytes, sync-flushing after every chunk"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31: gzip header and trailer
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush(zlib.Z_FINISH)
+
+
+def accepts_gzip(request):
+    return settings.CHAT_STREAM_GZIP and 'gzip' in request.headers.get('Accept-Encoding', '')
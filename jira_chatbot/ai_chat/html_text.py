@@ -0,0 +1,104 @@
+"""
+Plain-text extraction for Confluence storage-format HTML.
+
+The parser is incremental (feed() accepts chunks), drops markup, macro
+parameters and scripts, and keeps block structure as line breaks. Results
+are cached per page id and version so repeated views never re-parse.
+"""
+from html.parser import HTMLParser
+from .cache import get_cache
+from collections import namedtuple
+import hashlib
+import math
+import re
+
+ExtractedText = namedtuple('ExtractedText', ['text', 'tokens'])
+
+BLOCK_TAGS = {
+    'p', 'div', 'br', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'li', 'tr', 'table', 'ul', 'ol',
+    'pre', 'blockquote', 'hr', 'ac:structured-macro', 'ac:task',
+}
+SKIP_TAGS = {'script', 'style', 'ac:parameter', 'ac:placeholder', 'ri:attachment'}
+CELL_TAGS = {'td', 'th'}
+HIGHLIGHT_MARKERS = re.compile(r'@@@(end)?hl@@@')
+CACHE_TIMEOUT = 24 * 60 * 60
+
+cache = get_cache('confluence')
+
+
+class StorageTextExtractor(HTMLParser):
+    """Streaming HTML to text converter for Confluence storage format"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._parts = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in BLOCK_TAGS:
+            self._parts.append('\n')
+            if tag == 'li':
+                self._parts.append('- ')
+        elif tag in CELL_TAGS:
+            self._parts.append(' | ')
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in BLOCK_TAGS:
+            self._parts.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in BLOCK_TAGS:
+            self._parts.append('\n')
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self._parts.append(data)
+
+    def text(self):
+        """Return the text collected so far with whitespace normalized"""
+        self.close()
+        text = ''.join(self._parts)
+        text = re.sub(r'[ \t\r\f\v\xa0]+', ' ', text)
+        text = re.sub(r' *\n *', '\n', text)
+        text = re.sub(r'\n{3,}', '\n\n', text)
+        return text.strip()
+
+
+def estimate_tokens(text):
+    """Approximate LLM token count: roughly one token per 4 characters of a word, plus punctuation"""
+    return sum(math.ceil(len(piece) / 4) for piece in re.findall(r'\w+|[^\w\s]', text or ''))
+
+
+def extract_text(storage_html, page_id=None, version=None):
+    """Return ExtractedText for storage HTML, cached by page id and version when known"""
+    if page_id is not None and version is not None:
+        cache_key = f"confluence_text:{page_id}:{version}"
+    else:
+        digest = hashlib.sha1((storage_html or '').encode('utf-8')).hexdigest()
+        cache_key = f"confluence_text:sha1:{digest}"
+
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return ExtractedText(*cached)
+
+    parser = StorageTextExtractor()
+    parser.feed(HIGHLIGHT_MARKERS.sub('', storage_html or ''))
+    text = parser.text()
+    result = ExtractedText(text, estimate_tokens(text))
+    cache.set(cache_key, tuple(result), CACHE_TIMEOUT)
+    return result
+
+
+def truncate_tokens(text, max_tokens, ellipsis='...'):
+    """Cut plain text to about max_tokens on a word boundary, on one line for display"""
+    words = (text or '').split()
+    used = 0
+    for i, word in enumerate(words):
+        used += estimate_tokens(word)
+        if used > max_tokens:
+            return ' '.join(words[:i]) + ellipsis
+    return ' '.join(words)
@@ -0,0 +1,266 @@
+"""
+Pooled Jira clients: the shared service account plus one client per logged-in user.
+
+Building a JIRA client costs a serverInfo round trip and a new HTTP session,
+so clients are built once per process and reused. Per-user clients are kept
+in a bounded LRU keyed by UserJiraProfile: the least recently used client is
+closed when the pool is full, idle clients are closed after
+JIRA_POOL_IDLE_TIMEOUT, and each client holds at most
+JIRA_POOL_CONNECTIONS_PER_CLIENT sockets, so a process never keeps more than
+JIRA_POOL_MAX_CLIENTS x JIRA_POOL_CONNECTIONS_PER_CLIENT user connections
+open. Every client sends its requests through one shared token-bucket limiter.
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+from cryptography.fernet import Fernet, InvalidToken
+from django.conf import settings
+from functools import lru_cache
+from jira import JIRA
+from .metrics import InstrumentedAdapter
+import atexit
+import base64
+import hashlib
+import hmac
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+TOKEN_SESSION_KEY = 'jira_api_token'  # request.session key holding the encrypted token entered at login
+SERVICE_CONNECTIONS = 10  # Sockets for the service account client, shared by all request threads
+
+
+@lru_cache(maxsize=4)
+def _fernet(key):
+    if not key:
+        # Derived from SECRET_KEY when no dedicated key is configured
+        digest = hashlib.sha256(f"jira-session-token:{settings.SECRET_KEY}".encode()).digest()
+        key = base64.urlsafe_b64encode(digest)
+    return Fernet(key)
+
+
+def store_session_token(session, token):
+    """Keep a user's Jira token in their session, encrypted with JIRA_TOKEN_ENCRYPTION_KEY"""
+    session[TOKEN_SESSION_KEY] = _fernet(settings.JIRA_TOKEN_ENCRYPTION_KEY).encrypt(token.encode()).decode()
+
+
+def session_token(session):
+    """The Jira token stored at login, or None once it is older than JIRA_TOKEN_SESSION_TTL"""
+    encrypted = session.get(TOKEN_SESSION_KEY)
+    if not encrypted:
+        return None
+    try:
+        return _fernet(settings.JIRA_TOKEN_ENCRYPTION_KEY).decrypt(
+            encrypted.encode(), ttl=settings.JIRA_TOKEN_SESSION_TTL
+        ).decode()
+    except InvalidToken:
+        # Expired, encrypted with a replaced key, or stored in plaintext by an older release
+        del session[TOKEN_SESSION_KEY]
+        return None
+
+
+class TokenBucket:
+    """Thread-safe token bucket; acquire() blocks until a request may be sent"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class RateLimitedAdapter(InstrumentedAdapter):
+    """Timed Jira adapter with a fixed connection pool that waits for the shared limiter before each request"""
+
+    def __init__(self, limiter, pool_maxsize):
+        self.limiter = limiter
+        # pool_block keeps the socket count at pool_maxsize under concurrency
+        super().__init__('jira', pool_connections=1, pool_maxsize=pool_maxsize, pool_block=True)
+
+    def send(self, request, **kwargs):
+        self.limiter.acquire()
+        return super().send(request, **kwargs)
+
+
+class _Entry:
+    __slots__ = ('client', 'fingerprint', 'last_used', 'leases', 'retired')
+
+    def __init__(self, client, fingerprint):
+        self.client = client
+        self.fingerprint = fingerprint
+        self.last_used = time.monotonic()
+        self.leases = 0
+        self.retired = False
+
+
+class JiraClientPool:
+    """Process-wide Jira clients with an LRU of per-user clients"""
+
+    def __init__(self):
+        self._clients = OrderedDict()  # profile pk -> _Entry, least recently used first
+        self._lock = threading.Lock()
+        self._service = None
+        self._service_lock = threading.Lock()
+        self._limiter = None
+
+    @property
+    def limiter(self):
+        if self._limiter is None:
+            with self._lock:
+                if self._limiter is None:
+                    self._limiter = TokenBucket(settings.JIRA_RATE_LIMIT, settings.JIRA_RATE_BURST)
+        return self._limiter
+
+    def _mount(self, client, pool_maxsize):
+        adapter = RateLimitedAdapter(self.limiter, pool_maxsize)
+        client._session.mount('https://', adapter)
+        client._session.mount('http://', adapter)
+        return client
+
+    def service_client(self):
+        """The service account client, built on first use; raises if Jira cannot be reached"""
+        if self._service is None:
+            with self._service_lock:
+                if self._service is None:
+                    client = JIRA(
+                        server=settings.JIRA_SERVER,
+                        basic_auth=(settings.JIRA_USERNAME, settings.JIRA_API_TOKEN)
+                    )
+                    self._service = self._mount(client, SERVICE_CONNECTIONS)
+        return self._service
+
+    @contextmanager
+    def lease(self, profile, api_token):
+        """Yield the pooled client for a user's profile and API token"""
+        entry = self._checkout(profile, api_token)
+        try:
+            yield entry.client
+        finally:
+            self._checkin(entry)
+
+    def _checkout(self, profile, api_token):
+        fingerprint = hmac.new(settings.SECRET_KEY.encode('utf-8'), api_token.encode('utf-8'), hashlib.sha256).hexdigest()
+        retired = []
+        try:
+            with self._lock:
+                retired.extend(self._expire_idle())
+                entry = self._lease_pooled(profile.pk, fingerprint, retired)
+            if entry is None:
+                # Built outside the lock, so a slow or unreachable Jira never blocks other users
+                built = _Entry(self._build(profile, api_token), fingerprint)
+                with self._lock:
+                    entry = self._lease_pooled(profile.pk, fingerprint, retired)
+                    if entry is None:
+                        entry = built
+                        self._clients[profile.pk] = entry
+                        while len(self._clients) > settings.JIRA_POOL_MAX_CLIENTS:
+                            retired.append(self._retire(next(iter(self._clients))))
+                        entry.leases += 1
+                    else:
+                        # Another thread pooled a client for this user first; keep that one
+                        retired.append(built)
+        finally:
+            self._close(retired)
+        return entry
+
+    def _lease_pooled(self, key, fingerprint, retired):
+        """Lease the pooled client for a profile if its token still matches (lock held); None if there is none"""
+        entry = self._clients.get(key)
+        if entry is None:
+            return None
+        if entry.fingerprint != fingerprint:
+            # The user logged in again with a different token
+            retired.append(self._retire(key))
+            return None
+        self._clients.move_to_end(key)
+        entry.leases += 1
+        entry.last_used = time.monotonic()
+        return entry
+
+    def _checkin(self, entry):
+        with self._lock:
+            entry.leases -= 1
+            entry.last_used = time.monotonic()
+            closable = entry.retired and not entry.leases
+        if closable:
+            self._close([entry])
+
+    def _build(self, profile, api_token):
+        # No serverInfo call per user; the deployment type is the same for every account
+        client = JIRA(
+            server=profile.jira_server or settings.JIRA_SERVER,
+            basic_auth=(profile.jira_username, api_token),
+            get_server_info=False
+        )
+        if self._service is not None:
+            client.deploymentType = self._service.deploymentType
+        return self._mount(client, settings.JIRA_POOL_CONNECTIONS_PER_CLIENT)
+
+    def _retire(self, key):
+        """Remove an entry from the pool (lock held); returns it for closing"""
+        entry = self._clients.pop(key)
+        entry.retired = True
+        return entry
+
+    def _expire_idle(self):
+        """Retire clients unused for longer than JIRA_POOL_IDLE_TIMEOUT (lock held)"""
+        cutoff = time.monotonic() - settings.JIRA_POOL_IDLE_TIMEOUT
+        expired = []
+        # Oldest first, so stop at the first client that is still fresh
+        for key, entry in list(self._clients.items()):
+            if entry.last_used > cutoff:
+                break
+            if not entry.leases:
+                expired.append(self._retire(key))
+        return expired
+
+    def _close(self, entries):
+        """Close retired clients that are not in use; leased ones are closed at check-in"""
+        for entry in entries:
+            if entry.leases:
+                continue
+            try:
+                entry.client.close()
+            except Exception as e:
+                logger.warning(f"Failed to close pooled Jira client: {str(e)}")
+
+    def discard(self, profile_pk):
+        """Close a user's client, e.g. at logout"""
+        with self._lock:
+            entry = self._retire(profile_pk) if profile_pk in self._clients else None
+        if entry is not None:
+            self._close([entry])
+
+    def close_all(self):
+        with self._lock:
+            entries = [self._retire(key) for key in list(self._clients)]
+        self._close(entries)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'clients': len(self._clients),
+                'leased': sum(1 for entry in self._clients.values() if entry.leases),
+                'max_clients': settings.JIRA_POOL_MAX_CLIENTS,
+                'max_sockets': settings.JIRA_POOL_MAX_CLIENTS * settings.JIRA_POOL_CONNECTIONS_PER_CLIENT,
+            }
+
+
+jira_pool = JiraClientPool()
+atexit.register(jira_pool.close_all)
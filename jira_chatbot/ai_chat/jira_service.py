@@ -1,26 +1,95 @@
-from jira import JIRA
 from atlassian import Confluence
 from django.conf import settings
-from .models import JiraProject, JiraUser, JiraTicket, ConfluencePage
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from contextlib import nullcontext
+from .cache import get_cache
+from .html_text import extract_text, truncate_tokens
+from .jira_pool import jira_pool
+from .metrics import instrument_session
+from .models import JiraProject, JiraUser, JiraTicket, ConfluencePage, ConfluenceSyncState
+import hashlib
 import logging
+import re
 
 logger = logging.getLogger(__name__)
 
+class ConfluenceSpaceRegistry:
+    """Confluence space list in the shared cache, loaded once for all workers"""
+
+    cache_key = 'spaces'
+    refresh_key = 'spaces:miss-refresh'
+
+    def __init__(self, ttl=None, page_size=50):
+        self.ttl = ttl
+        self.page_size = page_size
+        self.cache = get_cache('confluence')
+
+    def get_spaces(self, confluence):
+        """Return {key: name} for all spaces, loading every page of results when stale"""
+        ttl = self.ttl if self.ttl is not None else settings.CONFLUENCE_SPACE_CACHE_TTL
+        return self.cache.get_or_set(self.cache_key, lambda: self._load(confluence), ttl)
+
+    def _load(self, confluence):
+        spaces = {}
+        start = 0
+        while True:
+            response = confluence.get_all_spaces(start=start, limit=self.page_size)
+            results = response.get('results', [])
+            for space in results:
+                spaces[space['key']] = space['name']
+            if len(results) < self.page_size:
+                break
+            start += self.page_size
+        logger.info(f"Loaded {len(spaces)} Confluence spaces")
+        return spaces
+
+    def has_space(self, confluence, space_key):
+        """Whether a space exists; a miss reloads the list once, at most every CONFLUENCE_SPACE_MISS_REFRESH seconds"""
+        if space_key in self.get_spaces(confluence):
+            return True
+        # The space may have been created since the list was loaded; one caller across workers reloads per interval
+        if not self.cache.add(self.refresh_key, True, settings.CONFLUENCE_SPACE_MISS_REFRESH):
+            return False
+        logger.info(f"Confluence space {space_key} not in the registry; reloading")
+        self.invalidate()
+        return space_key in self.get_spaces(confluence)
+
+    def invalidate(self):
+        """Force a reload on the next lookup"""
+        self.cache.delete(self.cache_key)
+
+
+def _status_code(error):
+    """HTTP status behind an atlassian-python-api error, which wraps the HTTPError in .reason"""
+    for candidate in (error, getattr(error, 'reason', None)):
+        response = getattr(candidate, 'response', None)
+        if response is not None:
+            return response.status_code
+    return None
+
+space_registry = ConfluenceSpaceRegistry()
+
+# Ticket search results; cleared after any ticket is created or changed
+jira_cache = get_cache('jira')
+
 class JiraService:
-    def __init__(self):
+    def __init__(self, user_profile=None, user_api_token=None):
         self.jira = None
         self.confluence = None
         self.jira_available = False
         self.confluence_available = False
+        # Ticket changes are made as this user when their API token is known
+        self.user_profile = user_profile if user_api_token else None
+        self.user_api_token = user_api_token
 
-        # Try to initialize JIRA connection
+        # Try to initialize JIRA connection (shared by every JiraService in the process)
         try:
-            self.jira = JIRA(
-                server=settings.JIRA_SERVER,
-                basic_auth=(settings.JIRA_USERNAME, settings.JIRA_API_TOKEN)
-            )
+            self.jira = jira_pool.service_client()
             self.jira_available = True
-            logger.info("JIRA connection established successfully")
+            logger.debug("JIRA connection established successfully")
         except Exception as e:
             logger.warning(f"Failed to connect to JIRA: {str(e)}")
             self.jira_available = False
@@ -32,12 +101,31 @@ class JiraService:
                 username=settings.CONFLUENCE_USERNAME,
                 password=settings.CONFLUENCE_API_TOKEN
             )
+            instrument_session(self.confluence.session, 'confluence')
             self.confluence_available = True
-            logger.info("Confluence connection established successfully")
+            logger.debug("Confluence connection established successfully")
         except Exception as e:
             logger.warning(f"Failed to connect to Confluence: {str(e)}")
             self.confluence_available = False
     
+    def _acting_client(self):
+        """Context manager yielding the user's pooled client, or the service account client"""
+        if self.user_profile:
+            return jira_pool.lease(self.user_profile, self.user_api_token)
+        return nullcontext(self.jira)
+
+    def find_account_id(self, email):
+        """Look up the Jira account ID for an email address, or None if there is no single match"""
+        if not self.jira_available or not email:
+            return None
+        try:
+            users = self.jira.search_users(query=email, maxResults=2)
+            if len(users) == 1:
+                return getattr(users[0], 'accountId', None)
+        except Exception as e:
+            logger.warning(f"Failed to look up Jira account for {email}: {str(e)}")
+        return None
+
     def sync_projects(self):
         """Sync Jira projects to database"""
         if not self.jira_available:
@@ -84,7 +172,8 @@ class JiraService:
                     issue_dict['assignee'] = {'emailAddress': assignee}
                     logger.info(f"Assigning ticket using email: {assignee}")
 
-            new_issue = self.jira.create_issue(fields=issue_dict)
+            with self._acting_client() as jira:
+                new_issue = jira.create_issue(fields=issue_dict)
 
             # Save to database
             project, created = JiraProject.objects.get_or_create(
@@ -101,6 +190,7 @@ class JiraService:
                 jira_id=new_issue.id,
                 created_by_chat=True
             )
+            jira_cache.clear()
 
             return ticket
         except Exception as e:
@@ -108,39 +198,74 @@ class JiraService:
             raise
     
     def search_tickets(self, query):
-        """Search for tickets"""
+        """Search for tickets; results are shared between workers until a ticket changes"""
         if not self.jira_available:
             logger.warning("JIRA not available, cannot search tickets")
             return []
 
+        cache_key = f"search:{hashlib.sha1(query.strip().lower().encode('utf-8')).hexdigest()}"
         try:
-            # Handle different search scenarios
-            if query == "*" or not query.strip():
-                # Search all tickets in SUP and KAN projects
-                jql = 'project in (SUP, KAN) ORDER BY updated DESC'
-            else:
-                # Search in summary, description, and comments
-                jql = f'(summary ~ "{query}" OR description ~ "{query}" OR comment ~ "{query}") AND project in (SUP, KAN) ORDER BY updated DESC'
+            return jira_cache.get_or_set(cache_key, lambda: self._search_tickets(query))
+        except Exception as e:
+            logger.error(f"Failed to search tickets: {str(e)}")
+            return []
 
-            issues = self.jira.search_issues(jql, maxResults=10)
+    def _search_tickets(self, query):
+        # Handle different search scenarios
+        if query == "*" or not query.strip():
+            # Search all tickets in SUP and KAN projects
+            jql = 'project in (SUP, KAN) ORDER BY updated DESC'
+        else:
+            # Search in summary, description, and comments
+            jql = f'(summary ~ "{query}" OR description ~ "{query}" OR comment ~ "{query}") AND project in (SUP, KAN) ORDER BY updated DESC'
+
+        issues = self.jira.search_issues(jql, maxResults=10)
+
+        results = []
+        for issue in issues:
+            results.append({
+                'key': issue.key,
+                'summary': issue.fields.summary,
+                'description': issue.fields.description or '',
+                'status': issue.fields.status.name,
+                'priority': issue.fields.priority.name if issue.fields.priority else 'Medium'
+            })
+
+        return results
+    
+    def get_resolved_tickets(self, max_results=500):
+        """Get resolved tickets with their comments, for the knowledge index"""
+        if not self.jira_available:
+            logger.warning("JIRA not available, cannot fetch resolved tickets")
+            return []
+
+        try:
+            jql = 'project in (SUP, KAN) AND statusCategory = Done ORDER BY updated DESC'
+            issues = self.jira.search_issues(jql, maxResults=max_results, fields='summary,description,comment')
 
             results = []
             for issue in issues:
+                comment_field = getattr(issue.fields, 'comment', None)
+                comments = [c.body for c in comment_field.comments] if comment_field else []
                 results.append({
+                    'id': issue.id,
                     'key': issue.key,
                     'summary': issue.fields.summary,
                     'description': issue.fields.description or '',
-                    'status': issue.fields.status.name,
-                    'priority': issue.fields.priority.name if issue.fields.priority else 'Medium'
+                    'comments': comments,
+                    'url': f"{settings.JIRA_SERVER}/browse/{issue.key}"
                 })
 
             return results
         except Exception as e:
-            logger.error(f"Failed to search tickets: {str(e)}")
+            logger.error(f"Failed to fetch resolved tickets: {str(e)}")
             return []
-    
+
     def search_confluence(self, query):
-        """Search Confluence pages"""
+        """Search Confluence pages, from the local mirror once it has been synced"""
+        if self.confluence_mirror_ready():
+            return self._search_confluence_mirror(query)
+
         if not self.confluence_available:
             logger.warning("Confluence not available, cannot search pages")
             return []
@@ -148,17 +273,22 @@ class JiraService:
         try:
             # Handle different query types
             if query == "*" or not query.strip():
-                # Get all pages using a broad search
-                results = self.confluence.cql('type=page')
+                # List pages in the configured spaces rather than the whole instance
+                cql = 'type=page'
+                if settings.CONFLUENCE_SYNC_SPACES:
+                    cql += f" and space in ({', '.join(settings.CONFLUENCE_SYNC_SPACES)})"
+                results = self.confluence.cql(cql)
             else:
                 # Search for specific content
                 results = self.confluence.cql(f'text ~ "{query}"')
 
             pages = []
             for result in results.get('results', []):
+                excerpt = extract_text(result.get('excerpt', ''))
                 pages.append({
                     'title': result['title'],
-                    'content': result.get('excerpt', ''),
+                    'content': excerpt.text,
+                    'tokens': excerpt.tokens,
                     'url': f"{settings.CONFLUENCE_SERVER}{result['url']}"
                 })
 
@@ -167,6 +297,141 @@ class JiraService:
             logger.error(f"Failed to search Confluence: {str(e)}")
             return []
 
+    def confluence_mirror_ready(self):
+        """Whether the configured spaces have been synced into ConfluencePage"""
+        if not settings.CONFLUENCE_SYNC_SPACES:
+            return False
+        return ConfluenceSyncState.objects.filter(
+            space_key__in=settings.CONFLUENCE_SYNC_SPACES,
+            last_synced_at__isnull=False
+        ).exists()
+
+    def _search_confluence_mirror(self, query, limit=25):
+        """Search the local ConfluencePage mirror instead of issuing live CQL"""
+        pages = ConfluencePage.objects.filter(space_key__in=settings.CONFLUENCE_SYNC_SPACES)
+
+        if query != "*" and query.strip():
+            words = [w for w in re.findall(r'\w+', query) if len(w) > 2] or [query.strip()]
+            condition = Q()
+            for word in words:
+                condition |= Q(title__icontains=word) | Q(content__icontains=word)
+            pages = pages.filter(condition)
+
+        results = []
+        for page in pages.order_by('-last_updated').only('title', 'content', 'url')[:limit]:
+            results.append({
+                'title': page.title,
+                'content': truncate_tokens(page.content, 120),
+                'url': f"{settings.CONFLUENCE_SERVER}{page.url}"
+            })
+        return results
+
+    def sync_confluence_pages(self, space_keys=None, full=False, batch_size=50):
+        """Incrementally mirror Confluence pages into ConfluencePage using a lastmodified keyset cursor"""
+        if not self.confluence_available:
+            logger.warning("Confluence not available, cannot sync pages")
+            return {}
+
+        stats = {}
+        for space_key in space_keys or settings.CONFLUENCE_SYNC_SPACES:
+            state, _ = ConfluenceSyncState.objects.get_or_create(space_key=space_key)
+            if full:
+                state.cursor = None
+
+            created = updated = unchanged = 0
+            # Pages are read from the start of the newest stored minute (CQL lastmodified has minute
+            # precision) rather than by offset, so edits during the sync cannot shift unread pages
+            # past the window. Versions already handled in this run are skipped on re-read.
+            seen = set()
+            limit = batch_size
+            try:
+                while True:
+                    cql = f'space = "{space_key}" and type = page'
+                    if state.cursor:
+                        cql += f' and lastmodified >= "{state.cursor:%Y/%m/%d %H:%M}"'
+                    cql += ' order by lastmodified asc, id asc'
+                    response = self.confluence.cql(
+                        cql, start=0, limit=limit,
+                        expand='content.body.storage,content.version,content.space'
+                    )
+                    results = [r['content'] for r in response.get('results', []) if r.get('content')]
+                    fresh = [r for r in results if (r['id'], r.get('version', {}).get('number', 1)) not in seen]
+                    if not fresh:
+                        if len(results) < limit:
+                            break
+                        # A whole batch inside one minute was already read; widen it to get past them
+                        limit *= 2
+                        continue
+
+                    counts = self._store_confluence_batch(space_key, fresh, state)
+                    created += counts[0]
+                    updated += counts[1]
+                    unchanged += counts[2]
+                    seen.update((r['id'], r.get('version', {}).get('number', 1)) for r in fresh)
+                    if len(results) < limit:
+                        break
+            except Exception as e:
+                logger.error(f"Failed to sync Confluence space {space_key}: {str(e)}")
+                stats[space_key] = {'error': str(e)}
+                continue
+
+            state.last_synced_at = timezone.now()
+            state.save()
+            stats[space_key] = {'created': created, 'updated': updated, 'unchanged': unchanged}
+            logger.info(f"Synced Confluence space {space_key}: {stats[space_key]}")
+
+        return stats
+
+    def _store_confluence_batch(self, space_key, results, state):
+        """Save one batch of CQL results and advance the sync cursor to the newest page stored"""
+        known = dict(ConfluencePage.objects.filter(
+            page_id__in=[r['id'] for r in results]
+        ).values_list('page_id', 'version'))
+
+        new_pages, changed_pages = [], []
+        unchanged = 0
+        cursor = state.cursor
+        for result in results:
+            version = result.get('version', {}).get('number', 1)
+            modified = parse_datetime(result.get('version', {}).get('when', ''))
+            if modified:
+                cursor = max(cursor, modified) if cursor else modified
+
+            if known.get(result['id']) == version:
+                unchanged += 1
+                continue
+
+            page = ConfluencePage(
+                page_id=result['id'],
+                title=result['title'][:255],
+                content=extract_text(
+                    result.get('body', {}).get('storage', {}).get('value', ''), result['id'], version
+                ).text,
+                space_key=space_key,
+                page_type=result.get('type', 'page'),
+                version=version,
+                url=result.get('_links', {}).get('webui', ''),
+                last_updated=modified or timezone.now(),
+            )
+            if result['id'] in known:
+                changed_pages.append(page)
+            else:
+                new_pages.append(page)
+
+        with transaction.atomic():
+            if new_pages:
+                ConfluencePage.objects.bulk_create(new_pages)
+            for page in changed_pages:
+                ConfluencePage.objects.filter(page_id=page.page_id).update(
+                    title=page.title, content=page.content, version=page.version,
+                    url=page.url, last_updated=page.last_updated
+                )
+            # Saved with the pages so a failed sync resumes after the last batch it stored
+            if cursor != state.cursor:
+                state.cursor = cursor
+                state.save(update_fields=['cursor'])
+        return len(new_pages), len(changed_pages), unchanged
+
     def create_confluence_page(self, space_key, title, content, parent_id=None):
         """Create a new Confluence page"""
         if not self.confluence_available:
@@ -184,18 +449,23 @@ class JiraService:
             )
 
             # Save to database
-            from django.utils import timezone
+            version = new_page.get('version', {}).get('number', 1)
             confluence_page = ConfluencePage.objects.create(
                 page_id=new_page['id'],
                 title=title,
-                content=content,
+                content=extract_text(content, new_page['id'], version).text,
                 space_key=space_key,
+                version=version,
+                url=new_page.get('_links', {}).get('webui', ''),
                 last_updated=timezone.now()
             )
 
             return confluence_page
         except Exception as e:
             logger.error(f"Failed to create Confluence page: {str(e)}")
+            if _status_code(e) == 404:
+                # Space not found: it may have been removed since the registry was loaded
+                space_registry.invalidate()
             raise
 
     def get_confluence_spaces(self):
@@ -204,44 +474,57 @@ class JiraService:
             return []
 
         try:
-            spaces = self.confluence.get_all_spaces(start=0, limit=50)
-            return [{'key': space['key'], 'name': space['name']} for space in spaces['results']]
+            spaces = space_registry.get_spaces(self.confluence)
+            return [{'key': key, 'name': name} for key, name in spaces.items()]
         except Exception as e:
             logger.error(f"Failed to get Confluence spaces: {str(e)}")
             return []
 
+    def has_confluence_space(self, space_key):
+        """Check whether a space exists, answered from the shared space registry"""
+        if not self.confluence_available:
+            return False
+
+        try:
+            return space_registry.has_space(self.confluence, space_key)
+        except Exception as e:
+            logger.error(f"Failed to get Confluence spaces: {str(e)}")
+            return False
+
     def update_ticket_status(self, ticket_key, new_status):
         """Update ticket status"""
         if not self.jira_available:
             raise Exception("JIRA is not available. Cannot update tickets.")
 
         try:
-            issue = self.jira.issue(ticket_key)
-            transitions = self.jira.transitions(issue)
-
-            # Find the transition that leads to the desired status
-            target_transition = None
-            for transition in transitions:
-                if transition['to']['name'].lower() == new_status.lower():
-                    target_transition = transition
-                    break
-
-            if not target_transition:
-                available_statuses = [t['to']['name'] for t in transitions]
-                raise Exception(f"Cannot transition to '{new_status}'. Available transitions: {', '.join(available_statuses)}")
-
-            # Perform the transition
-            self.jira.transition_issue(issue, target_transition['id'])
-
-            # Refresh the issue to get updated status
-            issue = self.jira.issue(ticket_key)
-            return {
-                'key': issue.key,
-                'summary': issue.fields.summary,
-                'old_status': issue.fields.status.name,
-                'new_status': new_status,
-                'success': True
-            }
+            with self._acting_client() as jira:
+                issue = jira.issue(ticket_key)
+                transitions = jira.transitions(issue)
+
+                # Find the transition that leads to the desired status
+                target_transition = None
+                for transition in transitions:
+                    if transition['to']['name'].lower() == new_status.lower():
+                        target_transition = transition
+                        break
+
+                if not target_transition:
+                    available_statuses = [t['to']['name'] for t in transitions]
+                    raise Exception(f"Cannot transition to '{new_status}'. Available transitions: {', '.join(available_statuses)}")
+
+                # Perform the transition
+                jira.transition_issue(issue, target_transition['id'])
+                jira_cache.clear()
+
+                # Refresh the issue to get updated status
+                issue = jira.issue(ticket_key)
+                return {
+                    'key': issue.key,
+                    'summary': issue.fields.summary,
+                    'old_status': issue.fields.status.name,
+                    'new_status': new_status,
+                    'success': True
+                }
 
         except Exception as e:
             logger.error(f"Failed to update ticket status: {str(e)}")
@@ -253,55 +536,57 @@ class JiraService:
             raise Exception("JIRA is not available. Cannot resolve tickets.")
 
         try:
-            issue = self.jira.issue(ticket_key)
-
-            # Assign ticket if assignee provided
-            if assignee:
-                try:
-                    # Check if assignee looks like an account ID
-                    if len(assignee) > 20 and assignee.replace('-', '').replace('_', '').isalnum():
-                        # This looks like an account ID, use it directly
-                        issue.update(assignee={'accountId': assignee})
-                        logger.info(f"Assigned ticket {ticket_key} to user with account ID: {assignee}")
-                    else:
-                        # This looks like an email, try email format
-                        issue.update(assignee={'emailAddress': assignee})
-                        logger.info(f"Assigned ticket {ticket_key} using email: {assignee}")
-                except Exception as e:
-                    logger.warning(f"Could not assign ticket {ticket_key} to {assignee}: {str(e)}")
-
-            transitions = self.jira.transitions(issue)
-
-            # Look for resolution transitions (common names)
-            resolution_transitions = []
-            for transition in transitions:
-                to_status = transition['to']['name'].lower()
-                if any(word in to_status for word in ['done', 'resolved', 'closed', 'complete', 'finished', 'klart']):
-                    resolution_transitions.append(transition)
-
-            if not resolution_transitions:
-                available_statuses = [t['to']['name'] for t in transitions]
-                raise Exception(f"No resolution transition found. Available transitions: {', '.join(available_statuses)}")
-
-            # Use the first resolution transition found
-            resolution_transition = resolution_transitions[0]
-
-            # Add comment if provided
-            if resolution_comment:
-                self.jira.add_comment(issue, resolution_comment)
-
-            # Perform the transition
-            self.jira.transition_issue(issue, resolution_transition['id'])
-
-            # Refresh the issue to get updated status
-            issue = self.jira.issue(ticket_key)
-            return {
-                'key': issue.key,
-                'summary': issue.fields.summary,
-                'status': issue.fields.status.name,
-                'resolution_comment': resolution_comment,
-                'success': True
-            }
+            with self._acting_client() as jira:
+                issue = jira.issue(ticket_key)
+
+                # Assign ticket if assignee provided
+                if assignee:
+                    try:
+                        # Check if assignee looks like an account ID
+                        if len(assignee) > 20 and assignee.replace('-', '').replace('_', '').isalnum():
+                            # This looks like an account ID, use it directly
+                            issue.update(assignee={'accountId': assignee})
+                            logger.info(f"Assigned ticket {ticket_key} to user with account ID: {assignee}")
+                        else:
+                            # This looks like an email, try email format
+                            issue.update(assignee={'emailAddress': assignee})
+                            logger.info(f"Assigned ticket {ticket_key} using email: {assignee}")
+                    except Exception as e:
+                        logger.warning(f"Could not assign ticket {ticket_key} to {assignee}: {str(e)}")
+
+                transitions = jira.transitions(issue)
+
+                # Look for resolution transitions (common names)
+                resolution_transitions = []
+                for transition in transitions:
+                    to_status = transition['to']['name'].lower()
+                    if any(word in to_status for word in ['done', 'resolved', 'closed', 'complete', 'finished', 'klart']):
+                        resolution_transitions.append(transition)
+
+                if not resolution_transitions:
+                    available_statuses = [t['to']['name'] for t in transitions]
+                    raise Exception(f"No resolution transition found. Available transitions: {', '.join(available_statuses)}")
+
+                # Use the first resolution transition found
+                resolution_transition = resolution_transitions[0]
+
+                # Add comment if provided
+                if resolution_comment:
+                    jira.add_comment(issue, resolution_comment)
+
+                # Perform the transition
+                jira.transition_issue(issue, resolution_transition['id'])
+                jira_cache.clear()
+
+                # Refresh the issue to get updated status
+                issue = jira.issue(ticket_key)
+                return {
+                    'key': issue.key,
+                    'summary': issue.fields.summary,
+                    'status': issue.fields.status.name,
+                    'resolution_comment': resolution_comment,
+                    'success': True
+                }
 
         except Exception as e:
             logger.error(f"Failed to resolve ticket: {str(e)}")
@@ -313,14 +598,16 @@ class JiraService:
             raise Exception("JIRA is not available. Cannot add comments.")
 
         try:
-            issue = self.jira.issue(ticket_key)
-            self.jira.add_comment(issue, comment)
-            return {
-                'key': issue.key,
-                'summary': issue.fields.summary,
-                'comment': comment,
-                'success': True
-            }
+            with self._acting_client() as jira:
+                issue = jira.issue(ticket_key)
+                jira.add_comment(issue, comment)
+                jira_cache.clear()
+                return {
+                    'key': issue.key,
+                    'summary': issue.fields.summary,
+                    'comment': comment,
+                    'success': True
+                }
         except Exception as e:
             logger.error(f"Failed to add comment: {str(e)}")
             raise
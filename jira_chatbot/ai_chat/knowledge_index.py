@@ -0,0 +1,301 @@
+"""
+Retrieval index over mirrored Confluence pages and resolved tickets.
+
+Text is chunked, embedded with the local Ollama embedding model and stored
+as unit-length float16 rows in a .npy matrix that is memory-mapped at query
+time. KnowledgeBase rows hold the chunk text and point at their matrix row.
+
+Every build writes its matrix under a new version name and tags its rows with
+that version. The "<KNOWLEDGE_INDEX_PATH>.current" pointer file is switched to
+the new version only once the rows are committed, and searches only return
+rows of the version whose matrix they scored, so a reader never pairs one
+build's vectors with another build's rows. A rolled back build leaves the
+current index untouched.
+"""
+from django.conf import settings
+from django.db import transaction
+from collections import Counter
+from .models import ConfluencePage, KnowledgeBase, JiraProject, JiraTicket, TicketSolution
+from .ollama_api import embed_texts
+from pathlib import Path
+import numpy as np
+import logging
+import os
+import re
+import threading
+import uuid
+
+logger = logging.getLogger(__name__)
+
+STOPWORDS = {
+    'the', 'and', 'for', 'with', 'that', 'this', 'from', 'are', 'was', 'not', 'you', 'your',
+    'have', 'has', 'but', 'can', 'will', 'when', 'then', 'into', 'after', 'before', 'they',
+    'their', 'there', 'which', 'should', 'would', 'could', 'been', 'does', 'did', 'all',
+}
+
+
+def chunk_text(text, max_words=180, overlap=30):
+    """Split text into overlapping chunks of roughly max_words, keeping paragraphs together"""
+    paragraphs = [p.split() for p in re.split(r'\n\s*\n', text or '') if p.strip()]
+    chunks = []
+    current = []
+    for words in paragraphs:
+        if current and len(current) + len(words) > max_words:
+            chunks.append(' '.join(current))
+            current = current[-overlap:] if overlap else []
+        current.extend(words)
+        while len(current) > max_words:
+            chunks.append(' '.join(current[:max_words]))
+            current = current[max_words - overlap:]
+    if current and (not chunks or len(current) > overlap):
+        chunks.append(' '.join(current))
+    return chunks
+
+
+def extract_keywords(text, limit=8):
+    """Most frequent non-trivial words, used for display and filtering"""
+    words = [w for w in re.findall(r'[a-zA-ZåäöÅÄÖ0-9-]{3,}', text.lower()) if w not in STOPWORDS]
+    return [word for word, _ in Counter(words).most_common(limit)]
+
+
+class KnowledgeIndex:
+    """Memory-mapped embedding matrix with vectorized top-k cosine search"""
+
+    block_rows = 4096  # Rows upcast to float32 per step; small blocks stay cache resident
+
+    def __init__(self, path=None):
+        self.path = path
+        self._matrix = None
+        self._version = None
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def _index_path(self):
+        return Path(self.path or settings.KNOWLEDGE_INDEX_PATH)
+
+    def _pointer_path(self):
+        path = self._index_path()
+        return path.with_name(f"{path.name}.current")
+
+    def _version_path(self, version):
+        path = self._index_path()
+        return path.with_name(f"{path.stem}.{version}{path.suffix}")
+
+    def current(self):
+        """Return (memory-mapped matrix, version) of the active build, reopening it after a rebuild"""
+        pointer = self._pointer_path()
+        try:
+            mtime = os.path.getmtime(pointer)
+        except OSError:
+            return self._legacy()
+        if self._matrix is None or mtime != self._mtime:
+            with self._lock:
+                if self._matrix is None or mtime != self._mtime:
+                    version = pointer.read_text().strip()
+                    self._matrix = np.load(self._version_path(version), mmap_mode='r')
+                    self._version = version
+                    self._mtime = mtime
+        return self._matrix, self._version
+
+    def _legacy(self):
+        """An index built before versioning: a single file whose rows have no version"""
+        path = self._index_path()
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None, None
+        if self._matrix is None or mtime != self._mtime:
+            with self._lock:
+                if self._matrix is None or mtime != self._mtime:
+                    self._matrix = np.load(path, mmap_mode='r')
+                    self._version = ''
+                    self._mtime = mtime
+        return self._matrix, self._version
+
+    def matrix(self):
+        return self.current()[0]
+
+    def search_vector(self, query_vector, k=5, matrix=None):
+        """Return [(row, score)] for the k rows with the highest cosine similarity"""
+        if matrix is None:
+            matrix = self.matrix()
+        if matrix is None or not len(matrix):
+            return []
+
+        query = np.asarray(query_vector, dtype=np.float32)
+        if query.shape != (matrix.shape[1],):
+            # Embedding model changed since the build; callers fall back to keyword search
+            logger.warning(
+                f"Query vector has shape {query.shape} but the knowledge index has {matrix.shape[1]} dimensions; "
+                f"rebuild it with build_knowledge_index"
+            )
+            return []
+        norm = np.linalg.norm(query)
+        if not norm:
+            return []
+        query /= norm
+
+        scores = np.empty(len(matrix), dtype=np.float32)
+        buffer = np.empty((min(self.block_rows, len(matrix)), matrix.shape[1]), dtype=np.float32)
+        for start in range(0, len(matrix), self.block_rows):
+            block = matrix[start:start + self.block_rows]
+            np.copyto(buffer[:len(block)], block)
+            np.matmul(buffer[:len(block)], query, out=scores[start:start + len(block)])
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(row), float(scores[row])) for row in top]
+
+    def search(self, query, k=5, min_score=None):
+        """Embed the query and return matching KnowledgeBase rows with their scores"""
+        matrix, version = self.current()
+        if matrix is None:
+            return []
+
+        min_score = settings.KNOWLEDGE_MIN_SCORE if min_score is None else min_score
+        try:
+            query_vector = embed_texts([query])[0]
+        except Exception as e:
+            logger.warning(f"Failed to embed knowledge query: {str(e)}")
+            return []
+
+        hits = [(row, score) for row, score in self.search_vector(query_vector, k, matrix) if score >= min_score]
+        if not hits:
+            return []
+
+        # Rows of a newer build committed since the matrix was opened are not these vectors
+        entries = KnowledgeBase.objects.filter(index_version=version).in_bulk(
+            [row for row, _ in hits], field_name='vector_row'
+        )
+        return [(entries[row], score) for row, score in hits if row in entries]
+
+    def write(self, vectors, version):
+        """Normalize and save a matrix under a version name; it is not searched until activate()"""
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if len(matrix):
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1
+            matrix /= norms
+        path = self._version_path(version)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.tmp.npy")
+        np.save(tmp_path, matrix.astype(np.float16))
+        os.replace(tmp_path, path)
+
+    def activate(self, version):
+        """Atomically switch searches to a written version and delete all but the previous matrix"""
+        pointer = self._pointer_path()
+        try:
+            previous = pointer.read_text().strip()
+        except OSError:
+            previous = None
+        tmp_pointer = pointer.with_name(f"{pointer.name}.tmp")
+        tmp_pointer.write_text(version)
+        os.replace(tmp_pointer, pointer)
+        with self._lock:
+            self._matrix = None
+
+        # Other workers may be about to open the previous version; anything older is unused
+        keep = {self._version_path(version)} | ({self._version_path(previous)} if previous else set())
+        path = self._index_path()
+        for old in path.parent.glob(f"{path.stem}.*{path.suffix}"):
+            if old not in keep and not old.name.endswith('.tmp.npy'):
+                old.unlink(missing_ok=True)
+        path.unlink(missing_ok=True)  # Unversioned index from before versioning
+
+    def discard(self, version):
+        """Delete the matrix of a build that was rolled back"""
+        self._version_path(version).unlink(missing_ok=True)
+
+
+knowledge_index = KnowledgeIndex()
+
+
+def _ticket_documents(jira_service, max_tickets):
+    """Yield (entry fields, text) for resolved tickets and record their solutions"""
+    for ticket in jira_service.get_resolved_tickets(max_results=max_tickets):
+        comments = [c for c in ticket['comments'] if c.strip()]
+        text = f"{ticket['summary']}\n\n{ticket['description']}"
+        if comments:
+            text += "\n\nResolution notes:\n\n" + "\n\n".join(comments)
+
+        project, _ = JiraProject.objects.get_or_create(
+            project_key=ticket['key'].split('-')[0],
+            defaults={'project_name': ticket['key'].split('-')[0], 'project_id': ticket['key'].split('-')[0]}
+        )
+        jira_ticket, _ = JiraTicket.objects.update_or_create(
+            ticket_key=ticket['key'],
+            defaults={
+                'project': project,
+                'summary': ticket['summary'][:255],
+                'description': ticket['description'],
+                'status': 'Done',
+                'jira_id': ticket['id'],
+            }
+        )
+        if comments:
+            TicketSolution.objects.update_or_create(
+                ticket=jira_ticket,
+                defaults={
+                    'solution_text': comments[-1],
+                    'steps_taken': comments,
+                    'tags': extract_keywords(text, limit=5),
+                }
+            )
+
+        yield {
+            'title': f"{ticket['key']}: {ticket['summary']}"[:255],
+            'source_type': 'ticket',
+            'source_id': ticket['key'],
+            'category': 'resolved_ticket',
+            'url': ticket['url'],
+        }, text
+
+
+def _confluence_documents():
+    """Yield (entry fields, text) for every mirrored Confluence page"""
+    for page in ConfluencePage.objects.only('page_id', 'title', 'content', 'url').iterator():
+        yield {
+            'title': page.title,
+            'source_type': 'confluence',
+            'source_id': page.page_id,
+            'category': 'documentation',
+            'url': f"{settings.CONFLUENCE_SERVER}{page.url}" if page.url else '',
+        }, f"{page.title}\n\n{page.content}"
+
+
+def build_knowledge_index(jira_service, max_tickets=500, batch_size=32, index=None):
+    """Rebuild KnowledgeBase rows and the embedding matrix from Confluence and resolved tickets"""
+    index = index or knowledge_index
+    documents = list(_confluence_documents())
+    if jira_service.jira_available:
+        documents.extend(_ticket_documents(jira_service, max_tickets))
+
+    entries = []
+    for fields, text in documents:
+        for chunk in chunk_text(text):
+            entries.append(KnowledgeBase(content=chunk, keywords=extract_keywords(chunk), **fields))
+
+    vectors = []
+    for start in range(0, len(entries), batch_size):
+        batch = entries[start:start + batch_size]
+        vectors.extend(embed_texts([entry.content for entry in batch]))
+
+    version = uuid.uuid4().hex
+    for row, entry in enumerate(entries):
+        entry.vector_row = row
+        entry.index_version = version
+
+    index.write(vectors, version)
+    try:
+        with transaction.atomic():
+            KnowledgeBase.objects.all().delete()
+            KnowledgeBase.objects.bulk_create(entries, batch_size=500)
+            transaction.on_commit(lambda: index.activate(version))
+    except Exception:
+        index.discard(version)
+        raise
+
+    logger.info(f"Built knowledge index with {len(entries)} chunks from {len(documents)} documents")
+    return {'documents': len(documents), 'chunks': len(entries)}
@@ -0,0 +1,118 @@
+"""
+Token and time accounting for every Ollama generation.
+
+ollama_api reads prompt and completion token counts and the load, prefill and
+eval durations from the final chunk of each stream and hands them to the
+current collector. ChatService collects the generations of one message and
+stores them with it: through the write-behind batch, so accounting adds no
+write to the request path. The summary thread stores its own generations as
+intent 'summary'. usage_rollup() aggregates the rows for the /api/llm-usage/
+endpoint and the llm_usage_report command.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.db.models import Count, Sum, F
+from django.utils import timezone
+from .models import LLMUsage
+import logging
+import uuid
+
+logger = logging.getLogger(__name__)
+
+GROUPS = {
+    'user': ('user_id', 'user__username'),
+    'session': ('session_id', 'session__session_id'),
+    'intent': ('intent', None),
+    'model': ('model', None),
+}
+
+_current_usage = ContextVar('llm_usage', default=None)
+
+
+@contextmanager
+def collect_usage():
+    """Collect the usage of every generation made inside the block into a list"""
+    usage = []
+    token = _current_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _current_usage.reset(token)
+
+
+def record_generation(final):
+    """Add the counts and timings of a finished generation to the current collector"""
+    usage = _current_usage.get()
+    if usage is None or final is None:
+        return
+    # Ollama reports durations in nanoseconds
+    usage.append({
+        'model': final.get('model') or '',
+        'prompt_tokens': final.get('prompt_eval_count') or 0,
+        'completion_tokens': final.get('eval_count') or 0,
+        'load_ms': (final.get('load_duration') or 0) / 1e6,
+        'prefill_ms': (final.get('prompt_eval_duration') or 0) / 1e6,
+        'eval_ms': (final.get('eval_duration') or 0) / 1e6,
+        'total_ms': (final.get('total_duration') or 0) / 1e6,
+    })
+
+
+def usage_rows(usage, session_id, user_id, intent, message_uid=None, created_at=None):
+    """Unsaved LLMUsage rows for collected generations"""
+    return [
+        LLMUsage(
+            session_id=session_id,
+            user_id=user_id,
+            intent=intent,
+            message_uid=uuid.UUID(str(message_uid)) if message_uid else None,
+            sequence=sequence,
+            created_at=created_at or timezone.now(),
+            **generation
+        )
+        for sequence, generation in enumerate(usage)
+    ]
+
+
+def save_usage(usage, session_id, user_id, intent):
+    """Store generations made outside a chat message, e.g. by the summary thread"""
+    if not usage:
+        return
+    try:
+        LLMUsage.objects.bulk_create(usage_rows(usage, session_id, user_id, intent))
+    except Exception as e:
+        logger.warning(f"Failed to store LLM usage for session {session_id}: {str(e)}")
+
+
+def usage_rollup(since, until=None, group_by='user', limit=20):
+    """Usage per user, session, intent or model since a time, most LLM time first"""
+    key, label = GROUPS[group_by]
+    rows = LLMUsage.objects.filter(created_at__gte=since)
+    if until:
+        rows = rows.filter(created_at__lt=until)
+
+    fields = [key, label] if label else [key]
+    rows = rows.values(*fields).annotate(
+        generations=Count('id'),
+        prompt_tokens=Sum('prompt_tokens'),
+        completion_tokens=Sum('completion_tokens'),
+        load_ms=Sum('load_ms'),
+        prefill_ms=Sum('prefill_ms'),
+        eval_ms=Sum('eval_ms'),
+        total_ms=Sum('total_ms'),
+    ).order_by(F('total_ms').desc(nulls_last=True))[:limit]
+
+    results = []
+    for row in rows:
+        eval_ms = row['eval_ms'] or 0
+        results.append({
+            'key': row[key],
+            'label': row[label] if label else row[key],
+            'generations': row['generations'],
+            'prompt_tokens': row['prompt_tokens'] or 0,
+            'completion_tokens': row['completion_tokens'] or 0,
+            'llm_seconds': round((row['total_ms'] or 0) / 1000, 3),
+            'load_seconds': round((row['load_ms'] or 0) / 1000, 3),
+            'prefill_seconds': round((row['prefill_ms'] or 0) / 1000, 3),
+            'tokens_per_second': round(row['completion_tokens'] / (eval_ms / 1000), 1) if eval_ms else None,
+        })
+    return results
@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from ai_chat.archive import archive_sessions, default_codec, zstandard
+
+
+class Command(BaseCommand):
+    help = (
+        "Move messages of chat sessions idle for longer than CHAT_ARCHIVE_AFTER_DAYS into compressed "
+        "ArchivedChatSession rows, keeping the sessions as stubs for the sidebar"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help="Idle age in days (default: CHAT_ARCHIVE_AFTER_DAYS)")
+        parser.add_argument('--chunk-size', type=int, default=100, help="Sessions archived per transaction")
+        parser.add_argument('--limit', type=int, default=None, help="Archive at most this many sessions")
+        parser.add_argument('--codec', choices=['zstd', 'gzip'], default=None, help="Default: zstd if installed, else gzip")
+        parser.add_argument('--vacuum', action='store_true', help="Compact the database file afterwards")
+
+    def handle(self, *args, **options):
+        if options['codec'] == 'zstd' and zstandard is None:
+            raise CommandError("The zstd codec requires the zstandard package")
+
+        days = options['days'] if options['days'] is not None else settings.CHAT_ARCHIVE_AFTER_DAYS
+        stats = archive_sessions(
+            days,
+            chunk_size=options['chunk_size'],
+            codec=options['codec'] or default_codec(),
+            limit=options['limit'],
+        )
+
+        ratio = stats['raw_bytes'] / stats['stored_bytes'] if stats['stored_bytes'] else 0
+        self.stdout.write(
+            f"Archived {stats['messages']} messages from {stats['sessions']} sessions idle for over {days} days "
+            f"({stats['raw_bytes']} bytes of JSON stored as {stats['stored_bytes']} with {stats['codec']}, {ratio:.1f}x)"
+        )
+
+        if options['vacuum'] and stats['sessions']:
+            with connection.cursor() as cursor:
+                if connection.vendor == 'sqlite':
+                    cursor.execute('VACUUM')
+                elif connection.vendor == 'postgresql':
+                    cursor.execute('VACUUM ANALYZE ai_chat_chatmessage')
+            self.stdout.write("Database compacted")
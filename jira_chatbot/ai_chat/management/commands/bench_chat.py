@@ -0,0 +1,251 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.db import connection, connections
+from django.test.utils import (
+    setup_test_environment, teardown_test_environment, setup_databases, teardown_databases,
+    override_settings, CaptureQueriesContext,
+)
+from unittest import mock
+from ai_chat.chat_service import ChatService
+from ai_chat.conversation_summary import conversation_summarizer
+from ai_chat.jira_pool import jira_pool
+from ai_chat.jira_service import JiraService
+from ai_chat.knowledge_index import build_knowledge_index
+from ai_chat.standin.fakes import FakeJira, FakeConfluence, FakeOllama
+from ai_chat.standin.server import FixtureStore, StandinConfig
+from ai_chat.write_behind import write_behind
+from jiraAuth.models import UserJiraProfile
+from pathlib import Path
+import json
+import logging
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+# A few phrasings per intent, so not every message is a cache hit
+INTENT_MESSAGES = {
+    'get_ticket_details': ["Show me SUP-1", "What is KAN-1 about?", "Details for SUP-5 please"],
+    'search_tickets': ["Search tickets about printer", "Find issues with wifi", "Search tickets for network access"],
+    'search_knowledge': ["How do I fix the windows login?", "Help with a microsoft 365 password reset", "Printer problem after an update"],
+    'create_ticket': ["Create a ticket for my broken HDMI monitor", "Create a new issue: printer is blurry", "New ticket for the wifi outage"],
+    'resolve_ticket': ["Resolve SUP-1", "Close SUP-2, it works now", "Resolve KAN-1"],
+    'bulk_close_tickets': ["Close all tickets related to printer", "Resolve all issues about wifi"],
+    'general_chat': ["Hello there", "Thanks, that was useful", "Good morning"],
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark ChatService.process_message per intent against in-process fake Jira, Confluence "
+        "and Ollama clients; reports throughput, p50/p95/p99 latency, queries and allocations per "
+        "message, and fails on regressions against a saved baseline"
+    )
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=100, help="Timed messages per intent")
+        parser.add_argument('--warmup', type=int, default=5, help="Untimed messages per intent first")
+        parser.add_argument('--intents', nargs='+', choices=sorted(INTENT_MESSAGES), help="Only these intents")
+        parser.add_argument('--sessions', type=int, default=10, help="Chat sessions the messages rotate over")
+        parser.add_argument('--alloc-samples', type=int, default=10, help="Messages per intent run under tracemalloc")
+        parser.add_argument('--atlassian-latency-ms', type=float, default=0, help="Added latency per Jira/Confluence call")
+        parser.add_argument('--jitter-ms', type=float, default=0)
+        parser.add_argument('--first-token-ms', type=float, default=0, help="LLM delay before the first token")
+        parser.add_argument('--token-latency-ms', type=float, default=0, help="LLM delay between tokens")
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--save', help="Write the results as JSON, e.g. to use as a baseline")
+        parser.add_argument('--compare', help="Baseline JSON; exit non-zero if an intent regressed")
+        parser.add_argument(
+            '--gate', choices=['p50', 'p95', 'p99'], default='p50',
+            help="Latency percentile compared with the baseline (p50 is the least noisy on shared CI runners)"
+        )
+        parser.add_argument('--threshold', type=float, default=0.5, help="Allowed relative increase in latency and allocations")
+        parser.add_argument('--min-delta-ms', type=float, default=2.0, help="Ignore latency increases smaller than this")
+
+    def handle(self, *args, **options):
+        tmp_dir = Path(tempfile.mkdtemp(prefix='bench-chat-'))
+        if connection.vendor == 'sqlite':
+            # The write-behind and summary threads need a shared on-disk database
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = str(tmp_dir / 'bench.sqlite3')
+
+        config = StandinConfig(
+            latency_ms=options['atlassian_latency_ms'],
+            jitter_ms=options['jitter_ms'],
+            first_token_ms=options['first_token_ms'],
+            token_latency_ms=options['token_latency_ms'],
+            seed=options['seed'],
+        )
+        store = FixtureStore()
+        fake_jira = FakeJira(store, config)
+        fake_ollama = FakeOllama(store, config)
+
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        # Ticket changes log at INFO for every message; keep the report readable
+        logging.disable(logging.INFO)
+        try:
+            with override_settings(
+                CACHES=self._local_caches(),
+                CHAT_WRITE_BEHIND_DIR=tmp_dir / 'write_behind',
+                KNOWLEDGE_INDEX_PATH=tmp_dir / 'knowledge_index.npy',
+                CONFLUENCE_SYNC_SPACES=['ITSUPPORT'],
+            ), mock.patch.object(jira_pool, 'service_client', return_value=fake_jira), \
+                    mock.patch('ai_chat.jira_service.Confluence', lambda **kwargs: FakeConfluence(store, config)), \
+                    mock.patch('ai_chat.ollama_api.get_client', return_value=fake_ollama):
+                self._prepare()
+                results = self._run(options)
+                write_behind.stop()
+                conversation_summarizer.drain()
+        finally:
+            logging.disable(logging.NOTSET)
+            connections.close_all()
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        report = {
+            'vendor': connection.vendor,
+            'options': {key: options[key] for key in (
+                'iterations', 'warmup', 'intents', 'sessions', 'atlassian_latency_ms', 'first_token_ms', 'token_latency_ms'
+            )},
+            'intents': results,
+        }
+        if options['save']:
+            with open(options['save'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Saved results to {options['save']}")
+        if options['compare']:
+            self._compare(report, options)
+
+    def _local_caches(self):
+        """In-memory copies of the cache aliases, so runs neither read nor pollute the shared cache"""
+        return {
+            alias: {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': f"bench-chat-{alias}",
+                'TIMEOUT': config.get('TIMEOUT', 300),
+                'OPTIONS': {'MAX_ENTRIES': config.get('OPTIONS', {}).get('MAX_ENTRIES', 1000)},
+            }
+            for alias, config in settings.CACHES.items()
+        }
+
+    def _prepare(self):
+        """Mirror the fixture Confluence pages and build a knowledge index, as in production"""
+        jira_service = JiraService()
+        jira_service.sync_confluence_pages()
+        stats = build_knowledge_index(jira_service)
+        self.stdout.write(f"Knowledge index: {stats['chunks']} chunks from {stats['documents']} documents")
+
+        self.user = User.objects.create(username='bench-chat', email='agent@example.com')
+        UserJiraProfile.objects.create(
+            user=self.user, jira_username='agent@example.com', jira_server=settings.JIRA_SERVER or ''
+        )
+
+    def _run(self, options):
+        intents = options['intents'] or list(INTENT_MESSAGES)
+        detector = ChatService.__new__(ChatService)
+        results = {}
+
+        self.stdout.write(f"{'intent':20} {'msg/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>8} {'alloc KiB':>10}")
+        for intent in intents:
+            messages = INTENT_MESSAGES[intent]
+            for message in messages:
+                if detector._detect_intent(message) != intent:
+                    raise CommandError(f"Benchmark message {message!r} is not detected as {intent}")
+
+            def send(i):
+                session_id = f"bench-{intent}-{i % options['sessions']}"
+                chat_service = ChatService(session_id, user=self.user, auto_assign=True)
+                chat_service.process_message(messages[i % len(messages)])
+
+            for i in range(options['warmup']):
+                send(i)
+
+            timings, queries = [], []
+            started = time.perf_counter()
+            for i in range(options['iterations']):
+                with CaptureQueriesContext(connection) as captured:
+                    message_started = time.perf_counter()
+                    send(i)
+                    timings.append((time.perf_counter() - message_started) * 1000)
+                queries.append(len(captured.captured_queries))
+            elapsed = time.perf_counter() - started
+
+            results[intent] = dict(
+                self._percentiles(timings),
+                throughput=options['iterations'] / elapsed,
+                queries=statistics.mean(queries),
+                alloc_kib=self._allocations(send, options['alloc_samples']),
+            )
+            r = results[intent]
+            self.stdout.write(
+                f"{intent:20} {r['throughput']:8.1f} {r['p50_ms']:9.2f} {r['p95_ms']:9.2f} "
+                f"{r['p99_ms']:9.2f} {r['queries']:8.1f} {r['alloc_kib']:10.1f}"
+            )
+        return results
+
+    def _allocations(self, send, samples):
+        """Median peak traced memory per message, measured separately so latency is not skewed"""
+        if not samples:
+            return 0.0
+        peaks = []
+        tracemalloc.start()
+        try:
+            for i in range(samples):
+                # tracemalloc sees every thread; let the summary worker go idle first
+                conversation_summarizer.drain()
+                tracemalloc.reset_peak()
+                baseline = tracemalloc.get_traced_memory()[0]
+                send(i)
+                peaks.append((tracemalloc.get_traced_memory()[1] - baseline) / 1024)
+        finally:
+            tracemalloc.stop()
+        return statistics.median(peaks)
+
+    def _percentiles(self, timings):
+        timings = sorted(timings)
+
+        def pick(fraction):
+            return timings[min(len(timings) - 1, max(0, int(round(len(timings) * fraction)) - 1))]
+
+        return {'p50_ms': statistics.median(timings), 'p95_ms': pick(0.95), 'p99_ms': pick(0.99)}
+
+    def _compare(self, report, options):
+        try:
+            with open(options['compare'], encoding='utf-8') as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Cannot read baseline {options['compare']}: {e}")
+
+        regressions = []
+        self.stdout.write(f"\nCompared with {options['compare']}:")
+        if baseline.get('options') != report['options']:
+            self.stdout.write(self.style.WARNING(f"Baseline was run with different options: {baseline.get('options')}"))
+        for intent, current in report['intents'].items():
+            before = baseline.get('intents', {}).get(intent)
+            if not before:
+                self.stdout.write(f"{intent:20} (not in baseline)")
+                continue
+
+            problems = []
+            key = f"{options['gate']}_ms"
+            if (current[key] > before[key] * (1 + options['threshold'])
+                    and current[key] - before[key] > options['min_delta_ms']):
+                problems.append(f"{options['gate']} {before[key]:.2f} -> {current[key]:.2f} ms")
+            if current['queries'] > before['queries'] + 0.5:
+                problems.append(f"queries {before['queries']:.1f} -> {current['queries']:.1f}")
+            if before['alloc_kib'] and current['alloc_kib'] > before['alloc_kib'] * (1 + options['threshold']):
+                problems.append(f"alloc {before['alloc_kib']:.0f} -> {current['alloc_kib']:.0f} KiB")
+
+            if problems:
+                regressions.append(f"{intent}: {', '.join(problems)}")
+                self.stdout.write(self.style.ERROR(f"{intent:20} {'; '.join(problems)}"))
+            else:
+                change = (current[key] / before[key] - 1) * 100 if before[key] else 0
+                self.stdout.write(self.style.SUCCESS(f"{intent:20} ok ({options['gate']} {change:+.0f}%)"))
+
+        if regressions:
+            raise CommandError("Chat benchmark regressed: " + "; ".join(regressions))
@@ -0,0 +1,94 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment, setup_databases, teardown_databases
+from ai_chat.models import ChatSession, ChatMessage
+from ai_chat.query_plans import hot_queries, uses_index
+from ai_chat.session_listing import build_session_listing
+import random
+import statistics
+import time
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway test database with chat data and report the latency and EXPLAIN "
+        "index usage of the hot chat queries (asserted by the ai_chat query plan tests)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=100000, help="Total ChatMessage rows to seed (e.g. 1000000)")
+        parser.add_argument('--sessions', type=int, default=2000)
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=200, help="Timed executions per query")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            self._seed(options)
+            self._run(options)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+    def _seed(self, options):
+        started = time.perf_counter()
+        users = User.objects.bulk_create([User(username=f"bench-{i}") for i in range(options['users'])])
+        sessions = ChatSession.objects.bulk_create([
+            ChatSession(session_id=f"bench-{i}", user=users[i % len(users)])
+            for i in range(options['sessions'])
+        ], batch_size=1000)
+
+        rng = random.Random(1)
+        batch = []
+        for i in range(options['messages']):
+            batch.append(ChatMessage(
+                session=sessions[rng.randrange(len(sessions))],
+                user_message=f"Benchmark question {i}",
+                bot_response="Benchmark answer",
+            ))
+            if len(batch) == 5000:
+                ChatMessage.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            ChatMessage.objects.bulk_create(batch)
+
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute('ANALYZE')
+            elif connection.vendor == 'postgresql':
+                cursor.execute('ANALYZE ai_chat_chatmessage; ANALYZE ai_chat_chatsession')
+
+        self.stdout.write(
+            f"Seeded {options['messages']} messages in {options['sessions']} sessions "
+            f"({time.perf_counter() - started:.1f}s, {connection.vendor})"
+        )
+
+    def _run(self, options):
+        session = ChatSession.objects.order_by('?').first()
+        user = session.user
+
+        for name, index_name, build in hot_queries(session, user):
+            index_used, plan = uses_index(build(), index_name)
+            timings = self._time(lambda: list(build()), options['repeat'])
+            status = self.style.SUCCESS('uses') if index_used else self.style.ERROR('MISSES')
+            self.stdout.write(f"{name:18} {status} {index_name}  {self._format(timings)}")
+            if options['verbosity'] > 1:
+                self.stdout.write(f"    {plan}")
+
+        timings = self._time(lambda: build_session_listing(user), options['repeat'])
+        self.stdout.write(f"{'sidebar listing':18} annotated query  {self._format(timings)}")
+
+    def _time(self, func, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - started) * 1000)
+        return timings
+
+    def _format(self, timings):
+        timings = sorted(timings)
+        p95 = timings[int(len(timings) * 0.95) - 1] if len(timings) > 1 else timings[0]
+        return f"p50 {statistics.median(timings):.3f} ms  p95 {p95:.3f} ms"
@@ -0,0 +1,108 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from django.db import connection, connections, transaction, OperationalError
+from django.test.utils import setup_test_environment, teardown_test_environment, setup_databases, teardown_databases
+from django.utils import timezone
+from ai_chat.models import ChatSession, ChatMessage
+from concurrent.futures import ThreadPoolExecutor
+import statistics
+import tempfile
+import threading
+import time
+import os
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark concurrent chat writers (ChatMessage insert + ChatSession.last_activity update) "
+        "against the configured database profile, using a throwaway test database"
+    )
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8, help="Concurrent writer threads")
+        parser.add_argument('--messages', type=int, default=200, help="Messages written per writer")
+        parser.add_argument('--sessions', type=int, default=50)
+        parser.add_argument('--read-ratio', type=float, default=1.0, help="Context reads per write")
+        parser.add_argument(
+            '--baseline', action='store_true',
+            help="SQLite only: drop the tuned OPTIONS to compare against default journaling"
+        )
+
+    def handle(self, *args, **options):
+        settings_dict = connection.settings_dict
+        if connection.vendor == 'sqlite':
+            # Threads need a shared on-disk database rather than the default in-memory test database
+            tmp_dir = tempfile.mkdtemp(prefix='bench-db-')
+            settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(tmp_dir, 'bench.sqlite3')
+            if options['baseline']:
+                settings_dict['OPTIONS'] = {}
+
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            self._run(options)
+        finally:
+            connections.close_all()
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+    def _run(self, options):
+        user = User.objects.create(username='bench-writer')
+        sessions = ChatSession.objects.bulk_create([
+            ChatSession(session_id=f"bench-{i}", user=user) for i in range(options['sessions'])
+        ])
+        session_ids = [s.pk for s in sessions]
+
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+
+        def writer(worker):
+            local_latencies = []
+            local_errors = 0
+            try:
+                for i in range(options['messages']):
+                    session_id = session_ids[(worker * options['messages'] + i) % len(session_ids)]
+                    started = time.perf_counter()
+                    try:
+                        reads = int(options['read_ratio']) + (1 if (i % 10) / 10 < options['read_ratio'] % 1 else 0)
+                        for _ in range(reads):
+                            list(ChatMessage.objects.filter(session_id=session_id).order_by('-created_at')[:5])
+                        with transaction.atomic():
+                            ChatMessage.objects.create(
+                                session_id=session_id,
+                                user_message=f"Writer {worker} message {i}",
+                                bot_response="Benchmark response",
+                                intent_detected='general_chat'
+                            )
+                            ChatSession.objects.filter(pk=session_id).update(last_activity=timezone.now())
+                    except OperationalError:
+                        local_errors += 1
+                    local_latencies.append((time.perf_counter() - started) * 1000)
+            finally:
+                connections.close_all()
+            with lock:
+                latencies.extend(local_latencies)
+                errors.append(local_errors)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['writers']) as executor:
+            list(executor.map(writer, range(options['writers'])))
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        total = len(latencies)
+        profile = connection.vendor
+        if profile == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                profile += f" (journal_mode={cursor.fetchone()[0]})"
+        self.stdout.write(f"Database: {profile}")
+        self.stdout.write(f"Writers: {options['writers']} x {options['messages']} messages")
+        self.stdout.write(f"Throughput: {total / elapsed:.0f} writes/s over {elapsed:.2f}s")
+        self.stdout.write(
+            f"Latency: p50 {statistics.median(latencies):.2f} ms  "
+            f"p95 {latencies[int(total * 0.95) - 1]:.2f} ms  p99 {latencies[int(total * 0.99) - 1]:.2f} ms"
+        )
+        self.stdout.write(f"'database is locked' / operational errors: {sum(errors)}")
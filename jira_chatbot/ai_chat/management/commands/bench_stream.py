@@ -0,0 +1,217 @@
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import (
+    setup_test_environment, teardown_test_environment, setup_databases, teardown_databases, override_settings,
+)
+from unittest import mock
+from urllib.parse import urlencode
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+from ai_chat.conversation_summary import conversation_summarizer
+from ai_chat.jira_pool import jira_pool
+from ai_chat.standin.fakes import FakeJira, FakeConfluence, FakeOllama
+from ai_chat.standin.server import FixtureStore, StandinConfig
+from ai_chat.write_behind import write_behind
+from jiraAuth.models import UserJiraProfile
+from pathlib import Path
+import http.client
+import json
+import logging
+import queue
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+import zlib
+
+# general_chat streams LLM tokens; get_ticket_details sends its reply in one piece
+MESSAGES = {
+    'general_chat': "Hello there",
+    'get_ticket_details': "Show me SUP-1",
+}
+
+# How the reply is written out: one character at a time as before, coalesced, or coalesced and gzipped
+MODES = {
+    'per-char': {'CHAT_STREAM_CHUNK_SIZE': 1, 'CHAT_STREAM_MAX_DELAY_MS': 0, 'CHAT_STREAM_GZIP': False},
+    'coalesced': {'CHAT_STREAM_GZIP': False},
+    'coalesced+gzip': {'CHAT_STREAM_GZIP': True},
+}
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class _MeasuredApp:
+    """WSGI wrapper recording the serving thread's CPU time and body writes per response"""
+
+    def __init__(self, app):
+        self.app = app
+        self.samples = queue.Queue()
+
+    def __call__(self, environ, start_response):
+        started = time.thread_time()
+        writes = 0
+        result = self.app(environ, start_response)
+        try:
+            for chunk in result:
+                if chunk:
+                    writes += 1
+                    # The server writes the chunk to the socket before asking for the next one
+                    yield chunk
+        finally:
+            result.close()
+            self.samples.put({'cpu_ms': (time.thread_time() - started) * 1000, 'writes': writes})
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark how chat replies are written out: server CPU per response and the latency a user "
+        "perceives, with per-character, coalesced and gzipped framing, against in-process fakes"
+    )
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20, help="Timed replies per mode and intent")
+        parser.add_argument('--warmup', type=int, default=2, help="Untimed replies per mode and intent first")
+        parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES))
+        parser.add_argument('--intents', nargs='+', choices=list(MESSAGES), default=list(MESSAGES))
+        parser.add_argument('--protocol', choices=['plain', 'sse'], default='plain', help="text/plain or server-sent events")
+        parser.add_argument('--reply-chars', type=int, default=4000, help="Length the fixture LLM replies are padded to")
+        parser.add_argument('--first-token-ms', type=float, default=0, help="LLM delay before the first token")
+        parser.add_argument('--token-latency-ms', type=float, default=2, help="LLM delay between tokens")
+        parser.add_argument('--json', action='store_true', help="Print JSON instead of a table")
+
+    def handle(self, *args, **options):
+        tmp_dir = Path(tempfile.mkdtemp(prefix='bench-stream-'))
+        if connection.vendor == 'sqlite':
+            # The stream, write-behind and summary threads need a shared on-disk database
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = str(tmp_dir / 'bench.sqlite3')
+
+        config = StandinConfig(first_token_ms=options['first_token_ms'], token_latency_ms=options['token_latency_ms'])
+        store = FixtureStore()
+        fixture_completion = store.completion_for
+        store.completion_for = lambda prompt: _padded(fixture_completion(prompt), options['reply_chars'])
+        fake_jira = FakeJira(store, config)
+        fake_ollama = FakeOllama(store, config)
+
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        logging.disable(logging.INFO)
+        try:
+            with override_settings(
+                CACHES={alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': f"bench-stream-{alias}"}
+                        for alias in settings.CACHES},
+                CHAT_WRITE_BEHIND_DIR=tmp_dir / 'write_behind',
+                KNOWLEDGE_INDEX_PATH=tmp_dir / 'knowledge_index.npy',
+            ), mock.patch.object(jira_pool, 'service_client', return_value=fake_jira), \
+                    mock.patch('ai_chat.jira_service.Confluence', lambda **kwargs: FakeConfluence(store, config)), \
+                    mock.patch('ai_chat.ollama_api.get_client', return_value=fake_ollama):
+                results = self._run(options)
+                write_behind.stop()
+                conversation_summarizer.drain()
+        finally:
+            logging.disable(logging.NOTSET)
+            connections.close_all()
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(
+            f"{'intent':20} {'mode':15} {'writes':>7} {'wire KiB':>9} {'CPU ms':>8} "
+            f"{'TTFB ms':>8} {'total ms':>9} {'max gap ms':>11}"
+        )
+        for row in results:
+            self.stdout.write(
+                f"{row['intent']:20} {row['mode']:15} {row['writes']:7.0f} {row['wire_kib']:9.1f} {row['cpu_ms']:8.2f} "
+                f"{row['ttfb_ms']:8.1f} {row['total_ms']:9.1f} {row['max_gap_ms']:11.1f}"
+            )
+        self.stdout.write("Medians per reply. CPU is the serving thread: Django, framing, gzip and socket writes.")
+
+    def _run(self, options):
+        user = User.objects.create(username='bench-stream', email='agent@example.com')
+        UserJiraProfile.objects.create(user=user, jira_username='agent@example.com', jira_server=settings.JIRA_SERVER or '')
+        client = Client()
+        client.force_login(user)
+        cookie = f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}"
+
+        app = _MeasuredApp(WSGIHandler())
+        server = make_server('127.0.0.1', 0, app, server_class=WSGIServer, handler_class=_QuietHandler)
+        threading.Thread(target=server.serve_forever, name='bench-stream-server', daemon=True).start()
+        try:
+            results = []
+            for intent in options['intents']:
+                for mode in options['modes']:
+                    with override_settings(**MODES[mode]):
+                        samples = []
+                        for i in range(options['warmup'] + options['iterations']):
+                            sample = self._request(server.server_port, cookie, MESSAGES[intent], options['protocol'], mode)
+                            sample.update(app.samples.get(timeout=30))
+                            if i >= options['warmup']:
+                                samples.append(sample)
+                    results.append({
+                        'intent': intent,
+                        'mode': mode,
+                        **{key: statistics.median(s[key] for s in samples) for key in samples[0]},
+                    })
+            return results
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def _request(self, port, cookie, message, protocol, mode):
+        """POST one message and time the body as it arrives"""
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        headers = {
+            'Host': 'testserver',
+            'Cookie': cookie,
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'Accept': 'text/event-stream' if protocol == 'sse' else 'text/plain',
+        }
+        if mode.endswith('gzip'):
+            headers['Accept-Encoding'] = 'gzip'
+        started = time.perf_counter()
+        conn.request('POST', '/', body=urlencode({'user_input': message}), headers=headers)
+        response = conn.getresponse()
+
+        decompressor = zlib.decompressobj(31) if response.getheader('Content-Encoding') == 'gzip' else None
+        wire_bytes, text = 0, b''
+        ttfb = last = None
+        max_gap = 0.0
+        while True:
+            data = response.read1(65536)
+            if not data:
+                break
+            now = time.perf_counter()
+            if ttfb is None:
+                ttfb = now - started
+            else:
+                max_gap = max(max_gap, now - last)
+            last = now
+            wire_bytes += len(data)
+            text += decompressor.decompress(data) if decompressor else data
+        conn.close()
+        if response.status != 200 or not text:
+            raise RuntimeError(f"Chat request failed with {response.status}: {text[:200]!r}")
+        return {
+            'wire_kib': wire_bytes / 1024,
+            'ttfb_ms': (ttfb or 0) * 1000,
+            'total_ms': ((last or started) - started) * 1000,
+            'max_gap_ms': max_gap * 1000,
+        }
+
+
+def _padded(content, length):
+    """Repeat a fixture completion until it is about `length` characters, like a long LLM answer"""
+    if len(content) >= length:
+        return content
+    sentence = content.strip() + ' '
+    return (sentence * (length // len(sentence) + 1))[:length].rsplit(' ', 1)[0]
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from ai_chat.jira_service import JiraService
+from ai_chat.knowledge_index import build_knowledge_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the KnowledgeBase retrieval index from mirrored Confluence pages and resolved tickets"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-tickets', type=int, default=500, help="Most recently resolved tickets to index")
+        parser.add_argument('--batch-size', type=int, default=32, help="Texts per embedding request")
+
+    def handle(self, *args, **options):
+        stats = build_knowledge_index(JiraService(), max_tickets=options['max_tickets'], batch_size=options['batch_size'])
+        self.stdout.write(f"Indexed {stats['chunks']} chunks from {stats['documents']} documents")
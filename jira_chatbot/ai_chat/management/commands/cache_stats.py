@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from ai_chat.cache import get_cache, shared_stats, reset_shared_stats
+
+
+class Command(BaseCommand):
+    help = "Show hit rates for each cache namespace, summed over all workers"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help="Zero the shared counters")
+        parser.add_argument('--clear', metavar='NAMESPACE', action='append', help="Invalidate every key in a namespace")
+
+    def handle(self, *args, **options):
+        for namespace in options['clear'] or []:
+            get_cache(namespace).clear()
+            self.stdout.write(f"Cleared {namespace}")
+
+        for namespace, stats in shared_stats().items():
+            timeout, max_entries = settings.CACHE_NAMESPACES[namespace]
+            self.stdout.write(
+                f"{namespace:12} hits {stats.get('hits', 0):>8}  misses {stats.get('misses', 0):>8}  "
+                f"coalesced {stats.get('coalesced', 0):>6}  hit rate {stats['hit_rate']:.1%}  "
+                f"(ttl {timeout}s, max {max_entries} entries)"
+            )
+
+        if options['reset']:
+            reset_shared_stats()
+            self.stdout.write("Counters reset")
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from ai_chat.llm_usage import GROUPS, usage_rollup
+from datetime import timedelta
+import json
+
+
+class Command(BaseCommand):
+    help = "Report the users, intents, sessions or models that used the most LLM time and tokens over a time window"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=24, help="Window ending now (default: 24)")
+        parser.add_argument('--by', nargs='+', choices=sorted(GROUPS), default=['user', 'intent'], help="Groupings to report")
+        parser.add_argument('--top', type=int, default=10, help="Rows per grouping")
+        parser.add_argument('--json', action='store_true', help="Print JSON instead of tables")
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(hours=options['hours'])
+        report = {group: usage_rollup(since, group_by=group, limit=options['top']) for group in options['by']}
+
+        if options['json']:
+            self.stdout.write(json.dumps({'since': since.isoformat(), **report}, indent=2, default=str))
+            return
+
+        self.stdout.write(f"LLM usage since {since:%Y-%m-%d %H:%M} UTC, ranked by generation time")
+        for group, rows in report.items():
+            self.stdout.write(
+                f"\n{group:30} {'calls':>7} {'prompt tok':>11} {'output tok':>11} "
+                f"{'LLM s':>9} {'load s':>8} {'prefill s':>10} {'tok/s':>7}"
+            )
+            if not rows:
+                self.stdout.write("(no generations recorded)")
+            for row in rows:
+                rate = f"{row['tokens_per_second']:7.1f}" if row['tokens_per_second'] is not None else f"{'-':>7}"
+                self.stdout.write(
+                    f"{str(row['label'] or '(none)')[:30]:30} {row['generations']:7d} {row['prompt_tokens']:11d} "
+                    f"{row['completion_tokens']:11d} {row['llm_seconds']:9.1f} {row['load_seconds']:8.1f} "
+                    f"{row['prefill_seconds']:10.1f} {rate}"
+                )
@@ -0,0 +1,332 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from ai_chat.standin.server import StandinConfig, start_in_thread
+from pathlib import Path
+import json
+import os
+import random
+import requests
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# Conversations a synthetic agent works through, one message per turn
+SCRIPTS = [
+    ["Hello there", "Printer problem after an update", "Search tickets about printer", "Show me SUP-1",
+     "Create a ticket for my blurry printer"],
+    ["How do I fix the windows login?", "Show me SUP-2", "Add comment to SUP-2: rejoined the domain, testing now",
+     "Resolve SUP-2"],
+    ["Find issues with wifi", "Help with a microsoft 365 password reset", "Thanks, that was useful"],
+    ["Good morning", "Search tickets for network access", "What is KAN-1 about?", "Close all tickets related to printer"],
+]
+
+
+class Recorder:
+    """Thread-safe samples per endpoint"""
+
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def add(self, endpoint, ok, total, ttfb=None):
+        with self._lock:
+            self.samples.setdefault(endpoint, []).append((ok, total, ttfb))
+
+
+class ResourceSampler(threading.Thread):
+    """Samples CPU and RSS of a server process and its children from /proc (Linux only)"""
+
+    def __init__(self, pid, interval=1.0):
+        super().__init__(name='loadtest-resources', daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.cpu_percent = []
+        self.rss_mb = []
+        self._stop_event = threading.Event()
+        self._ticks = os.sysconf('SC_CLK_TCK')
+        self._page_size = os.sysconf('SC_PAGE_SIZE')
+
+    def _processes(self):
+        children = {}
+        for entry in os.listdir('/proc'):
+            if entry.isdigit():
+                try:
+                    with open(f'/proc/{entry}/stat') as f:
+                        ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+                    children.setdefault(ppid, []).append(int(entry))
+                except (OSError, IndexError, ValueError):
+                    continue
+        pids, queue = [], [self.pid]
+        while queue:
+            pid = queue.pop()
+            pids.append(pid)
+            queue.extend(children.get(pid, []))
+        return pids
+
+    def _sample(self):
+        cpu_ticks = rss_pages = 0
+        for pid in self._processes():
+            try:
+                with open(f'/proc/{pid}/stat') as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+                cpu_ticks += int(fields[11]) + int(fields[12])  # utime + stime
+                with open(f'/proc/{pid}/statm') as f:
+                    rss_pages += int(f.read().split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+        return cpu_ticks / self._ticks, rss_pages * self._page_size / (1024 * 1024)
+
+    def run(self):
+        cpu, _ = self._sample()
+        started = time.monotonic()
+        while not self._stop_event.wait(self.interval):
+            now = time.monotonic()
+            current, rss = self._sample()
+            self.cpu_percent.append((current - cpu) / (now - started) * 100)
+            self.rss_mb.append(rss)
+            cpu, started = current, now
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test the chat HTTP endpoints with N concurrent synthetic agents running conversation "
+        "scripts; reports streaming time-to-first-byte, full response time, error rates and server "
+        "CPU/memory. Use --spawn to run the server against local stand-ins for Jira, Confluence and Ollama"
+    )
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help="Server under test (ignored with --spawn)")
+        parser.add_argument('--users', type=int, default=20, help="Concurrent synthetic agents")
+        parser.add_argument('--duration', type=float, default=60, help="Seconds to keep sending once ramped up")
+        parser.add_argument('--ramp-up', type=float, default=10, help="Seconds over which the agents start")
+        parser.add_argument('--think-ms', type=float, default=500, help="Mean pause between an agent's messages")
+        parser.add_argument('--timeout', type=float, default=120, help="Per-request timeout in seconds")
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument(
+            '--spawn', action='store_true',
+            help="Start a stand-in and a server with a throwaway database and cache, then load test it"
+        )
+        parser.add_argument(
+            '--server-command', default=f'{sys.executable} manage.py runserver --noreload 127.0.0.1:{{port}}',
+            help="Command used by --spawn; {port} is substituted, e.g. "
+                 "'gunicorn jira_chatbot.wsgi -w 4 --threads 8 -b 127.0.0.1:{port}'"
+        )
+        parser.add_argument('--server-pid', type=int, help="Sample CPU and RSS of this server process and its children")
+        parser.add_argument('--atlassian-latency-ms', type=float, default=50, help="Stand-in latency per Jira/Confluence call (--spawn)")
+        parser.add_argument('--first-token-ms', type=float, default=200, help="Stand-in LLM delay before the first token (--spawn)")
+        parser.add_argument('--token-latency-ms', type=float, default=10, help="Stand-in LLM delay between tokens (--spawn)")
+        parser.add_argument('--json', help="Also write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        server = tmp_dir = None
+        try:
+            if options['spawn']:
+                tmp_dir = Path(tempfile.mkdtemp(prefix='loadtest-chat-'))
+                server, url = self._spawn(options, tmp_dir)
+                server_pid = server.pid
+            else:
+                url = options['url'].rstrip('/')
+                server_pid = options['server_pid']
+
+            sampler = None
+            if server_pid and os.path.exists('/proc'):
+                sampler = ResourceSampler(server_pid)
+                sampler.start()
+
+            recorder = Recorder()
+            started = time.monotonic()
+            self._run_users(url, options, recorder)
+            elapsed = time.monotonic() - started
+
+            if sampler:
+                sampler.stop()
+            self._report(recorder, elapsed, sampler, options)
+        finally:
+            if server is not None:
+                server.terminate()
+                try:
+                    server.wait(10)
+                except subprocess.TimeoutExpired:
+                    server.kill()
+            if tmp_dir is not None:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _spawn(self, options, tmp_dir):
+        standin = start_in_thread(config=StandinConfig(
+            latency_ms=options['atlassian_latency_ms'],
+            first_token_ms=options['first_token_ms'],
+            token_latency_ms=options['token_latency_ms'],
+            seed=options['seed'],
+        ))
+        env = dict(
+            os.environ,
+            STANDIN_SERVER_URL=standin.url,
+            DATABASE_PROFILE='sqlite',
+            DB_NAME=str(tmp_dir / 'loadtest.sqlite3'),
+            CACHE_DIR=str(tmp_dir / 'cache'),
+            CHAT_WRITE_BEHIND_DIR=str(tmp_dir / 'write_behind'),
+            KNOWLEDGE_INDEX_PATH=str(tmp_dir / 'knowledge_index.npy'),
+        )
+        env.pop('CACHE_URL', None)  # Keep the run off any shared cache
+        manage_dir = settings.BASE_DIR
+        # Same setup as a fresh deployment: schema, mirrored Confluence pages and the knowledge index
+        for command in (['migrate', '-v0'], ['sync_confluence'], ['build_knowledge_index']):
+            subprocess.run(
+                [sys.executable, 'manage.py', *command], cwd=manage_dir, env=env, check=True, stdout=subprocess.DEVNULL
+            )
+
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        command = options['server_command'].format(port=port)
+        server = subprocess.Popen(
+            command.split(), cwd=manage_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        url = f"http://127.0.0.1:{port}"
+
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                requests.get(f"{url}/auth/login/", timeout=1)
+                break
+            except requests.ConnectionError:
+                if server.poll() is not None or time.monotonic() > deadline:
+                    raise CommandError(f"Server did not start: {command}")
+                time.sleep(0.2)
+        self.stdout.write(f"Spawned server {url} (pid {server.pid}) against stand-in {standin.url}")
+        return server, url
+
+    def _run_users(self, url, options, recorder):
+        rng = random.Random(options['seed'])
+        users = options['users']
+        end = time.monotonic() + options['ramp_up'] + options['duration']
+        threads = []
+        for index in range(users):
+            delay = options['ramp_up'] * index / users
+            thread = threading.Thread(
+                target=self._agent, name=f'loadtest-agent-{index}',
+                args=(url, index, delay, end, random.Random(rng.random()), options, recorder), daemon=True
+            )
+            thread.start()
+            threads.append(thread)
+        self.stdout.write(f"Running {users} agents for {options['duration']:.0f}s after a {options['ramp_up']:.0f}s ramp-up")
+        for thread in threads:
+            thread.join()
+
+    def _request(self, recorder, endpoint, session, method, url, timeout, stream=False, **kwargs):
+        """Send one request and record it; streamed responses also record time to first byte"""
+        started = time.perf_counter()
+        ttfb = None
+        try:
+            response = session.request(method, url, timeout=timeout, stream=stream, **kwargs)
+            if stream:
+                for chunk in response.iter_content(chunk_size=None):
+                    if ttfb is None and chunk:
+                        ttfb = time.perf_counter() - started
+            else:
+                response.content
+            ok = response.status_code < 400
+        except requests.RequestException:
+            response, ok = None, False
+        recorder.add(endpoint, ok, time.perf_counter() - started, ttfb)
+        return response if ok else None
+
+    def _agent(self, url, index, delay, end, rng, options, recorder):
+        time.sleep(delay)
+        timeout = options['timeout']
+        session = requests.Session()
+
+        # Any token is accepted by the stand-in; each agent becomes its own Django user
+        login_url = f"{url}/auth/login/"
+        if self._request(recorder, 'login page', session, 'GET', login_url, timeout) is None:
+            return
+        response = self._request(
+            recorder, 'login', session, 'POST', login_url, timeout,
+            data={'username': f"loadtest-{index}@example.com", 'password': 'loadtest-token',
+                  'csrfmiddlewaretoken': session.cookies.get('csrftoken', '')},
+            headers={'Referer': login_url}, allow_redirects=False,
+        )
+        if response is None or response.status_code != 302:
+            return
+        csrf_headers = {'X-CSRFToken': session.cookies.get('csrftoken', '')}
+
+        while time.monotonic() < end:
+            # Each conversation starts from the chat home page, like an agent opening the app
+            self._request(recorder, '/ page', session, 'GET', f"{url}/", timeout)
+            response = self._request(recorder, '/api/new-chat/', session, 'POST', f"{url}/api/new-chat/", timeout, headers=csrf_headers)
+            if response is None:
+                time.sleep(1)
+                continue
+            chat_path = response.json()['redirect_url']
+            self._request(recorder, '/chat/<id>/ page', session, 'GET', f"{url}{chat_path}", timeout)
+
+            for message in rng.choice(SCRIPTS):
+                if time.monotonic() >= end:
+                    break
+                self._request(
+                    recorder, '/chat/<id>/ message', session, 'POST', f"{url}{chat_path}", timeout, stream=True,
+                    data={'user_input': message, 'auto_assign': 'false'}, headers=csrf_headers,
+                )
+                time.sleep(rng.expovariate(1000 / options['think_ms']) if options['think_ms'] else 0)
+
+            self._request(recorder, '/api/chat-sessions/', session, 'GET', f"{url}/api/chat-sessions/", timeout)
+
+    def _report(self, recorder, elapsed, sampler, options):
+        def pct(values, fraction):
+            values = sorted(values)
+            return values[min(len(values) - 1, max(0, int(round(len(values) * fraction)) - 1))] * 1000
+
+        results = {'elapsed_s': elapsed, 'users': options['users'], 'endpoints': {}}
+        self.stdout.write(
+            f"\n{'endpoint':22} {'requests':>8} {'errors':>7} {'req/s':>7} "
+            f"{'ttfb p50':>9} {'p95':>8} {'p99':>8} {'total p50':>10} {'p95':>8} {'p99':>8}"
+        )
+        for endpoint, samples in recorder.samples.items():
+            totals = [total for ok, total, _ in samples if ok]
+            ttfbs = [ttfb for ok, _, ttfb in samples if ok and ttfb is not None]
+            errors = sum(1 for ok, _, _ in samples if not ok)
+            row = {
+                'requests': len(samples),
+                'error_rate': errors / len(samples),
+                'per_second': len(samples) / elapsed,
+            }
+            for name, values in (('ttfb', ttfbs), ('total', totals)):
+                if values:
+                    row.update({f'{name}_p50_ms': statistics.median(values) * 1000,
+                                f'{name}_p95_ms': pct(values, 0.95), f'{name}_p99_ms': pct(values, 0.99)})
+            results['endpoints'][endpoint] = row
+
+            def fmt(key, width):
+                return f"{row[key]:{width}.0f}" if key in row else ' ' * (width - 1) + '-'
+
+            self.stdout.write(
+                f"{endpoint:22} {row['requests']:8d} {row['error_rate']:7.1%} {row['per_second']:7.1f} "
+                f"{fmt('ttfb_p50_ms', 9)} {fmt('ttfb_p95_ms', 8)} {fmt('ttfb_p99_ms', 8)} "
+                f"{fmt('total_p50_ms', 10)} {fmt('total_p95_ms', 8)} {fmt('total_p99_ms', 8)}"
+            )
+
+        if sampler and sampler.cpu_percent:
+            results['server'] = {
+                'cpu_percent_mean': statistics.mean(sampler.cpu_percent),
+                'cpu_percent_max': max(sampler.cpu_percent),
+                'rss_mb_max': max(sampler.rss_mb),
+            }
+            self.stdout.write(
+                f"\nServer: CPU mean {results['server']['cpu_percent_mean']:.0f}% "
+                f"(max {results['server']['cpu_percent_max']:.0f}%), RSS max {results['server']['rss_mb_max']:.0f} MB"
+            )
+
+        if options['json']:
+            with open(options['json'], 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Saved results to {options['json']}")
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from ai_chat.standin.server import StandinServer, StandinConfig, FixtureStore, DEFAULT_FIXTURES
+
+
+class Command(BaseCommand):
+    help = "Run the local Jira/Confluence/Ollama stand-in server backed by recorded fixtures"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--fixtures', default=str(DEFAULT_FIXTURES), help="Path to the recorded fixture JSON")
+        parser.add_argument('--latency-ms', type=float, default=0, help="Added latency per request")
+        parser.add_argument('--jitter-ms', type=float, default=0, help="Random +/- jitter on top of the latency")
+        parser.add_argument('--first-token-ms', type=float, default=0, help="Ollama delay before the first token")
+        parser.add_argument('--token-latency-ms', type=float, default=0, help="Ollama delay between streamed tokens")
+        parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with 503")
+        parser.add_argument('--seed', type=int, default=None, help="Seed for reproducible jitter and errors")
+
+    def handle(self, *args, **options):
+        config = StandinConfig(
+            latency_ms=options['latency_ms'],
+            jitter_ms=options['jitter_ms'],
+            token_latency_ms=options['token_latency_ms'],
+            first_token_ms=options['first_token_ms'],
+            error_rate=options['error_rate'],
+            seed=options['seed'],
+        )
+        server = StandinServer((options['host'], options['port']), FixtureStore(options['fixtures']), config)
+        self.stdout.write(f"Stand-in server listening on {server.url}")
+        self.stdout.write(f"Set STANDIN_SERVER_URL={server.url} to point the app at it")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
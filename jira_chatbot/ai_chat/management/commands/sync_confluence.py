@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from ai_chat.jira_service import JiraService
+
+
+class Command(BaseCommand):
+    help = "Incrementally mirror Confluence pages into ConfluencePage using a lastmodified cursor per space"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--space', action='append', dest='spaces', help="Space key to sync (default: CONFLUENCE_SYNC_SPACES)")
+        parser.add_argument('--full', action='store_true', help="Ignore the stored cursor and re-read every page")
+        parser.add_argument('--batch-size', type=int, default=50)
+
+    def handle(self, *args, **options):
+        service = JiraService()
+        if not service.confluence_available:
+            self.stderr.write("Confluence is not available")
+            return
+
+        stats = service.sync_confluence_pages(options['spaces'], full=options['full'], batch_size=options['batch_size'])
+        for space_key, result in stats.items():
+            self.stdout.write(f"{space_key}: {result}")
@@ -0,0 +1,261 @@
+"""
+Latency histograms for chat messages, exposed in Prometheus text format at /metrics.
+
+ChatService.process_message opens a MessageTimer; the stages it runs (context
+fetch, intent detection, the handler, persistence), every Jira and Confluence
+HTTP call and every LLM call made while it is open are recorded against it and
+labelled with the message's intent once that is known. Work outside a message
+(the summary thread, management commands) is labelled intent="background".
+
+Observations are plain in-memory increments. Each process claims one of
+MAX_PROCESSES slots in the default cache and periodically stores a snapshot of
+its histograms under it; /metrics merges the snapshots in every slot so one
+scrape covers every worker. No key is shared between processes, so concurrent
+flushes cannot drop each other.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.core.cache import caches
+from requests.adapters import HTTPAdapter
+from .tracing import REQUEST_ID_HEADER, current_request_id, record_span
+import atexit
+import logging
+import os
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 15  # Seconds between snapshots of this process's histograms
+PROCESS_TTL = 3600  # Snapshots and slots of processes that stopped flushing are dropped after this long
+MAX_PROCESSES = 256  # Slots for concurrently live processes
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 250)
+
+_current_timer = ContextVar('chat_message_timer', default=None)
+
+
+class Histogram:
+    """Prometheus-style histogram with a fixed label set"""
+
+    def __init__(self, name, documentation, labelnames, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [count per bucket..., count above the last bucket, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+        registry.maybe_flush()
+
+    def snapshot(self):
+        with self._lock:
+            return {key: list(series) for key, series in self._series.items()}
+
+
+class MessageTimer:
+    """Stage timings of one chat message, observed with its intent label when finished"""
+
+    def __init__(self):
+        self.intent = 'unknown'
+        self._started = time.perf_counter()
+        self._observations = []
+        self._token = _current_timer.set(self)
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage_seconds, time.perf_counter() - started, stage=name)
+
+    def add(self, histogram, value, **labels):
+        self._observations.append((histogram, value, labels))
+        _record_span(histogram, value, labels)
+
+    def timings(self):
+        """Milliseconds per stage recorded so far, summed over repeated stages"""
+        totals = {}
+        for histogram, value, labels in self._observations:
+            if histogram is stage_seconds:
+                totals[labels['stage']] = totals.get(labels['stage'], 0) + value * 1000
+        return {stage: round(ms, 1) for stage, ms in totals.items()}
+
+    def finish(self):
+        """Observe everything recorded for this message, plus its total time"""
+        _current_timer.reset(self._token)
+        self.add(stage_seconds, time.perf_counter() - self._started, stage='total')
+        for histogram, value, labels in self._observations:
+            histogram.observe(value, intent=self.intent, **labels)
+
+
+def observe(histogram, value, **labels):
+    """Record against the current message if there is one, otherwise as background work"""
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.add(histogram, value, **labels)
+    else:
+        histogram.observe(value, intent='background', **labels)
+        _record_span(histogram, value, labels)
+
+
+def _record_span(histogram, value, labels):
+    """Mirror stage and HTTP timings into the current request's trace"""
+    if histogram is atlassian_request_seconds:
+        record_span(f"{labels['service']}.{labels['method']}", value)
+    elif histogram is stage_seconds and labels['stage'] != 'total':
+        record_span(labels['stage'], value)
+
+
+@contextmanager
+def timed(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage_seconds, time.perf_counter() - started, stage=stage)
+
+
+class InstrumentedAdapter(HTTPAdapter):
+    """HTTPAdapter that times every request to an Atlassian service and tags it with the correlation ID"""
+
+    def __init__(self, service, **kwargs):
+        self.service = service
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        request_id = current_request_id()
+        if request_id:
+            request.headers[REQUEST_ID_HEADER] = request_id
+        started = time.perf_counter()
+        try:
+            return super().send(request, **kwargs)
+        finally:
+            observe(atlassian_request_seconds, time.perf_counter() - started, service=self.service, method=request.method)
+
+
+def instrument_session(session, service):
+    """Time all HTTP calls made through a requests session"""
+    adapter = InstrumentedAdapter(service)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+
+class Registry:
+    def __init__(self):
+        self.histograms = []
+        self.process_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.slot = None
+        self._last_flush = time.monotonic()
+        self._flush_lock = threading.Lock()
+
+    def histogram(self, *args, **kwargs):
+        histogram = Histogram(*args, **kwargs)
+        self.histograms.append(histogram)
+        return histogram
+
+    def maybe_flush(self):
+        if time.monotonic() - self._last_flush > FLUSH_INTERVAL and self._flush_lock.acquire(blocking=False):
+            try:
+                self.flush()
+            finally:
+                self._flush_lock.release()
+
+    def _claim_slot(self, cache):
+        """Keep this process's slot, or claim a free one if it expired or was evicted"""
+        if self.slot is not None and cache.get(f"metrics:slot:{self.slot}") == self.process_id:
+            cache.touch(f"metrics:slot:{self.slot}", PROCESS_TTL)
+            return self.slot
+        self.slot = None
+        for slot in range(MAX_PROCESSES):
+            if cache.add(f"metrics:slot:{slot}", self.process_id, PROCESS_TTL):
+                self.slot = slot
+                break
+        return self.slot
+
+    def flush(self):
+        """Store this process's snapshot under its own slot"""
+        self._last_flush = time.monotonic()
+        snapshot = {h.name: h.snapshot() for h in self.histograms}
+        try:
+            cache = caches['default']
+            slot = self._claim_slot(cache)
+            if slot is None:
+                logger.warning(f"All {MAX_PROCESSES} metrics slots are taken; this process is not reported")
+                return
+            cache.set(f"metrics:process:{slot}", snapshot, PROCESS_TTL)
+        except Exception as e:
+            logger.warning(f"Failed to store metrics snapshot: {str(e)}")
+
+    def collect(self):
+        """Histograms merged across all processes that flushed within PROCESS_TTL"""
+        self.flush()
+        snapshots = caches['default'].get_many(
+            [f"metrics:process:{slot}" for slot in range(MAX_PROCESSES)]
+        ).values()
+
+        merged = {h.name: {} for h in self.histograms}
+        for snapshot in snapshots:
+            for name, series in snapshot.items():
+                if name not in merged:
+                    continue
+                for key, values in series.items():
+                    totals = merged[name].setdefault(key, [0] * len(values))
+                    for i, value in enumerate(values):
+                        totals[i] += value
+        return merged
+
+    def render(self):
+        """Prometheus text exposition format"""
+        merged = self.collect()
+        lines = []
+        for histogram in self.histograms:
+            lines.append(f"# HELP {histogram.name} {histogram.documentation}")
+            lines.append(f"# TYPE {histogram.name} histogram")
+            for key, series in sorted(merged[histogram.name].items()):
+                labels = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(histogram.labelnames, key))
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ('+Inf',), series[:-1]):
+                    cumulative += count
+                    lines.append(f'{histogram.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"{histogram.name}_sum{{{labels}}} {series[-1]:.6f}")
+                lines.append(f"{histogram.name}_count{{{labels}}} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
+atexit.register(registry.flush)
+
+stage_seconds = registry.histogram(
+    'chat_stage_seconds',
+    "Time spent per stage of a chat message: context, intent, handler, persist, "
+    "llm_queue_wait, llm_first_token, llm and total",
+    ['intent', 'stage'],
+)
+atlassian_request_seconds = registry.histogram(
+    'chat_atlassian_request_seconds',
+    "Duration of each HTTP call to Jira or Confluence",
+    ['intent', 'service', 'method'],
+)
+llm_tokens_per_second = registry.histogram(
+    'chat_llm_tokens_per_second',
+    "LLM generation speed reported by Ollama",
+    ['intent'],
+    buckets=RATE_BUCKETS,
+)
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_chat', '0002_chatsession_is_active_chatsession_title_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConfluenceSyncState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('space_key', models.CharField(max_length=50, unique=True)),
+                ('cursor', models.DateTimeField(blank=True, null=True)),
+                ('last_synced_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='confluencepage',
+            name='url',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+        migrations.AddField(
+            model_name='confluencepage',
+            name='version',
+            field=models.IntegerField(default=1),
+        ),
+    ]
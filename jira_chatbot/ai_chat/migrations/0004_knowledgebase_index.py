@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_chat', '0003_confluence_mirror'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='knowledgebase',
+            name='url',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+        migrations.AddField(
+            model_name='knowledgebase',
+            name='vector_row',
+            field=models.IntegerField(blank=True, null=True, unique=True),
+        ),
+    ]
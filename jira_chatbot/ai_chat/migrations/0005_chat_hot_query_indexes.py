@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:32
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_chat', '0004_knowledgebase_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['session', 'created_at', 'id'], name='chatmsg_session_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatsession',
+            index=models.Index(fields=['user', 'last_activity'], name='chatsession_user_activity_idx'),
+        ),
+    ]
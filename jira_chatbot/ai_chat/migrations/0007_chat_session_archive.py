@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_chat', '0006_chatmessage_write_behind'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatsession',
+            name='archived_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='ArchivedChatSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('codec', models.CharField(max_length=10)),
+                ('payload', models.BinaryField()),
+                ('message_count', models.IntegerField()),
+                ('first_message_at', models.DateTimeField()),
+                ('last_message_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('session', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='archive', to='ai_chat.chatsession')),
+            ],
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:02
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_chat', '0007_chat_session_archive'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message_uid', models.UUIDField(blank=True, null=True)),
+                ('sequence', models.PositiveSmallIntegerField(default=0)),
+                ('intent', models.CharField(blank=True, max_length=100)),
+                ('model', models.CharField(blank=True, max_length=100)),
+                ('prompt_tokens', models.IntegerField(default=0)),
+                ('completion_tokens', models.IntegerField(default=0)),
+                ('load_ms', models.FloatField(default=0)),
+                ('prefill_ms', models.FloatField(default=0)),
+                ('eval_ms', models.FloatField(default=0)),
+                ('total_ms', models.FloatField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('session', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='ai_chat.chatsession')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['created_at'], name='llmusage_created_idx')],
+                'constraints': [models.UniqueConstraint(fields=('message_uid', 'sequence'), name='llmusage_message_sequence_uniq')],
+            },
+        ),
+    ]
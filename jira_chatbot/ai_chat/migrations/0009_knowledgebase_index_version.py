@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_chat', '0008_llm_usage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='knowledgebase',
+            name='index_version',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_chat', '0009_knowledgebase_index_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatsession',
+            name='context_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
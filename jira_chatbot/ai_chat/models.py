@@ -1,6 +1,7 @@
 # ai_chat/models.py
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 import json
 
 class JiraProject(models.Model):
@@ -33,29 +34,84 @@ class ChatSession(models.Model):
     user_email = models.EmailField(blank=True, null=True)  # Who's chatting (legacy)
     current_project = models.ForeignKey(JiraProject, on_delete=models.SET_NULL, null=True, blank=True)
     conversation_context = models.JSONField(default=dict)  # Store conversation state
+    context_version = models.PositiveIntegerField(default=0)  # Bumped by every update_context()
     is_active = models.BooleanField(default=True)  # Whether this session is currently active
+    archived_at = models.DateTimeField(null=True, blank=True)  # Messages moved to ArchivedChatSession
     created_at = models.DateTimeField(auto_now_add=True)
     last_activity = models.DateTimeField(auto_now=True)
     
+    def _staged_fields(self):
+        if not hasattr(self, '_dirty_fields'):
+            self._dirty_fields = set()
+        return self._dirty_fields
+
+    def stage(self, **fields):
+        """Set fields in memory; they are written together by the next flush()"""
+        for name, value in fields.items():
+            setattr(self, name, value)
+        self._staged_fields().update(fields)
+
     def set_context(self, key, value):
-        """Helper method to set context data"""
+        """Helper method to set context data (written by the next flush())"""
         self.conversation_context[key] = value
-        self.save()
+        self._staged_fields().add('conversation_context')
 
     def get_context(self, key, default=None):
         """Helper method to get context data"""
         return self.conversation_context.get(key, default)
 
+    @classmethod
+    def update_context(cls, pk, mutate, attempts=5):
+        """Compare-and-swap conversation_context: mutate(state) returns the new state, or None to leave it
+
+        The row is re-read and mutate() re-applied whenever another worker
+        updated the context in between. Returns the stored state, or None.
+        """
+        for _ in range(attempts):
+            row = cls.objects.filter(pk=pk).values_list('conversation_context', 'context_version').first()
+            if row is None:
+                return None
+            state = mutate(dict(row[0] or {}))
+            if state is None:
+                return None
+            if cls.objects.filter(pk=pk, context_version=row[1]).update(
+                conversation_context=state, context_version=row[1] + 1
+            ):
+                return state
+        raise RuntimeError(f"Conversation context of session {pk} kept changing during {attempts} attempts")
+
+    def flush(self, touch=True):
+        """Write staged fields in a single UPDATE, bumping last_activity when touch is set; returns True if anything was written"""
+        fields = self._staged_fields()
+        if fields:
+            self.save(update_fields=(fields | {'last_activity'}) if touch else fields)
+            fields.clear()
+        elif touch:
+            self.touch()
+        else:
+            return False
+        return True
+
+    def touch(self):
+        """Bump last_activity with one UPDATE, without fetching or rewriting the row"""
+        self.last_activity = timezone.now()
+        ChatSession.objects.filter(pk=self.pk).update(last_activity=self.last_activity)
+
+    @staticmethod
+    def title_from_message(user_message):
+        """Build a title from the first 50 characters of a user message"""
+        title = user_message[:50]
+        if len(user_message) > 50:
+            title += "..."
+        return title
+
     def generate_title(self):
         """Auto-generate a title based on the first message"""
         if not self.title:
             first_message = self.chatmessage_set.first()
             if first_message:
-                # Use first 50 characters of the first user message
-                self.title = first_message.user_message[:50]
-                if len(first_message.user_message) > 50:
-                    self.title += "..."
-                self.save()
+                self.title = self.title_from_message(first_message.user_message)
+                self.save(update_fields=['title'])
         return self.title
 
     def get_message_count(self):
@@ -65,14 +121,66 @@ class ChatSession(models.Model):
     def __str__(self):
         return f"Chat {self.session_id[:8]} - {self.title or 'Untitled'}"
 
+    class Meta:
+        indexes = [
+            # Sidebar: filter(user=...).order_by('-last_activity')[:20]
+            models.Index(fields=['user', 'last_activity'], name='chatsession_user_activity_idx'),
+        ]
+
 class ChatMessage(models.Model):
     session = models.ForeignKey(ChatSession, on_delete=models.CASCADE)
+    message_uid = models.UUIDField(null=True, blank=True, unique=True, editable=False)  # Idempotency key for write-behind replay
     user_message = models.TextField()
     bot_response = models.TextField()
     intent_detected = models.CharField(max_length=100, blank=True)  # What the bot understood
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(default=timezone.now)  # Set when the reply is produced, not when the batch is written
     response_type = models.CharField(max_length=50, default='text')
 
+    class Meta:
+        indexes = [
+            # Recent context, history pages and first-message lookups all scan by (session, created_at, id)
+            models.Index(fields=['session', 'created_at', 'id'], name='chatmsg_session_created_idx'),
+        ]
+
+class LLMUsage(models.Model):
+    """Token counts and timings of one Ollama generation (see ai_chat.llm_usage)"""
+    # Kept when a chat is deleted, so capacity history stays complete
+    session = models.ForeignKey(ChatSession, on_delete=models.SET_NULL, null=True, blank=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    message_uid = models.UUIDField(null=True, blank=True)  # ChatMessage the generation was made for; null for summaries
+    sequence = models.PositiveSmallIntegerField(default=0)  # Position among the message's generations
+    intent = models.CharField(max_length=100, blank=True)
+    model = models.CharField(max_length=100, blank=True)
+    prompt_tokens = models.IntegerField(default=0)
+    completion_tokens = models.IntegerField(default=0)
+    load_ms = models.FloatField(default=0)
+    prefill_ms = models.FloatField(default=0)
+    eval_ms = models.FloatField(default=0)
+    total_ms = models.FloatField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            # Replaying a write-behind journal must not count a generation twice
+            models.UniqueConstraint(fields=['message_uid', 'sequence'], name='llmusage_message_sequence_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['created_at'], name='llmusage_created_idx'),
+        ]
+
+class ArchivedChatSession(models.Model):
+    """Compressed JSON copy of an inactive session's messages (see ai_chat.archive)"""
+    session = models.OneToOneField(ChatSession, on_delete=models.CASCADE, related_name='archive')
+    codec = models.CharField(max_length=10)  # 'zstd' or 'gzip'
+    payload = models.BinaryField()
+    message_count = models.IntegerField()
+    first_message_at = models.DateTimeField()
+    last_message_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Archive of {self.session_id} ({self.message_count} messages, {self.codec})"
+
 class JiraTicket(models.Model):
     """Enhanced ticket model with all necessary fields"""
     PRIORITY_CHOICES = [
@@ -143,14 +251,26 @@ class TicketCreationFlow(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
 class ConfluencePage(models.Model):
+    """Local mirror of a Confluence page (plain-text body)"""
     page_id = models.CharField(max_length=50, unique=True)
     title = models.CharField(max_length=255)
     content = models.TextField()
     space_key = models.CharField(max_length=50)
     page_type = models.CharField(max_length=50, default='page')
+    version = models.IntegerField(default=1)  # Confluence version number, used to skip unchanged pages
+    url = models.CharField(max_length=500, blank=True)  # Relative web UI link
     last_updated = models.DateTimeField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+class ConfluenceSyncState(models.Model):
+    """Incremental sync cursor per Confluence space"""
+    space_key = models.CharField(max_length=50, unique=True)
+    cursor = models.DateTimeField(null=True, blank=True)  # Highest lastmodified seen so far
+    last_synced_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.space_key} (cursor: {self.cursor})"
+
 class TicketSolution(models.Model):
     """Store extracted solutions from resolved tickets"""
     ticket = models.OneToOneField(JiraTicket, on_delete=models.CASCADE)
@@ -168,4 +288,10 @@ class KnowledgeBase(models.Model):
     source_id = models.CharField(max_length=50)
     keywords = models.JSONField(default=list)
     category = models.CharField(max_length=100)
-    created_at = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
+    url = models.CharField(max_length=500, blank=True)
+    vector_row = models.IntegerField(null=True, blank=True, unique=True)  # Row in the knowledge index matrix
+    index_version = models.CharField(max_length=32, blank=True)  # Index build the row belongs to
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.source_type}:{self.source_id} - {self.title}"
\ No newline at end of file
@@ -1,11 +1,60 @@
+from django.conf import settings
+from .cache import get_cache
+from .metrics import observe, stage_seconds, llm_tokens_per_second
+from .tracing import add_request_id_header
+from .llm_usage import record_generation
+import hashlib
 import ollama
+import time
+
+_client = None
+
+def get_client():
+    """Return the shared Ollama client for the configured host"""
+    global _client
+    if _client is None:
+        _client = ollama.Client(host=settings.OLLAMA_API_URL, event_hooks={'request': [add_request_id_header]})
+    return _client
 
 def generate_response(prompt):
-    stream = ollama.chat(
-        model='llama3:latest',
-        messages = [{'role': 'user', 
-                     'content': prompt}],
-        stream=True,
-    )
-    for chunk in stream:
-        yield chunk['message']['content']
+    started = time.perf_counter()
+    first_token_at = None
+    final = None
+    try:
+        stream = get_client().chat(
+            model=settings.OLLAMA_MODEL,
+            messages = [{'role': 'user', 
+                         'content': prompt}],
+            stream=True,
+        )
+        for chunk in stream:
+            if chunk.get('done'):
+                final = chunk
+            if first_token_at is None and chunk['message']['content']:
+                first_token_at = time.perf_counter()
+            yield chunk['message']['content']
+    finally:
+        _record_generation(started, first_token_at, final)
+        record_generation(final)
+
+def _record_generation(started, first_token_at, final):
+    """Record LLM timings; queue wait is client-side time the server did not spend on this request"""
+    elapsed = time.perf_counter() - started
+    observe(stage_seconds, elapsed, stage='llm')
+    if first_token_at is not None:
+        observe(stage_seconds, first_token_at - started, stage='llm_first_token')
+    if final is not None:
+        # Ollama reports durations in nanoseconds
+        observe(stage_seconds, max(0.0, elapsed - (final.get('total_duration') or 0) / 1e9), stage='llm_queue_wait')
+        if final.get('eval_count') and final.get('eval_duration'):
+            observe(llm_tokens_per_second, final['eval_count'] / (final['eval_duration'] / 1e9))
+
+def generate_cached(prompt):
+    """Full response for a repeatable prompt, shared between workers via the 'llm' cache"""
+    digest = hashlib.sha256(f"{settings.OLLAMA_MODEL}\n{prompt}".encode('utf-8')).hexdigest()
+    return get_cache('llm').get_or_set(f"response:{digest}", lambda: "".join(generate_response(prompt)))
+
+def embed_texts(texts):
+    """Embed a batch of texts with the local embedding model"""
+    response = get_client().embed(model=settings.OLLAMA_EMBED_MODEL, input=list(texts))
+    return response['embeddings']
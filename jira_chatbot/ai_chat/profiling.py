@@ -0,0 +1,172 @@
+"""
+On-demand cProfile of single requests, for staff.
+
+A staff user adds an "X-Profile: 1" header or "?profile=1" to a request; the
+view runs under cProfile and, for streamed chat replies, so does every step of
+the response generator. cProfile only records the thread that enabled it, so
+while profiling() is true ChatService.stream_message processes the message on
+the request thread instead of its worker thread; the reply then arrives in one
+go rather than streamed. Background work such as summary compaction and
+write-behind batches is not included. The stats are saved to PROFILE_DIR as a
+.prof file (open with snakeviz, or `python -m pstats`) and listed at
+/api/profiles/. Only the newest PROFILE_MAX_FILES files younger than
+PROFILE_MAX_AGE_HOURS are kept. One request is profiled at a time per process;
+others are served normally with "X-Profile: busy".
+
+Requests without the flag only pay for a header and a query string lookup.
+"""
+from contextvars import ContextVar
+from django.conf import settings
+from django.utils import timezone
+from pathlib import Path
+import cProfile
+import logging
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-Profile'
+_VALID_NAME = re.compile(r'^[\w.-]+\.prof$')
+
+STALE_AFTER = 600  # Seconds after which a profile that was never finished frees the slot
+
+_profiling = ContextVar('profiling', default=False)
+
+
+def profiling():
+    """True while the code running is being profiled; work handed to other threads would not be recorded"""
+    return _profiling.get()
+
+
+class _ProfilerSlot:
+    """One profile at a time per process; cProfile cannot run in several threads at once on newer Pythons"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._since = None
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            # A streamed response that was never iterated never releases the slot
+            if self._since is not None and now - self._since < STALE_AFTER:
+                return False
+            self._since = now
+            return True
+
+    def release(self):
+        with self._lock:
+            self._since = None
+
+
+_slot = _ProfilerSlot()
+
+
+def _requested(request):
+    return request.headers.get(PROFILE_HEADER) == '1' or request.GET.get('profile') == '1'
+
+
+class StaffProfilingMiddleware:
+    """Profile requests flagged by staff users and save the stats"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not (_requested(request) and request.user.is_staff):
+            return self.get_response(request)
+        if not _slot.acquire():
+            response = self.get_response(request)
+            response[PROFILE_HEADER] = 'busy'
+            return response
+
+        profiler = cProfile.Profile()
+        name = _profile_name(request)
+        started = time.perf_counter()
+        try:
+            token = _profiling.set(True)
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+                _profiling.reset(token)
+        except BaseException:
+            _slot.release()
+            raise
+
+        response[PROFILE_HEADER] = name
+        if response.streaming:
+            response.streaming_content = self._stream(profiler, name, started, iter(response.streaming_content))
+        else:
+            self._save(profiler, name, started)
+        return response
+
+    def _stream(self, profiler, name, started, chunks):
+        try:
+            while True:
+                # Only the generator's own work is profiled, not the server writing chunks out
+                token = _profiling.set(True)
+                profiler.enable()
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    return
+                finally:
+                    profiler.disable()
+                    _profiling.reset(token)
+                yield chunk
+        finally:
+            self._save(profiler, name, started)
+
+    def _save(self, profiler, name, started):
+        try:
+            profile_dir = Path(settings.PROFILE_DIR)
+            profile_dir.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(profile_dir / name)
+            logger.info(f"Saved profile {name} ({(time.perf_counter() - started) * 1000:.0f}ms)")
+            prune_profiles(profile_dir)
+        except Exception as e:
+            logger.warning(f"Failed to save profile {name}: {str(e)}")
+        finally:
+            _slot.release()
+
+
+def _profile_name(request):
+    path = re.sub(r'[^\w-]+', '_', request.path.strip('/'))[:60] or 'root'
+    request_id = getattr(request, 'request_id', '')[:12]
+    return f"{timezone.now():%Y%m%d-%H%M%S}-{request.method.lower()}-{path}-{request_id}.prof"
+
+
+def list_profiles(profile_dir=None):
+    """Saved profiles, newest first"""
+    profile_dir = Path(profile_dir or settings.PROFILE_DIR)
+    if not profile_dir.is_dir():
+        return []
+    profiles = []
+    for path in profile_dir.glob('*.prof'):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue  # Pruned in the meantime
+        profiles.append({'name': path.name, 'size': stat.st_size, 'modified': stat.st_mtime})
+    return sorted(profiles, key=lambda p: p['modified'], reverse=True)
+
+
+def profile_path(name):
+    """Path of a saved profile, or None if the name is not a profile in PROFILE_DIR"""
+    if not _VALID_NAME.match(name):
+        return None
+    path = Path(settings.PROFILE_DIR) / name
+    return path if path.is_file() else None
+
+
+def prune_profiles(profile_dir=None):
+    """Delete profiles beyond PROFILE_MAX_FILES or older than PROFILE_MAX_AGE_HOURS"""
+    profile_dir = Path(profile_dir or settings.PROFILE_DIR)
+    cutoff = time.time() - settings.PROFILE_MAX_AGE_HOURS * 3600
+    for index, profile in enumerate(list_profiles(profile_dir)):
+        if index >= settings.PROFILE_MAX_FILES or profile['modified'] < cutoff:
+            (profile_dir / profile['name']).unlink(missing_ok=True)
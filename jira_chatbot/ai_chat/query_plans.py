@@ -0,0 +1,24 @@
+"""
+The hot chat queries and the composite index each of them should use.
+
+Shared by the query plan tests and `python manage.py bench_chat_queries`.
+"""
+from .models import ChatSession, ChatMessage
+
+
+def hot_queries(session, user):
+    """(name, index name, queryset factory) for every hot query"""
+    return [
+        ('recent context', 'chatmsg_session_created_idx',
+         lambda: ChatMessage.objects.filter(session=session).order_by('-created_at')[:5]),
+        ('first message', 'chatmsg_session_created_idx',
+         lambda: ChatMessage.objects.filter(session=session).order_by('created_at', 'id')[:1]),
+        ('sidebar sessions', 'chatsession_user_activity_idx',
+         lambda: ChatSession.objects.filter(user=user).order_by('-last_activity')[:20]),
+    ]
+
+
+def uses_index(queryset, index_name):
+    """Return (whether EXPLAIN names the index, the plan)"""
+    plan = queryset.explain()
+    return index_name in plan, plan
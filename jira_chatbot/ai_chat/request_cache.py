@@ -0,0 +1,71 @@
+"""
+Cached lookups for the rows every chat message needs.
+
+The chat session, the user's Jira profile and the resolved assignee are kept
+in the shared 'sessions' cache namespace and dropped explicitly whenever they
+change, so a typical message reaches the database once or twice in total.
+"""
+from jiraAuth.models import UserJiraProfile
+from .cache import get_cache
+from .models import ChatSession
+import logging
+
+logger = logging.getLogger(__name__)
+
+CACHE_TIMEOUT = 300
+
+cache = get_cache('sessions')
+
+
+def _session_key(session_id):
+    return f"chat_session:{session_id}"
+
+
+def _profile_key(user_id):
+    return f"jira_profile:{user_id}"
+
+
+def _assignee_key(user_id):
+    return f"jira_assignee:{user_id}"
+
+
+def get_chat_session(session_id, user=None):
+    """Return the ChatSession for session_id, creating it on first use"""
+    return cache.get_or_set(
+        _session_key(session_id),
+        lambda: ChatSession.objects.get_or_create(session_id=session_id, defaults={'user': user})[0],
+        CACHE_TIMEOUT
+    )
+
+
+def cache_chat_session(session):
+    """Store a session after its staged changes have been written"""
+    cache.set(_session_key(session.session_id), session, CACHE_TIMEOUT)
+
+
+def invalidate_chat_session(session_id):
+    """Drop a cached session after it was renamed, deleted, archived or its context updated"""
+    cache.delete(_session_key(session_id))
+
+
+def get_jira_profile(user):
+    """Return the user's UserJiraProfile, or None if they have none"""
+    # A missing profile is cached as None too
+    return cache.get_or_set(_profile_key(user.pk), lambda: UserJiraProfile.objects.filter(user=user).first(), CACHE_TIMEOUT)
+
+
+def get_assignee(user, jira_service):
+    """Jira account ID to assign tickets to for a user, falling back to their username or email"""
+    def resolve():
+        profile = get_jira_profile(user)
+        if profile and profile.jira_account_id:
+            return profile.jira_account_id
+        email = (profile.jira_username if profile else None) or user.email
+        return jira_service.find_account_id(email) or email
+
+    return cache.get_or_set(_assignee_key(user.pk), resolve, CACHE_TIMEOUT)
+
+
+def invalidate_jira_profile(user_id):
+    """Drop the cached profile and assignee after a user's Jira profile changes"""
+    cache.delete_many([_profile_key(user_id), _assignee_key(user_id)])
@@ -0,0 +1,58 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from .cache import get_cache
+from .models import ChatSession, ChatMessage
+
+SESSION_LIST_LIMIT = 20
+CACHE_TIMEOUT = 300
+
+cache = get_cache('sessions')
+
+
+def _cache_key(user_id):
+    return f"chat_sessions:{user_id}"
+
+
+def get_session_listing(user):
+    """Sidebar data for a user's most recent sessions, cached until a message is written"""
+    return cache.get_or_set(_cache_key(user.pk), lambda: build_session_listing(user), CACHE_TIMEOUT)
+
+
+def invalidate_session_listing(user_id):
+    """Drop the cached sidebar listing after a session or its messages change"""
+    if user_id:
+        cache.delete(_cache_key(user_id))
+
+
+def build_session_listing(user):
+    """Build the sidebar listing with one annotated query and one bulk title backfill"""
+    first_message = ChatMessage.objects.filter(
+        session=OuterRef('pk')
+    ).order_by('created_at', 'id').values('user_message')[:1]
+
+    sessions = list(
+        ChatSession.objects.filter(user=user)
+        .annotate(
+            message_count=Count('chatmessage'),
+            archived_count=F('archive__message_count'),
+            first_message=Subquery(first_message),
+        )
+        .order_by('-last_activity')[:SESSION_LIST_LIMIT]
+    )
+
+    # Backfill missing titles in one query; bulk_update leaves last_activity untouched
+    untitled = [s for s in sessions if not s.title and s.first_message]
+    for session in untitled:
+        session.title = ChatSession.title_from_message(session.first_message)
+    if untitled:
+        ChatSession.objects.bulk_update(untitled, ['title'])
+
+    return [
+        {
+            'session_id': session.session_id,
+            'title': session.title or 'New Chat',
+            'last_activity': session.last_activity.isoformat(),
+            'message_count': session.message_count + (session.archived_count or 0),
+            'created_at': session.created_at.isoformat()
+        }
+        for session in sessions
+    ]
@@ -0,0 +1,193 @@
+"""
+In-process fakes for the Jira, Confluence and Ollama clients.
+
+They answer from the same FixtureStore as the stand-in server and sleep for
+the same StandinConfig latencies, but skip HTTP entirely, so a benchmark of
+ChatService measures the app's own work plus exactly the injected latency.
+JiraService and ollama_api run unmodified on top of them.
+"""
+from atlassian.errors import ApiPermissionError
+from types import SimpleNamespace
+import copy
+import requests
+import time
+
+from .server import FixtureStore, StandinConfig, _assignee, _embedding, _strip_tags, _tokenize
+
+
+def _http_error(status, message):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(message, response=response)
+
+
+def _namespace(value):
+    """Turn decoded JSON into attribute access, like the jira library's resources"""
+    if isinstance(value, dict):
+        return SimpleNamespace(**{key: _namespace(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return [_namespace(item) for item in value]
+    return value
+
+
+class FakeIssue:
+    def __init__(self, jira, issue):
+        self._jira = jira
+        self.raw = copy.deepcopy(issue)
+        self.id = issue['id']
+        self.key = issue['key']
+        self.fields = _namespace(issue['fields'])
+
+    def update(self, assignee=None, **kwargs):
+        self._jira.config.delay()
+        if assignee is not None:
+            self._jira.store.get_issue(self.key)['fields']['assignee'] = _assignee(assignee)
+
+
+class FakeJira:
+    """Subset of jira.JIRA used by JiraService and ChatService"""
+
+    deploymentType = 'Cloud'
+
+    def __init__(self, store=None, config=None):
+        self.store = store or FixtureStore()
+        self.config = config or StandinConfig()
+
+    def _get(self, key):
+        issue = self.store.get_issue(key)
+        if issue is None:
+            raise Exception(f"Issue {key} does not exist or you do not have permission to see it.")
+        return issue
+
+    def issue(self, key):
+        self.config.delay()
+        return FakeIssue(self, self._get(key))
+
+    def search_issues(self, jql, maxResults=50, fields=None):
+        self.config.delay()
+        return [FakeIssue(self, issue) for issue in self.store.search_issues(jql)[:maxResults]]
+
+    def create_issue(self, fields=None):
+        self.config.delay()
+        issue = self.store.create_issue(fields or {})
+        if issue is None:
+            raise Exception("valid project is required")
+        return FakeIssue(self, issue)
+
+    def transitions(self, issue):
+        self.config.delay()
+        return copy.deepcopy(self.store.data['jira']['transitions'])
+
+    def transition_issue(self, issue, transition_id):
+        self.config.delay()
+        if not self.store.transition(self._get(issue.key), transition_id):
+            raise Exception("Transition id is not valid.")
+
+    def add_comment(self, issue, body):
+        self.config.delay()
+        return _namespace(self.store.add_comment(self._get(issue.key), body))
+
+    def search_users(self, query=None, maxResults=50):
+        self.config.delay()
+        me = self.store.data['jira']['myself']
+        term = (query or '').lower()
+        matches = term and (term in me['emailAddress'].lower() or term in me['displayName'].lower())
+        return [_namespace(me)] if matches else []
+
+    def projects(self):
+        self.config.delay()
+        return [_namespace(project) for project in self.store.data['jira']['projects']]
+
+    def close(self):
+        pass
+
+
+class FakeConfluence:
+    """Subset of atlassian.Confluence used by JiraService"""
+
+    def __init__(self, store=None, config=None, **kwargs):
+        self.store = store or FixtureStore()
+        self.config = config or StandinConfig()
+        self.session = requests.Session()  # Only mounted on, never used
+
+    def _page(self, page, expand=''):
+        payload = {
+            'id': page['id'],
+            'type': 'page',
+            'title': page['title'],
+            'space': {'key': page['space']},
+            'version': {'number': page['version'], 'when': page['lastModified']},
+            '_links': {'webui': f"/spaces/{page['space']}/pages/{page['id']}"},
+        }
+        if 'body' in expand:
+            payload['body'] = {'storage': {'value': page['body'], 'representation': 'storage'}}
+        return payload
+
+    def cql(self, cql, start=0, limit=25, expand=None, **kwargs):
+        self.config.delay()
+        pages = self.store.search_pages(cql)[start:start + limit]
+        return {'results': [{
+            'content': self._page(page, expand or ''),
+            'title': page['title'],
+            'excerpt': _strip_tags(page['body'])[:200].strip(),
+            'url': f"/spaces/{page['space']}/pages/{page['id']}",
+            'lastModified': page['lastModified'],
+        } for page in pages]}
+
+    def get_all_spaces(self, start=0, limit=50, **kwargs):
+        self.config.delay()
+        return {'results': self.store.data['confluence']['spaces'][start:start + limit]}
+
+    def create_page(self, space, title, body, parent_id=None, **kwargs):
+        self.config.delay()
+        if not self.store.space(space):
+            # Raised like atlassian-python-api does for a 404 from POST /content
+            raise ApiPermissionError(
+                "The calling user does not have permission to view the content",
+                reason=_http_error(404, f"No space with key : {space}"),
+            )
+        page = self.store.create_page(space, title, body)
+        if page is None:
+            raise Exception("A page with this title already exists")
+        return self._page(page, 'body')
+
+
+class FakeOllama:
+    """Subset of ollama.Client used by ollama_api, streaming with the configured token timings"""
+
+    def __init__(self, store=None, config=None):
+        self.store = store or FixtureStore()
+        self.config = config or StandinConfig()
+
+    def chat(self, model, messages, stream=False):
+        prompt = '\n'.join(message.get('content', '') for message in messages)
+        content = self.store.completion_for(prompt)
+        chunks = self._stream(model, prompt, content)
+        if stream:
+            return chunks
+        final = list(chunks)[-1]
+        final['message']['content'] = content
+        return final
+
+    def _stream(self, model, prompt, content):
+        started = time.perf_counter()
+        if self.config.first_token_ms:
+            time.sleep(self.config.first_token_ms / 1000)
+        prefill_ns = int((time.perf_counter() - started) * 1e9)
+        tokens = _tokenize(content)
+        for token in tokens:
+            if self.config.token_latency_ms:
+                time.sleep(self.config.token_latency_ms / 1000)
+            yield {'model': model, 'message': {'role': 'assistant', 'content': token}, 'done': False}
+        total_ns = int((time.perf_counter() - started) * 1e9)
+        yield {
+            'model': model, 'message': {'role': 'assistant', 'content': ''}, 'done': True,
+            'total_duration': total_ns, 'prompt_eval_count': len(_tokenize(prompt)),
+            'prompt_eval_duration': prefill_ns, 'eval_count': len(tokens),
+            'eval_duration': max(1, total_ns - prefill_ns),
+        }
+
+    def embed(self, model, input):
+        self.config.delay()
+        texts = [input] if isinstance(input, str) else input
+        return {'model': model, 'embeddings': [_embedding(text) for text in texts]}
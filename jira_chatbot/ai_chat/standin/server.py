@@ -0,0 +1,616 @@
+"""
+Local stand-in for Jira, Confluence and Ollama backed by recorded fixtures.
+
+Serves the REST endpoints JiraService and ollama_api use so ChatService can
+be benchmarked and load tested without network access. Point the settings
+at it with STANDIN_SERVER_URL=http://127.0.0.1:8765.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+from datetime import datetime, timezone
+import copy
+import json
+import logging
+import random
+import re
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FIXTURES = Path(__file__).resolve().parent / 'fixtures' / 'recorded.json'
+
+
+class StandinConfig:
+    """Latency and error injection settings for the stand-in server"""
+
+    def __init__(self, latency_ms=0, jitter_ms=0, token_latency_ms=0, first_token_ms=0,
+                 error_rate=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.token_latency_ms = token_latency_ms
+        self.first_token_ms = first_token_ms
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self):
+        """Sleep for the configured request latency plus jitter"""
+        with self._lock:
+            jitter = self.random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0
+        seconds = max(0.0, self.latency_ms + jitter) / 1000
+        if seconds:
+            time.sleep(seconds)
+
+    def should_fail(self):
+        """Decide whether to inject an error for this request"""
+        if not self.error_rate:
+            return False
+        with self._lock:
+            return self.random.random() < self.error_rate
+
+
+class FixtureStore:
+    """In-memory copy of the recorded fixtures, mutated by write requests"""
+
+    def __init__(self, path=DEFAULT_FIXTURES):
+        with open(path, encoding='utf-8') as f:
+            self.data = json.load(f)
+        self.lock = threading.Lock()
+        self.issues = {issue['key']: copy.deepcopy(issue) for issue in self.data['jira']['issues']}
+        self.pages = {page['id']: copy.deepcopy(page) for page in self.data['confluence']['pages']}
+        self._next_issue_id = 20000
+        self._next_page_id = 90000
+
+    # Jira
+
+    def project(self, key_or_id):
+        for project in self.data['jira']['projects']:
+            if key_or_id in (project['key'], project['id']):
+                return project
+        return None
+
+    def search_issues(self, jql):
+        """Evaluate the small subset of JQL that JiraService generates"""
+        jql_lower = jql.lower()
+        projects = None
+        match = re.search(r'project\s+in\s*\(([^)]*)\)', jql, re.IGNORECASE)
+        if match:
+            projects = {p.strip().strip('"').upper() for p in match.group(1).split(',')}
+        else:
+            match = re.search(r'project\s*=\s*"?(\w+)"?', jql, re.IGNORECASE)
+            if match:
+                projects = {match.group(1).upper()}
+
+        terms = {t.lower() for t in re.findall(r'~\s*"([^"]*)"', jql)}
+        done_only = re.search(r'statuscategory\s*=\s*"?done"?', jql_lower) is not None
+
+        with self.lock:
+            issues = list(self.issues.values())
+
+        results = []
+        for issue in issues:
+            fields = issue['fields']
+            if projects and fields['project']['key'] not in projects:
+                continue
+            if done_only and fields['status'].get('statusCategory', {}).get('key') != 'done':
+                continue
+            if terms:
+                comments = ' '.join(c['body'] for c in fields.get('comment', {}).get('comments', []))
+                haystack = f"{fields['summary']} {fields.get('description') or ''} {comments}".lower()
+                if not any(_matches(term, haystack) for term in terms):
+                    continue
+            results.append(issue)
+
+        results.sort(key=lambda i: i['fields']['updated'], reverse=True)
+        return results
+
+    def create_issue(self, fields):
+        project = self.project(fields['project'].get('key') or fields['project'].get('id'))
+        if not project:
+            return None
+        now = _jira_timestamp()
+        with self.lock:
+            number = 1 + max(
+                [int(k.split('-')[1]) for k in self.issues if k.startswith(project['key'] + '-')] or [0]
+            )
+            key = f"{project['key']}-{number}"
+            self._next_issue_id += 1
+            issue = {
+                'id': str(self._next_issue_id),
+                'key': key,
+                'fields': {
+                    'summary': fields.get('summary', ''),
+                    'description': fields.get('description'),
+                    'status': {'name': 'Open', 'statusCategory': {'key': 'new', 'name': 'To Do'}},
+                    'priority': fields.get('priority') or {'name': 'Medium'},
+                    'assignee': _assignee(fields.get('assignee')),
+                    'issuetype': fields.get('issuetype') or {'name': 'Task'},
+                    'project': {'id': project['id'], 'key': project['key'], 'name': project['name']},
+                    'created': now,
+                    'updated': now,
+                    'comment': {'comments': []},
+                },
+            }
+            self.issues[key] = issue
+        return issue
+
+    def get_issue(self, key_or_id):
+        with self.lock:
+            if key_or_id in self.issues:
+                return self.issues[key_or_id]
+            for issue in self.issues.values():
+                if issue['id'] == key_or_id:
+                    return issue
+        return None
+
+    def transition(self, issue, transition_id):
+        for transition in self.data['jira']['transitions']:
+            if transition['id'] == str(transition_id):
+                with self.lock:
+                    issue['fields']['status'] = copy.deepcopy(transition['to'])
+                    issue['fields']['updated'] = _jira_timestamp()
+                return True
+        return False
+
+    def add_comment(self, issue, body):
+        with self.lock:
+            comments = issue['fields'].setdefault('comment', {'comments': []})['comments']
+            comment = {
+                'id': str(30000 + len(comments)),
+                'body': body,
+                'created': _jira_timestamp(),
+                'author': {'displayName': self.data['jira']['myself']['displayName']},
+            }
+            comments.append(comment)
+            issue['fields']['updated'] = comment['created']
+        return comment
+
+    # Confluence
+
+    def search_pages(self, cql):
+        """Evaluate the small subset of CQL that JiraService generates"""
+        spaces = None
+        match = re.search(r'space\s*(?:=\s*"?(\w+)"?|in\s*\(([^)]*)\))', cql, re.IGNORECASE)
+        if match:
+            raw = match.group(1) or match.group(2)
+            spaces = {s.strip().strip('"').upper() for s in raw.split(',')}
+        terms = [t.lower() for t in re.findall(r'(?:text|title)\s*~\s*"([^"]*)"', cql, re.IGNORECASE)]
+        since = None
+        match = re.search(r'lastmodified\s*>=?\s*"([^"]+)"', cql, re.IGNORECASE)
+        if match:
+            since = _parse_cql_date(match.group(1))
+
+        with self.lock:
+            pages = list(self.pages.values())
+
+        results = []
+        for page in pages:
+            if spaces and page['space'].upper() not in spaces:
+                continue
+            if since and _parse_iso(page['lastModified']) < since:
+                continue
+            if terms:
+                haystack = f"{page['title']} {_strip_tags(page['body'])}".lower()
+                if not any(_matches(term, haystack) for term in terms):
+                    continue
+            results.append(page)
+
+        results.sort(key=lambda p: (p['lastModified'], int(p['id'])))
+        if not re.search(r'order\s+by\s+lastmodified\s+asc', cql, re.IGNORECASE):
+            results.reverse()
+        return results
+
+    def create_page(self, space_key, title, body):
+        with self.lock:
+            for page in self.pages.values():
+                if page['space'] == space_key and page['title'] == title:
+                    return None
+            self._next_page_id += 1
+            page = {
+                'id': str(self._next_page_id),
+                'title': title,
+                'space': space_key,
+                'version': 1,
+                'lastModified': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+                'body': body,
+            }
+            self.pages[page['id']] = page
+        return page
+
+    def space(self, key):
+        for space in self.data['confluence']['spaces']:
+            if space['key'] == key:
+                return space
+        return None
+
+    # Ollama
+
+    def completion_for(self, prompt):
+        for rule in self.data['ollama']['responses']:
+            if rule['match'].lower() in prompt.lower():
+                return rule['content']
+        return self.data['ollama']['default']
+
+
+def _jira_timestamp():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000+0000')
+
+
+def _parse_iso(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def _parse_cql_date(value):
+    for fmt in ('%Y/%m/%d %H:%M', '%Y-%m-%d %H:%M', '%Y/%m/%d', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, fmt).replace(tzinfo=timezone.utc)
+        except ValueError:
+            continue
+    return None
+
+
+STOPWORDS = {'the', 'and', 'for', 'about', 'with', 'all', 'any', 'how', 'what', 'can', 'you'}
+
+
+def _matches(term, haystack):
+    """Loose full-text match: any significant word of the term occurs in the text"""
+    words = [w for w in re.findall(r'\w+', term) if len(w) > 2 and w not in STOPWORDS]
+    return any(word in haystack for word in words) if words else term in haystack
+
+
+def _strip_tags(html):
+    return re.sub(r'<[^>]+>', ' ', html or '')
+
+
+def _assignee(value):
+    if not value:
+        return None
+    return {
+        'accountId': value.get('accountId', ''),
+        'emailAddress': value.get('emailAddress', ''),
+        'displayName': value.get('emailAddress') or value.get('accountId', ''),
+    }
+
+
+def _embedding(text, dims=256):
+    """Deterministic hashed bag-of-words vector standing in for a real embedding model"""
+    vector = [0.0] * dims
+    for word in re.findall(r'\w+', text.lower()):
+        if len(word) > 2 and word not in STOPWORDS:
+            vector[zlib.crc32(word[:6].encode('utf-8')) % dims] += 1.0
+    return vector
+
+
+def _tokenize(text):
+    """Split text into word-sized pieces the way a streaming model emits them"""
+    return re.findall(r'\s*\S+|\s+', text)
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    """Route Jira, Confluence and Ollama requests to the fixture store"""
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'AtlassianStandin/1.0'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    @property
+    def store(self):
+        return self.server.store
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def _dispatch(self, method):
+        parsed = urlparse(self.path)
+        path = parsed.path.rstrip('/') or '/'
+        if path.startswith('/wiki/'):
+            path = path[len('/wiki'):]
+        query = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+        body = self._read_body()
+
+        if path.startswith('/api/'):
+            route = self._ollama_route
+        elif path.startswith('/rest/api/2/') or path.startswith('/rest/api/3/'):
+            route = self._jira_route
+            path = path[len('/rest/api/2/'):]
+        elif path.startswith('/rest/api/'):
+            route = self._confluence_route
+            path = path[len('/rest/api/'):]
+        else:
+            return self._send_json(404, {'errorMessages': [f'Unknown path {parsed.path}']})
+
+        self.config.delay()
+        if self.config.should_fail():
+            return self._send_json(503, {'errorMessages': ['Injected failure from stand-in server']})
+
+        try:
+            route(method, path, query, body)
+        except BrokenPipeError:
+            pass
+        except Exception as e:
+            logger.exception(f"Stand-in failed to handle {method} {self.path}")
+            self._send_json(500, {'errorMessages': [str(e)]})
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return {}
+        raw = self.rfile.read(length)
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return {}
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_empty(self, status=204):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _base_url(self):
+        return f"http://{self.headers.get('Host', '127.0.0.1')}"
+
+    def _issue_payload(self, issue):
+        payload = copy.deepcopy(issue)
+        payload['self'] = f"{self._base_url()}/rest/api/2/issue/{issue['id']}"
+        return payload
+
+    # Jira
+
+    def _jira_route(self, method, path, query, body):
+        jira = self.store.data['jira']
+        parts = path.split('/')
+
+        if path == 'serverInfo':
+            return self._send_json(200, dict(jira['serverInfo'], baseUrl=self._base_url()))
+        if path == 'myself':
+            return self._send_json(200, jira['myself'])
+        if path == 'user/search':
+            term = (query.get('query') or query.get('username') or '').lower()
+            me = jira['myself']
+            matches = term and (term in me['emailAddress'].lower() or term in me['displayName'].lower())
+            user = dict(me, self=f"{self._base_url()}/rest/api/2/user?accountId={me['accountId']}")
+            return self._send_json(200, [user] if matches else [])
+        if path == 'field':
+            return self._send_json(200, [])
+        if path == 'project':
+            return self._send_json(200, jira['projects'])
+        if parts[0] == 'project' and len(parts) == 2:
+            project = self.store.project(parts[1])
+            if not project:
+                return self._send_json(404, {'errorMessages': ['No project could be found.']})
+            return self._send_json(200, dict(project, issueTypes=jira['issuetypes']))
+        if path == 'issuetype':
+            return self._send_json(200, jira['issuetypes'])
+        if path == 'search':
+            params = body if method == 'POST' else query
+            issues = self.store.search_issues(params.get('jql', ''))
+            start = int(params.get('startAt') or 0)
+            limit = int(params.get('maxResults') or 50)
+            page = issues[start:start + limit]
+            return self._send_json(200, {
+                'startAt': start,
+                'maxResults': limit,
+                'total': len(issues),
+                'issues': [self._issue_payload(i) for i in page],
+            })
+        if path == 'issue' and method == 'POST':
+            issue = self.store.create_issue(body.get('fields', {}))
+            if not issue:
+                return self._send_json(400, {'errors': {'project': 'valid project is required'}})
+            return self._send_json(201, {'id': issue['id'], 'key': issue['key'],
+                                         'self': self._issue_payload(issue)['self']})
+
+        if parts[0] == 'issue' and len(parts) >= 2:
+            issue = self.store.get_issue(parts[1])
+            if not issue:
+                return self._send_json(404, {'errorMessages': ['Issue does not exist or you do not have permission to see it.']})
+            if len(parts) == 2:
+                if method == 'PUT':
+                    fields = body.get('fields', {})
+                    if 'assignee' in fields:
+                        issue['fields']['assignee'] = _assignee(fields['assignee'])
+                    return self._send_empty()
+                return self._send_json(200, self._issue_payload(issue))
+            if parts[2] == 'transitions':
+                if method == 'POST':
+                    if not self.store.transition(issue, body.get('transition', {}).get('id')):
+                        return self._send_json(400, {'errorMessages': ['Transition id is not valid.']})
+                    return self._send_empty()
+                return self._send_json(200, {'transitions': jira['transitions']})
+            if parts[2] == 'comment':
+                if method == 'POST':
+                    return self._send_json(201, self.store.add_comment(issue, body.get('body', '')))
+                comments = issue['fields'].get('comment', {}).get('comments', [])
+                return self._send_json(200, {'comments': comments, 'total': len(comments)})
+
+        return self._send_json(404, {'errorMessages': [f'Unsupported Jira endpoint {method} {path}']})
+
+    # Confluence
+
+    def _page_payload(self, page, expand=''):
+        payload = {
+            'id': page['id'],
+            'type': 'page',
+            'status': 'current',
+            'title': page['title'],
+            'space': {'key': page['space']},
+            'version': {'number': page['version'], 'when': page['lastModified']},
+            '_links': {'webui': f"/spaces/{page['space']}/pages/{page['id']}"},
+        }
+        if 'body' in expand:
+            payload['body'] = {'storage': {'value': page['body'], 'representation': 'storage'}}
+        return payload
+
+    def _confluence_route(self, method, path, query, body):
+        parts = path.split('/')
+        start = int(query.get('start') or 0)
+        limit = int(query.get('limit') or 25)
+        expand = query.get('expand', '')
+
+        if path in ('search', 'content/search'):
+            pages = self.store.search_pages(query.get('cql', ''))
+            window = pages[start:start + limit]
+            if path == 'search':
+                results = [{
+                    'content': self._page_payload(p, expand),
+                    'title': p['title'],
+                    'excerpt': _strip_tags(p['body'])[:200].strip(),
+                    'url': f"/spaces/{p['space']}/pages/{p['id']}",
+                    'lastModified': p['lastModified'],
+                } for p in window]
+            else:
+                results = [self._page_payload(p, expand) for p in window]
+            return self._send_json(200, {
+                'results': results,
+                'start': start,
+                'limit': limit,
+                'size': len(results),
+                'totalSize': len(pages),
+            })
+        if path == 'space':
+            spaces = self.store.data['confluence']['spaces']
+            window = spaces[start:start + limit]
+            return self._send_json(200, {'results': window, 'start': start, 'limit': limit, 'size': len(window)})
+        if parts[0] == 'space' and len(parts) == 2:
+            space = self.store.space(parts[1])
+            if not space:
+                return self._send_json(404, {'message': f'No space with key : {parts[1]}'})
+            return self._send_json(200, space)
+        if path == 'content' and method == 'POST':
+            space_key = body.get('space', {}).get('key', '')
+            if not self.store.space(space_key):
+                return self._send_json(404, {'message': f'No space with key : {space_key}'})
+            html = body.get('body', {}).get('storage', {}).get('value', '')
+            page = self.store.create_page(space_key, body.get('title', ''), html)
+            if not page:
+                return self._send_json(400, {'message': 'A page with this title already exists'})
+            return self._send_json(200, self._page_payload(page, 'body'))
+        if path == 'content':
+            pages = [
+                p for p in self.store.pages.values()
+                if p['space'] == query.get('spaceKey', p['space']) and p['title'] == query.get('title', p['title'])
+            ]
+            results = [self._page_payload(p, expand) for p in pages[start:start + limit]]
+            return self._send_json(200, {'results': results, 'start': start, 'limit': limit, 'size': len(results)})
+        if parts[0] == 'content' and len(parts) == 2:
+            page = self.store.pages.get(parts[1])
+            if not page:
+                return self._send_json(404, {'message': 'No content found'})
+            return self._send_json(200, self._page_payload(page, expand))
+
+        return self._send_json(404, {'message': f'Unsupported Confluence endpoint {method} {path}'})
+
+    # Ollama
+
+    def _ollama_route(self, method, path, query, body):
+        model = body.get('model') or self.store.data['ollama']['model']
+        if path == '/api/tags':
+            return self._send_json(200, {'models': [{'name': self.store.data['ollama']['model']}]})
+        if path in ('/api/embed', '/api/embeddings'):
+            texts = body.get('input', body.get('prompt', ''))
+            texts = [texts] if isinstance(texts, str) else texts
+            return self._send_json(200, {'model': model, 'embeddings': [_embedding(t) for t in texts]})
+        if path not in ('/api/chat', '/api/generate'):
+            return self._send_json(404, {'error': f'Unsupported Ollama endpoint {path}'})
+
+        if path == '/api/chat':
+            prompt = '\n'.join(m.get('content', '') for m in body.get('messages', []))
+        else:
+            prompt = body.get('prompt', '')
+        content = self.store.completion_for(prompt)
+        tokens = _tokenize(content)
+        prompt_tokens = len(_tokenize(prompt))
+
+        def chunk(text, done=False):
+            payload = {'model': model, 'created_at': datetime.now(timezone.utc).isoformat(), 'done': done}
+            if path == '/api/chat':
+                payload['message'] = {'role': 'assistant', 'content': text}
+            else:
+                payload['response'] = text
+            return payload
+
+        started = time.perf_counter()
+        token_delay = self.config.token_latency_ms / 1000
+        if self.config.first_token_ms:
+            time.sleep(self.config.first_token_ms / 1000)
+        prefill_ns = int((time.perf_counter() - started) * 1e9)
+
+        def final():
+            total_ns = int((time.perf_counter() - started) * 1e9)
+            return dict(chunk('', done=True), done_reason='stop', total_duration=total_ns,
+                        load_duration=0, prompt_eval_count=prompt_tokens,
+                        prompt_eval_duration=prefill_ns, eval_count=len(tokens),
+                        eval_duration=max(1, total_ns - prefill_ns))
+
+        if body.get('stream', True) is False:
+            payload = final()
+            if path == '/api/chat':
+                payload['message']['content'] = content
+            else:
+                payload['response'] = content
+            return self._send_json(200, payload)
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for token in tokens:
+            if token_delay:
+                time.sleep(token_delay)
+            self._write_chunk(chunk(token))
+        self._write_chunk(final())
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+    def _write_chunk(self, payload):
+        data = (json.dumps(payload) + '\n').encode('utf-8')
+        self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+
+class StandinServer(ThreadingHTTPServer):
+    """Threaded HTTP server holding the fixture store and injection config"""
+
+    daemon_threads = True
+
+    def __init__(self, address, store=None, config=None):
+        super().__init__(address, StandinHandler)
+        self.store = store or FixtureStore()
+        self.config = config or StandinConfig()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_in_thread(host='127.0.0.1', port=0, fixtures=DEFAULT_FIXTURES, config=None):
+    """Start a stand-in server on a background thread, for benchmarks and tests"""
+    server = StandinServer((host, port), FixtureStore(fixtures), config)
+    thread = threading.Thread(target=server.serve_forever, name='standin-server', daemon=True)
+    thread.start()
+    return server
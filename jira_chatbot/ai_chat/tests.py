@@ -0,0 +1,655 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+from .cache import NamespacedCache
+from .chat_service import ChatService
+from .conversation_summary import ConversationSummarizer, conversation_summarizer
+from .framing import TokenCoalescer, _cut_point
+from .jira_pool import TOKEN_SESSION_KEY, JiraClientPool, session_token, store_session_token
+from .jira_service import JiraService, space_registry
+from .metrics import Registry
+from .knowledge_index import KnowledgeIndex, build_knowledge_index
+from .models import ChatSession, ChatMessage, ConfluencePage, ConfluenceSyncState, KnowledgeBase
+from .query_plans import hot_queries, uses_index
+from .session_listing import SESSION_LIST_LIMIT, get_session_listing
+from .standin.fakes import FakeConfluence, FakeOllama
+from .standin.server import FixtureStore
+from .write_behind import WriteBehindQueue
+import json
+import pstats
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+# Each test run gets in-memory caches instead of the shared file cache
+LOCAL_CACHES = {
+    alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': f"tests-{alias}"}
+    for alias in settings.CACHES
+}
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class CacheIsolatedTestCase(TestCase):
+    """Starts every test with empty caches"""
+
+    def setUp(self):
+        super().setUp()
+        for alias in LOCAL_CACHES:
+            caches[alias].clear()
+
+
+class SessionListingQueryTests(CacheIsolatedTestCase):
+    """The sidebar listing must not issue a query per session"""
+
+    def _create_sessions(self, user, count, messages=3):
+        for i in range(count):
+            session = ChatSession.objects.create(session_id=f"{user.username}-{i}", user=user)
+            ChatMessage.objects.bulk_create(
+                ChatMessage(session=session, user_message=f"Question {j} in session {i}", bot_response="Answer")
+                for j in range(messages)
+            )
+
+    def test_listing_query_count_is_constant(self):
+        user = User.objects.create(username='many-sessions')
+        self._create_sessions(user, SESSION_LIST_LIMIT + 10)
+
+        # One annotated SELECT plus one bulk title backfill
+        with self.assertNumQueries(2):
+            listing = get_session_listing(user)
+        self.assertEqual(len(listing), SESSION_LIST_LIMIT)
+        self.assertTrue(all(row['message_count'] == 3 for row in listing))
+        self.assertTrue(all(row['title'].startswith('Question 0') for row in listing))
+
+        # Served from the cache until a message is written
+        with self.assertNumQueries(0):
+            get_session_listing(user)
+
+    def test_titled_sessions_need_one_query(self):
+        user = User.objects.create(username='titled-sessions')
+        self._create_sessions(user, 5)
+        ChatSession.objects.filter(user=user).update(title='Printer trouble')
+
+        with self.assertNumQueries(1):
+            listing = get_session_listing(user)
+        self.assertEqual({row['title'] for row in listing}, {'Printer trouble'})
+
+    def test_sidebar_endpoint_does_not_scale_with_sessions(self):
+        counts = []
+        for username, sessions in (('few-sessions', 2), ('more-sessions', SESSION_LIST_LIMIT)):
+            user = User.objects.create(username=username)
+            self._create_sessions(user, sessions)
+            self.client.force_login(user)
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.get('/api/chat-sessions/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json()['sessions']), sessions)
+            counts.append(len(captured.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+class QueryPlanTests(TestCase):
+    """The hot chat queries must be answered from their composite indexes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        users = User.objects.bulk_create([User(username=f"plan-{i}") for i in range(5)])
+        sessions = ChatSession.objects.bulk_create(
+            ChatSession(session_id=f"plan-{i}", user=users[i % len(users)]) for i in range(50)
+        )
+        ChatMessage.objects.bulk_create(
+            ChatMessage(session=sessions[i % len(sessions)], user_message=f"Question {i}", bot_response="Answer")
+            for i in range(2000)
+        )
+        cls.session, cls.user = sessions[0], users[0]
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute('ANALYZE')
+            elif connection.vendor == 'postgresql':
+                # Tables this small would be scanned sequentially regardless of the indexes
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def test_hot_queries_use_their_indexes(self):
+        for name, index_name, build in hot_queries(self.session, self.user):
+            with self.subTest(query=name):
+                index_used, plan = uses_index(build(), index_name)
+                self.assertTrue(index_used, f"{name} does not use {index_name}:\n{plan}")
+
+
+class ConfluenceSpaceRegistryTests(CacheIsolatedTestCase):
+    """Space lookups come from the registry; a miss reloads it once per interval"""
+
+    def setUp(self):
+        super().setUp()
+        self.store = FixtureStore()
+        self.confluence = FakeConfluence(self.store)
+        self.service = JiraService.__new__(JiraService)
+        self.service.confluence = self.confluence
+        self.service.confluence_available = True
+
+    def _add_space(self, key):
+        self.store.data['confluence']['spaces'].append({'key': key, 'name': f"{key} space"})
+
+    def test_miss_reloads_once_per_interval(self):
+        with mock.patch.object(self.confluence, 'get_all_spaces', wraps=self.confluence.get_all_spaces) as get_all_spaces, \
+                self.assertLogs('ai_chat.jira_service', 'INFO') as logs:
+            self.assertTrue(self.service.has_confluence_space('ITSUPPORT'))
+            self._add_space('NEWSPACE')
+            self.assertTrue(self.service.has_confluence_space('NEWSPACE'))
+            loads = get_all_spaces.call_count
+
+            # Unknown spaces within the refresh interval are answered from memory
+            self.assertFalse(self.service.has_confluence_space('MISSING'))
+            self.assertFalse(self.service.has_confluence_space('MISSING'))
+            self.assertEqual(get_all_spaces.call_count, loads)
+        self.assertIn('NEWSPACE not in the registry', '\n'.join(logs.output))
+
+    def test_not_found_on_create_invalidates_registry(self):
+        with mock.patch.object(space_registry, 'invalidate') as invalidate, \
+                self.assertLogs('ai_chat.jira_service', 'ERROR'), self.assertRaises(Exception):
+            self.service.create_confluence_page('GONE', 'Title', '<p>Body</p>')
+        invalidate.assert_called_once()
+
+
+class ConfluenceSyncTests(TestCase):
+    """Sync pages by lastmodified keyset so concurrent edits neither skip nor duplicate pages"""
+
+    def setUp(self):
+        self.store = FixtureStore()
+        self.store.pages = {}
+        self.confluence = FakeConfluence(self.store)
+        self.service = JiraService.__new__(JiraService)
+        self.service.confluence = self.confluence
+        self.service.confluence_available = True
+
+    def _add_page(self, page_id, modified):
+        self.store.pages[page_id] = {
+            'id': page_id, 'title': f"Page {page_id}", 'space': 'SYNC', 'version': 1,
+            'lastModified': modified, 'body': f"<p>Body {page_id}</p>",
+        }
+
+    def _sync(self, **kwargs):
+        with self.assertLogs('ai_chat.jira_service', 'INFO'):
+            return self.service.sync_confluence_pages(['SYNC'], batch_size=3, **kwargs)['SYNC']
+
+    def test_page_edited_mid_sync_does_not_skip_others(self):
+        for n in range(1, 8):
+            self._add_page(str(n), f"2025-09-01T10:0{n}:00.000Z")
+        cql = self.confluence.cql
+
+        def edit_after_first_batch(*args, **kwargs):
+            response = cql(*args, **kwargs)
+            page = self.store.pages['1']
+            if page['version'] == 1:
+                page.update(version=2, lastModified='2025-09-01T10:30:00.000Z')
+            return response
+
+        with mock.patch.object(self.confluence, 'cql', side_effect=edit_after_first_batch):
+            stats = self._sync()
+
+        self.assertEqual(stats, {'created': 7, 'updated': 1, 'unchanged': 0})
+        self.assertEqual(
+            dict(ConfluencePage.objects.values_list('page_id', 'version')),
+            {'1': 2, **{str(n): 1 for n in range(2, 8)}},
+        )
+        state = ConfluenceSyncState.objects.get(space_key='SYNC')
+        self.assertEqual(state.cursor.isoformat(), '2025-09-01T10:30:00+00:00')
+
+    def test_minute_with_more_pages_than_a_batch(self):
+        for n in range(1, 6):
+            self._add_page(str(n), f"2025-09-01T10:00:0{n}.000Z")
+        self.assertEqual(self._sync(), {'created': 5, 'updated': 0, 'unchanged': 0})
+        self.assertEqual(self._sync(), {'created': 0, 'updated': 0, 'unchanged': 5})
+
+    def test_failed_sync_keeps_cursor_at_last_stored_page(self):
+        for n in range(1, 8):
+            self._add_page(str(n), f"2025-09-01T10:0{n}:00.000Z")
+        cql = self.confluence.cql
+        with mock.patch.object(self.confluence, 'cql', side_effect=[cql('space = "SYNC" order by lastmodified asc', limit=3),
+                                                                     Exception('boom')]):
+            with self.assertLogs('ai_chat.jira_service', 'ERROR'):
+                self.assertEqual(self.service.sync_confluence_pages(['SYNC'], batch_size=3), {'SYNC': {'error': 'boom'}})
+
+        self.assertEqual(sorted(ConfluencePage.objects.values_list('page_id', flat=True)), ['1', '2', '3'])
+        state = ConfluenceSyncState.objects.get(space_key='SYNC')
+        self.assertEqual(state.cursor.isoformat(), '2025-09-01T10:03:00+00:00')
+
+        stats = self._sync()
+        self.assertEqual(stats, {'created': 4, 'updated': 0, 'unchanged': 1})
+
+
+class KnowledgeIndexBuildTests(TestCase):
+    """A build becomes searchable only once its rows are committed"""
+
+    def setUp(self):
+        self.tmp_dir = Path(tempfile.mkdtemp(prefix='knowledge-index-'))
+        self.addCleanup(shutil.rmtree, self.tmp_dir, ignore_errors=True)
+        self.index = KnowledgeIndex(self.tmp_dir / 'knowledge_index.npy')
+        self.jira_service = SimpleNamespace(jira_available=False)
+        patcher = mock.patch('ai_chat.ollama_api.get_client', return_value=FakeOllama(FixtureStore()))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _page(self, page_id, title, content):
+        ConfluencePage.objects.create(
+            page_id=page_id, title=title, content=content, space_key='ITSUPPORT', last_updated=timezone.now()
+        )
+
+    def _build(self):
+        with self.captureOnCommitCallbacks(execute=True), self.assertLogs('ai_chat.knowledge_index', 'INFO'):
+            build_knowledge_index(self.jira_service, index=self.index)
+        return self.index.current()[1]
+
+    def test_build_activates_after_commit(self):
+        self._page('1', 'Printer troubleshooting', 'Restart the print spooler and clear the queue.')
+        version = self._build()
+        self.assertTrue(version)
+        hits = self.index.search('print spooler queue', min_score=0)
+        self.assertTrue(hits)
+        self.assertTrue(all(entry.index_version == version for entry, _ in hits))
+
+    def test_query_from_another_embedding_model_finds_nothing(self):
+        self._page('1', 'Printer troubleshooting', 'Restart the print spooler and clear the queue.')
+        self._build()
+        dimensions = self.index.matrix().shape[1]
+        with mock.patch('ai_chat.knowledge_index.embed_texts', return_value=[[0.1] * (dimensions + 8)]), \
+                self.assertLogs('ai_chat.knowledge_index', 'WARNING') as logs:
+            self.assertEqual(self.index.search('print spooler queue', min_score=0), [])
+        self.assertIn('rebuild it', logs.output[0])
+
+    def test_rolled_back_build_keeps_current_index(self):
+        self._page('1', 'Printer troubleshooting', 'Restart the print spooler and clear the queue.')
+        version = self._build()
+        with mock.patch.object(KnowledgeBase.objects, 'bulk_create', side_effect=RuntimeError('disk full')), \
+                self.assertRaises(RuntimeError), self.captureOnCommitCallbacks(execute=True):
+            build_knowledge_index(self.jira_service, index=self.index)
+        self.assertEqual(self.index.current()[1], version)
+        self.assertEqual(sorted(p.name for p in self.tmp_dir.iterdir()),
+                         sorted(['knowledge_index.npy.current', f"knowledge_index.{version}.npy"]))
+
+    def test_reader_never_pairs_old_vectors_with_new_rows(self):
+        self._page('1', 'Printer troubleshooting', 'Restart the print spooler and clear the queue.')
+        self._build()
+        reader = KnowledgeIndex(self.index.path)
+        old_matrix, old_version = reader.current()
+
+        self._page('2', 'VPN setup', 'Install the VPN client and sign in with your account.')
+        new_version = self._build()
+        self.assertNotEqual(new_version, old_version)
+        # A reader still holding the old matrix finds none of the new build's rows
+        with mock.patch.object(reader, 'current', return_value=(old_matrix, old_version)):
+            self.assertEqual(reader.search('print spooler queue', min_score=0), [])
+        self.assertTrue(reader.search('print spooler queue', min_score=0))
+
+
+class WriteBehindVisibilityTests(CacheIsolatedTestCase):
+    """A reply queued by one worker is visible to the others before it is saved"""
+
+    def setUp(self):
+        super().setUp()
+        self.journal_dir = Path(tempfile.mkdtemp(prefix='write-behind-'))
+        self.addCleanup(shutil.rmtree, self.journal_dir, ignore_errors=True)
+        user = User.objects.create(username='write-behind')
+        self.session = ChatSession.objects.create(session_id='write-behind-1', user=user)
+
+    def _journal_of_other_worker(self, *records):
+        with open(self.journal_dir / 'chat-999-abcdef12.jsonl', 'w', encoding='utf-8') as journal:
+            for record in records:
+                journal.write(json.dumps(record) + '\n')
+            journal.write('{"torn": ')  # Line still being written
+
+    def _record(self, session_pk, user_message):
+        return {
+            'message_uid': str(uuid.uuid4()), 'session': session_pk, 'user': None,
+            'user_message': user_message, 'bot_response': 'Answer', 'intent_detected': 'general_chat',
+            'created_at': timezone.now().isoformat(), 'llm_usage': [],
+        }
+
+    def test_pending_messages_include_other_workers_journals(self):
+        self._journal_of_other_worker(
+            self._record(self.session.pk, 'Is the VPN down?'), self._record(self.session.pk + 1, 'Other session')
+        )
+        queue = WriteBehindQueue(journal_dir=str(self.journal_dir))
+        self.assertEqual([m.user_message for m in queue.pending_messages(self.session.pk)], ['Is the VPN down?'])
+
+    def test_context_includes_turn_saved_by_another_worker(self):
+        self._journal_of_other_worker(self._record(self.session.pk, 'Is the VPN down?'))
+        self.session.conversation_context = {'summary': '', 'recent': [], 'summarized_turns': 0}
+        with override_settings(CHAT_WRITE_BEHIND_DIR=self.journal_dir):
+            pending = WriteBehindQueue().pending_messages(self.session.pk)
+        context = conversation_summarizer.context_for(self.session, pending)
+        self.assertIn('User: Is the VPN down?', context)
+
+    def _queue_without_writer(self):
+        """A queue whose journal is open but whose writer thread never runs"""
+        queue = WriteBehindQueue(journal_dir=str(self.journal_dir), batch_size=100)
+        queue._open_journal()
+        queue._thread = object()
+        self.addCleanup(lambda: [journal.close() for journal in queue._segment_files.values()])
+        return queue
+
+    def test_committed_journal_segments_are_deleted_under_steady_traffic(self):
+        queue = self._queue_without_writer()
+        with override_settings(CHAT_WRITE_BEHIND_FSYNC=False):
+            batch = [queue.enqueue(self.session, f"Question {n}", 'Answer', 'general_chat') for n in range(3)]
+            # Another reply arrives before the batch commits, so something is always queued
+            queued = queue.enqueue(self.session, 'Question 3', 'Answer', 'general_chat')
+            queue._write_with_retry([queue._pending[uid] for uid in batch])
+            self.assertEqual(len(list(self.journal_dir.glob('chat-*.jsonl'))), 2)
+
+            queue.enqueue(self.session, 'Question 4', 'Answer', 'general_chat')
+            queue._write_with_retry([queue._pending[queued]])
+
+        # Only the reply still queued is left on disk
+        lines = [line for journal in self.journal_dir.glob('chat-*.jsonl') for line in journal.read_text().splitlines()]
+        self.assertEqual([json.loads(line)['user_message'] for line in lines], ['Question 4'])
+
+    @override_settings(CHAT_WRITE_BEHIND_MAX_ATTEMPTS=2, CHAT_WRITE_BEHIND_FSYNC=False)
+    def test_poison_message_is_dead_lettered_and_the_rest_saved(self):
+        queue = self._queue_without_writer()
+        uids = [queue.enqueue(self.session, text, 'Answer', 'general_chat') for text in ('Fine', 'Poison', 'Also fine')]
+        write = queue._write
+
+        def failing_write(records):
+            if any(r['user_message'] == 'Poison' for r in records):
+                raise ValueError('cannot be saved')
+            write(records)
+
+        with mock.patch.object(queue, '_write', side_effect=failing_write), \
+                mock.patch('ai_chat.write_behind.time.sleep'), self.assertLogs('ai_chat.write_behind', 'ERROR'):
+            queue._write_with_retry([queue._pending[uid] for uid in uids])
+
+        self.assertEqual(
+            sorted(ChatMessage.objects.filter(session=self.session).values_list('user_message', flat=True)),
+            ['Also fine', 'Fine']
+        )
+        dead = [json.loads(line) for line in (self.journal_dir / 'dead-letter.jsonl').read_text().splitlines()]
+        self.assertEqual([record['user_message'] for record in dead], ['Poison'])
+        self.assertEqual(queue._pending, {})
+
+    def test_journal_is_fsynced_before_enqueue_returns(self):
+        queue = self._queue_without_writer()
+        with mock.patch('ai_chat.write_behind.os.fsync') as fsync:
+            queue.enqueue(self.session, 'Hello', 'Hi', 'general_chat')
+        fsync.assert_called_once_with(queue._journal.fileno())
+
+
+class ConversationContextTests(CacheIsolatedTestCase):
+    """Concurrent turns and compactions must not overwrite each other"""
+
+    def setUp(self):
+        super().setUp()
+        self.session = ChatSession.objects.create(session_id='context-1')
+        self.summarizer = ConversationSummarizer()
+        scheduled = mock.patch.object(self.summarizer, '_schedule')
+        scheduled.start()
+        self.addCleanup(scheduled.stop)
+
+    def _exchange(self, number):
+        self.summarizer.append_exchanges(self.session.pk, [(f"turn-{number}", f"Question {number}", f"Answer {number}")])
+
+    def _stored(self):
+        return ChatSession.objects.get(pk=self.session.pk).conversation_context
+
+    def test_turn_appended_during_compaction_is_kept(self):
+        for number in range(5):
+            self._exchange(number)
+
+        def summarize(summary, turns):
+            self._exchange(5)  # Another worker answers while the LLM call runs
+            return 'Asked question 0'
+
+        with mock.patch.object(self.summarizer, '_summarize', side_effect=summarize):
+            self.summarizer._compact(self.session.pk)
+
+        state = self._stored()
+        self.assertEqual(state['summary'], 'Asked question 0')
+        self.assertEqual(state['summarized_turns'], 1)
+        self.assertEqual([turn['id'] for turn in state['recent']], [f"turn-{n}" for n in range(1, 6)])
+
+    def test_compaction_after_another_workers_compaction_is_dropped(self):
+        for number in range(5):
+            self._exchange(number)
+
+        def summarize(summary, turns):
+            other = ConversationSummarizer()
+            with mock.patch.object(other, '_summarize', return_value='Stored by another worker'):
+                other._compact(self.session.pk)
+            return 'Stale summary'
+
+        with mock.patch.object(self.summarizer, '_summarize', side_effect=summarize):
+            self.summarizer._compact(self.session.pk)
+
+        state = self._stored()
+        self.assertEqual(state['summary'], 'Stored by another worker')
+        self.assertEqual(state['summarized_turns'], 1)
+        self.assertEqual(len(state['recent']), 4)
+
+    def test_batch_write_appends_its_turns_once(self):
+        records = [{
+            'message_uid': str(uuid.uuid4()), 'session': self.session.pk, 'user': None,
+            'user_message': f"Question {number}", 'bot_response': 'Answer', 'intent_detected': 'general_chat',
+            'created_at': timezone.now().isoformat(), 'llm_usage': [],
+        } for number in range(2)]
+        queue = WriteBehindQueue()
+        queue._write(records)
+        self.assertEqual([turn['id'] for turn in self._stored()['recent']], [r['message_uid'] for r in records])
+
+        # Folded into the summary, then the journal is replayed after a crash
+        ChatSession.update_context(self.session.pk, lambda state: dict(state, summary='Two questions', recent=[]))
+        queue._write(records)
+        self.assertEqual(self._stored()['recent'], [])
+        self.assertEqual(ChatMessage.objects.filter(session=self.session).count(), 2)
+
+    def test_update_context_retries_after_a_concurrent_write(self):
+        calls = []
+
+        def mutate(state):
+            calls.append(dict(state))
+            if len(calls) == 1:
+                ChatSession.update_context(self.session.pk, lambda s: dict(s, other='written meanwhile'))
+            return dict(state, mine=True)
+
+        ChatSession.update_context(self.session.pk, mutate)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self._stored(), {'other': 'written meanwhile', 'mine': True})
+        self.assertEqual(ChatSession.objects.get(pk=self.session.pk).context_version, 2)
+
+
+class NamespacedCacheTests(CacheIsolatedTestCase):
+    """Cleared keys stay cleared even when culling evicts the generation key"""
+
+    def test_evicted_generation_does_not_bring_back_cleared_keys(self):
+        cache = NamespacedCache('jira')
+        cache.set('search:vpn', ['IT-1'])
+        cache.clear()
+        self.assertIsNone(cache.get('search:vpn'))
+
+        # What MAX_ENTRIES culling does to the generation key
+        cache.backend.delete('__generation__', version=0)
+        other_worker = NamespacedCache('jira')
+        self.assertIsNone(other_worker.get('search:vpn'))
+
+        other_worker.set('search:vpn', ['IT-2'])
+        cache._generation = None  # Past GENERATION_TTL
+        self.assertEqual(cache.get('search:vpn'), ['IT-2'])
+
+
+class SessionTokenTests(TestCase):
+    """The Jira token kept in the login session is encrypted and expires"""
+
+    def test_token_is_stored_encrypted(self):
+        session = {}
+        store_session_token(session, 'atlassian-api-token')
+        self.assertNotIn('atlassian-api-token', session[TOKEN_SESSION_KEY])
+        self.assertEqual(session_token(session), 'atlassian-api-token')
+
+    @override_settings(JIRA_TOKEN_SESSION_TTL=60)
+    def test_expired_token_is_dropped(self):
+        session = {}
+        with mock.patch('time.time', return_value=time.time() - 120):
+            store_session_token(session, 'atlassian-api-token')
+        self.assertIsNone(session_token(session))
+        self.assertNotIn(TOKEN_SESSION_KEY, session)
+
+    def test_plaintext_token_from_older_sessions_is_dropped(self):
+        session = {TOKEN_SESSION_KEY: 'atlassian-api-token'}
+        self.assertIsNone(session_token(session))
+        self.assertNotIn(TOKEN_SESSION_KEY, session)
+
+
+class MetricsTests(CacheIsolatedTestCase):
+    """/metrics is closed by default and merges every worker's snapshot"""
+
+    def test_anonymous_scrape_is_refused_without_a_token(self):
+        with self.assertLogs('django.request', 'WARNING'):
+            self.assertEqual(self.client.get('/metrics').status_code, 401)
+
+    def test_staff_can_read_metrics(self):
+        self.client.force_login(User.objects.create(username='ops', is_staff=True))
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    @override_settings(METRICS_TOKEN='scrape-secret')
+    def test_scraper_needs_the_token(self):
+        with self.assertLogs('django.request', 'WARNING'):
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-secret')
+        self.assertEqual(response.status_code, 200)
+
+    def test_concurrent_workers_keep_their_own_snapshots(self):
+        workers = [Registry() for _ in range(3)]
+        for number, worker in enumerate(workers):
+            histogram = worker.histogram('test_seconds', 'Test', ('intent',))
+            histogram.observe(number + 1, intent='general_chat')
+            worker.flush()
+
+        merged = workers[0].collect()['test_seconds'][('general_chat',)]
+        self.assertEqual(sum(merged[:-1]), 3)
+        self.assertEqual(merged[-1], 6)
+        self.assertEqual(len({worker.slot for worker in workers}), 3)
+
+
+class ProfilingTests(CacheIsolatedTestCase):
+    """A profiled chat message is processed where cProfile can see it"""
+
+    def setUp(self):
+        super().setUp()
+        self.profile_dir = Path(tempfile.mkdtemp(prefix='profiles-'))
+        self.addCleanup(shutil.rmtree, self.profile_dir, ignore_errors=True)
+        self.client.force_login(User.objects.create(username='profiler', is_staff=True))
+
+    def test_profile_of_a_streamed_message_includes_processing(self):
+        def process_message(service, user_message):
+            return 'Profiled reply'
+
+        with override_settings(PROFILE_DIR=self.profile_dir), \
+                mock.patch.object(ChatService, 'process_message', process_message), \
+                mock.patch.object(ChatService, '_get_jira_service', lambda service, token: None):
+            response = self.client.post('/chat/profiled/', {'user_input': 'Hello'}, HTTP_X_PROFILE='1')
+            with self.assertLogs('ai_chat.profiling', 'INFO'):
+                body = b''.join(response.streaming_content)
+
+        self.assertEqual(body, b'Profiled reply')
+        stats = pstats.Stats(str(self.profile_dir / response['X-Profile']))
+        self.assertTrue(
+            any(function == 'process_message' for _, _, function in stats.stats),
+            "the message was processed outside the profiled thread"
+        )
+
+
+class FramingTests(TestCase):
+    """Chunks are cut at sentence ends that exist, not at missing ones"""
+
+    def test_missing_sentence_end_is_not_a_cut_point(self):
+        self.assertEqual(_cut_point('abcdef', 3), 3)
+        self.assertEqual(_cut_point('ab cdef', 3), 3)
+        self.assertEqual(_cut_point('Hi. there', 5), 4)
+
+    def test_small_chunks_are_full_sized(self):
+        reply = 'Restart the printer spooler and try again' * 5
+        for chunk_size in (2, 3):
+            with self.subTest(chunk_size=chunk_size):
+                coalescer = TokenCoalescer(chunk_size=chunk_size, max_delay=60)
+                chunks = []
+                for character in reply:
+                    chunks.extend(coalescer.add(character))
+                chunks.extend(coalescer.flush())
+                self.assertEqual(''.join(chunks), reply)
+                single = sum(1 for chunk in chunks[1:] if len(chunk) == 1)
+                self.assertLess(single, len(chunks) // 4)
+
+
+class JiraClientPoolTests(TestCase):
+    """Building one user's client never holds up another user's checkout"""
+
+    def setUp(self):
+        self.pool = JiraClientPool()
+        self.slow_login = threading.Event()
+        self.builds = []
+        self.clients = []
+
+        def build(profile, api_token):
+            self.builds.append(profile.pk)
+            if profile.pk == 1:
+                self.slow_login.wait(5)
+            client = mock.Mock()
+            self.clients.append(client)
+            return client
+
+        patcher = mock.patch.object(self.pool, '_build', side_effect=build)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _checkout(self, pk, results):
+        results.append(self.pool._checkout(SimpleNamespace(pk=pk), 'token'))
+
+    def _wait_for_builds(self, count):
+        deadline = time.monotonic() + 2
+        while len(self.builds) < count:
+            if time.monotonic() > deadline:
+                self.slow_login.set()
+                self.fail(f"only {len(self.builds)} of {count} clients were being built at once")
+            time.sleep(0.001)
+
+    def test_slow_build_does_not_block_other_users(self):
+        slow = []
+        thread = threading.Thread(target=self._checkout, args=(1, slow))
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.slow_login.set)
+        self._wait_for_builds(1)
+
+        fast = []
+        other = threading.Thread(target=self._checkout, args=(2, fast))
+        other.start()
+        other.join(2)
+        self.assertEqual(len(fast), 1, "checkout of user 2 waited for user 1's login")
+        self.assertFalse(slow)
+
+    def test_client_pooled_first_is_kept(self):
+        results = []
+        threads = [threading.Thread(target=self._checkout, args=(1, results)) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        self._wait_for_builds(2)
+        self.slow_login.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertIs(results[0], results[1])
+        self.assertEqual(results[0].leases, 2)
+        self.assertEqual(self.pool.stats()['clients'], 1)
+        spare = next(client for client in self.clients if client is not results[0].client)
+        spare.close.assert_called_once()
+        results[0].client.close.assert_not_called()
+
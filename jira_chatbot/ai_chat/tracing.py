@@ -0,0 +1,214 @@
+"""
+Per-request correlation IDs, span timings and non-blocking structured logging.
+
+RequestTracingMiddleware gives every request an ID (the incoming X-Request-ID
+header when it looks sane, otherwise a new one) and echoes it on the response.
+The ID is held in a ContextVar, so every log record written while the request
+runs carries it, as do the X-Request-ID headers sent to Jira, Confluence and
+Ollama. Stage and HTTP timings recorded through ai_chat.metrics are added to
+the request's spans; requests slower than SLOW_REQUEST_MS are logged with that
+breakdown.
+
+Records are handed to a queue and written by a listener thread, so request
+threads never wait on stderr. DEBUG records are kept for a LOG_SAMPLE_RATE
+fraction of requests only.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from logging.handlers import QueueHandler, QueueListener
+import atexit
+import json
+import logging
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+_VALID_REQUEST_ID = re.compile(r'^[A-Za-z0-9._:-]{8,128}$')
+
+_current_trace = ContextVar('request_trace', default=None)
+
+
+class Trace:
+    """Correlation ID, sampling decision and span timings of one request"""
+
+    def __init__(self, request_id=None, sampled=True):
+        self.request_id = request_id or uuid.uuid4().hex
+        self.sampled = sampled
+        self.started = time.perf_counter()
+        self.spans = {}  # name -> [count, total seconds]
+
+    def add_span(self, name, seconds):
+        span = self.spans.setdefault(name, [0, 0.0])
+        span[0] += 1
+        span[1] += seconds
+
+    def breakdown(self):
+        """Spans slowest first, e.g. 'handler=812ms llm=790ms jira.GET=15ms(x2)'"""
+        parts = []
+        for name, (count, total) in sorted(self.spans.items(), key=lambda item: -item[1][1]):
+            parts.append(f"{name}={total * 1000:.0f}ms" + (f"(x{count})" if count > 1 else ''))
+        return ' '.join(parts)
+
+
+def current_request_id():
+    trace = _current_trace.get()
+    return trace.request_id if trace else None
+
+
+def record_span(name, seconds):
+    """Add a timing to the current request's spans, if there is one"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_span(name, seconds)
+
+
+def debug_enabled(log):
+    """True if a DEBUG record from this logger would be kept for the current request"""
+    if not log.isEnabledFor(logging.DEBUG):
+        return False
+    trace = _current_trace.get()
+    return trace is None or trace.sampled
+
+
+@contextmanager
+def traced(request_id=None):
+    """Run a block under a trace, e.g. a management command or a background job"""
+    trace = Trace(request_id, sampled=random.random() < settings.LOG_SAMPLE_RATE)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+class RequestTracingMiddleware:
+    """Assign a correlation ID to each request and log slow requests with their span breakdown"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        incoming = request.headers.get(REQUEST_ID_HEADER, '')
+        trace = Trace(
+            incoming if _VALID_REQUEST_ID.match(incoming) else None,
+            sampled=random.random() < settings.LOG_SAMPLE_RATE,
+        )
+        request.request_id = trace.request_id
+        token = _current_trace.set(trace)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_trace.reset(token)
+        response[REQUEST_ID_HEADER] = trace.request_id
+
+        if response.streaming:
+            # The chat reply is produced while the body is iterated, after this returns
+            response.streaming_content = self._stream(trace, request, response, iter(response.streaming_content))
+        else:
+            self._finish(trace, request, response)
+        return response
+
+    def _stream(self, trace, request, response, chunks):
+        try:
+            while True:
+                # Each chunk runs under the request's trace, whichever thread iterates the body
+                token = _current_trace.set(trace)
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    return
+                finally:
+                    _current_trace.reset(token)
+                yield chunk
+        finally:
+            self._finish(trace, request, response)
+
+    def _finish(self, trace, request, response):
+        elapsed_ms = (time.perf_counter() - trace.started) * 1000
+        token = _current_trace.set(trace)
+        try:
+            if elapsed_ms >= settings.SLOW_REQUEST_MS:
+                logger.warning(
+                    f"Slow request {request.method} {request.path} {response.status_code} "
+                    f"{elapsed_ms:.0f}ms: {trace.breakdown() or 'no spans'}",
+                    extra={'duration_ms': round(elapsed_ms, 1), 'spans': {
+                        name: round(total * 1000, 1) for name, (count, total) in trace.spans.items()
+                    }},
+                )
+            else:
+                logger.debug(f"{request.method} {request.path} {response.status_code} {elapsed_ms:.0f}ms")
+        finally:
+            _current_trace.reset(token)
+
+
+def add_request_id_header(request):
+    """httpx request hook tagging calls to Ollama with the current correlation ID"""
+    request_id = current_request_id()
+    if request_id:
+        request.headers[REQUEST_ID_HEADER] = request_id
+
+
+class RequestContextFilter(logging.Filter):
+    """Attach the correlation ID to records and drop DEBUG records of unsampled requests"""
+
+    def filter(self, record):
+        trace = _current_trace.get()
+        record.request_id = trace.request_id if trace else '-'
+        return record.levelno > logging.DEBUG or trace is None or trace.sampled
+
+
+# LogRecord attributes that are not extra fields passed by the caller
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'request_id'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, including any extra= fields"""
+
+    def format(self, record):
+        payload = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S') + f".{int(record.msecs):03d}",
+            'level': record.levelname,
+            'logger': record.name,
+            'request_id': getattr(record, 'request_id', '-'),
+            'message': record.getMessage(),
+        }
+        payload.update({key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES})
+        if record.exc_info:
+            payload['exception'] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str, ensure_ascii=False)
+
+
+class BackgroundStreamHandler(QueueHandler):
+    """Queue records for a listener thread that formats and writes them to a stream"""
+
+    def __init__(self, stream=None, maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+        self.target = logging.StreamHandler(stream or sys.stderr)
+        self.dropped = 0
+        self.listener = QueueListener(self.queue, self.target)
+        self.listener.start()
+        atexit.register(self.listener.stop)
+
+    def setFormatter(self, fmt):
+        # Formatting happens on the listener thread
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Only resolve the message arguments here; the record itself is formatted by the listener
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Never block a request on logging; count what was lost instead
+            self.dropped += 1
@@ -8,4 +8,9 @@ urlpatterns = [
     path('api/delete-chat/<str:session_id>/', views.delete_chat, name='delete_chat'),
     path('api/rename-chat/<str:session_id>/', views.rename_chat, name='rename_chat'),
     path('api/chat-sessions/', views.get_chat_sessions, name='get_chat_sessions'),
+    path('api/chat-history/<str:session_id>/', views.chat_history, name='chat_history'),
+    path('api/llm-usage/', views.llm_usage, name='llm_usage'),
+    path('api/profiles/', views.profiles, name='profiles'),
+    path('api/profiles/<str:name>', views.download_profile, name='download_profile'),
+    path('metrics', views.metrics, name='metrics'),
 ]
\ No newline at end of file
@@ -1,12 +1,85 @@
 from django.shortcuts import render, get_object_or_404
-from django.http import StreamingHttpResponse, JsonResponse
+from django.conf import settings
+from django.http import StreamingHttpResponse, JsonResponse, HttpResponse, FileResponse, Http404
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
+from django.db.models import Q
+from django.utils.crypto import constant_time_compare
+from django.utils.dateparse import parse_datetime
 from .chat_service import ChatService
 from .models import ChatSession, ChatMessage
+from .session_listing import get_session_listing, invalidate_session_listing
+from .write_behind import write_behind
+from .archive import rehydrate_session
+from .request_cache import invalidate_chat_session
+from .jira_pool import session_token
+from .metrics import registry as metrics_registry
+from .llm_usage import GROUPS as USAGE_GROUPS, usage_rollup
+from .profiling import list_profiles, profile_path
+from .framing import frame_events, gzip_stream, accepts_gzip
+from datetime import timedelta
+from django.utils import timezone
 import uuid
 import json
 
+HISTORY_PAGE_SIZE = 30
+HISTORY_MAX_PAGE_SIZE = 100
+
+def _history_page(session_pk, before=None, limit=HISTORY_PAGE_SIZE):
+    """Return (messages oldest first, cursor for the next older page) keyed on (created_at, id)"""
+    messages = ChatMessage.objects.filter(session_id=session_pk)
+    if before:
+        created_at, message_id = before
+        messages = messages.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=message_id)
+        )
+
+    rows = messages.order_by('-created_at', '-id').values(
+        'id', 'message_uid', 'user_message', 'bot_response', 'created_at'
+    )[:limit + 1]
+
+    page = list(rows.iterator())
+    has_more = len(page) > limit
+    page = page[:limit]
+
+    cursor = None
+    if has_more:
+        cursor = f"{page[-1]['created_at'].isoformat()}|{page[-1]['id']}"
+
+    page.reverse()
+
+    if not before:
+        # The newest page also shows replies still waiting in the write-behind queue
+        saved = {row['message_uid'] for row in page}
+        page.extend(
+            {'user_message': msg.user_message, 'bot_response': msg.bot_response, 'created_at': msg.created_at}
+            for msg in write_behind.pending_messages(session_pk) if msg.message_uid not in saved
+        )
+    history = [
+        {
+            'user_message': row['user_message'],
+            'bot_response': row['bot_response'],
+            'created_at': row['created_at'].isoformat()
+        }
+        for row in page
+    ]
+    return history, cursor
+
+def _parse_history_cursor(value):
+    """Parse a 'created_at|id' cursor, returning None if it is malformed"""
+    try:
+        created_at, message_id = value.rsplit('|', 1)
+        created_at = parse_datetime(created_at)
+        return (created_at, int(message_id)) if created_at else None
+    except ValueError:
+        return None
+
+def _sse(event, data):
+    """One server-sent event; pings are comments, which EventSource parsers ignore"""
+    if event == 'ping':
+        return ': ping\n\n'
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
 @login_required
 @csrf_exempt
 def ai_chat(request, session_id=None):
@@ -26,21 +99,48 @@ def ai_chat(request, session_id=None):
         request.session['auto_assign'] = auto_assign
 
         # Process message through chat service
-        chat_service = ChatService(session_id, user=request.user, auto_assign=auto_assign)
+        chat_service = ChatService(
+            session_id, user=request.user, auto_assign=auto_assign,
+            jira_api_token=session_token(request.session)
+        )
 
-        def response_generator():
-            response = chat_service.process_message(user_input)
-            for char in response:
-                yield char
+        # Tokens are coalesced into chunks of up to CHAT_STREAM_CHUNK_SIZE characters, cut at sentences
+        events = frame_events(chat_service.stream_message(
+            user_input, poll=settings.CHAT_STREAM_MAX_DELAY_MS / 2000
+        ))
 
-        return StreamingHttpResponse(response_generator(), content_type='text/plain')
+        if 'text/event-stream' in request.headers.get('Accept', ''):
+            # Typed events (status, token, result_card, error, done) for the chat page
+            content = (_sse(event, data) for event, data in events)
+            content_type = 'text/event-stream'
+        else:
+            def content():
+                for event, data in events:
+                    if event == 'token':
+                        yield data['text']
+                    elif event == 'error':
+                        yield data['message']
+            content = content()
+            content_type = 'text/plain'
+
+        gzip = accepts_gzip(request)
+        response = StreamingHttpResponse(gzip_stream(content) if gzip else content, content_type=content_type)
+        if gzip:
+            response['Content-Encoding'] = 'gzip'
+        response['Vary'] = 'Accept, Accept-Encoding'
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # Stop nginx from buffering the stream
+        return response
 
     # For GET requests, load the specific session or create new one
+    chat_session = None
     if session_id:
         # Load specific session
         try:
             chat_session = ChatSession.objects.get(session_id=session_id, user=request.user)
             request.session['chat_session_id'] = session_id
+            if chat_session.archived_at:
+                rehydrate_session(chat_session)
         except ChatSession.DoesNotExist:
             # Session doesn't exist or doesn't belong to user, redirect to new chat
             session_id = None
@@ -50,44 +150,18 @@ def ai_chat(request, session_id=None):
         session_id = str(uuid.uuid4())
         request.session['chat_session_id'] = session_id
 
-    # Get chat history for this session
-    chat_history = []
-    if session_id:
-        try:
-            chat_session = ChatSession.objects.get(session_id=session_id)
-            messages = ChatMessage.objects.filter(session=chat_session).order_by('created_at')
-            chat_history = [
-                {
-                    'user_message': msg.user_message,
-                    'bot_response': msg.bot_response,
-                    'created_at': msg.created_at.isoformat()
-                }
-                for msg in messages
-            ]
-        except ChatSession.DoesNotExist:
-            pass
+    # Get the latest page of chat history; older pages are fetched on scroll
+    chat_history, history_cursor = [], None
+    if chat_session:
+        chat_history, history_cursor = _history_page(chat_session.pk)
 
     # Get user's chat sessions for sidebar
-    user_sessions = ChatSession.objects.filter(
-        user=request.user
-    ).order_by('-last_activity')[:20]  # Last 20 sessions
-
-    # Serialize user sessions
-    sessions_data = []
-    for session in user_sessions:
-        if not session.title:
-            session.generate_title()
-        sessions_data.append({
-            'session_id': session.session_id,
-            'title': session.title or 'New Chat',
-            'last_activity': session.last_activity.isoformat(),
-            'message_count': session.get_message_count(),
-            'created_at': session.created_at.isoformat()
-        })
+    sessions_data = get_session_listing(request.user)
 
     context = {
         'current_session_id': session_id,
         'chat_history': json.dumps(chat_history),
+        'history_cursor': json.dumps(history_cursor),
         'user_sessions': json.dumps(sessions_data)
     }
 
@@ -107,6 +181,8 @@ def delete_chat(request, session_id):
         try:
             chat_session = ChatSession.objects.get(session_id=session_id, user=request.user)
             chat_session.delete()
+            invalidate_session_listing(request.user.pk)
+            invalidate_chat_session(session_id)
             return JsonResponse({'success': True})
         except ChatSession.DoesNotExist:
             return JsonResponse({'success': False, 'error': 'Session not found'})
@@ -121,30 +197,95 @@ def rename_chat(request, session_id):
             new_title = request.POST.get('title', '').strip()
             if new_title:
                 chat_session.title = new_title
-                chat_session.save()
+                # Only the title; conversation_context is updated in the background
+                chat_session.save(update_fields=['title', 'last_activity'])
+                invalidate_session_listing(request.user.pk)
+                invalidate_chat_session(session_id)
                 return JsonResponse({'success': True, 'title': new_title})
             return JsonResponse({'success': False, 'error': 'Title cannot be empty'})
         except ChatSession.DoesNotExist:
             return JsonResponse({'success': False, 'error': 'Session not found'})
     return JsonResponse({'success': False, 'error': 'Invalid method'})
 
+@login_required
+def chat_history(request, session_id):
+    """Get a page of older messages for a chat session, newest page first"""
+    try:
+        chat_session = ChatSession.objects.only('pk', 'session_id', 'user_id', 'archived_at').get(
+            session_id=session_id, user=request.user
+        )
+    except ChatSession.DoesNotExist:
+        return JsonResponse({'success': False, 'error': 'Session not found'}, status=404)
+
+    if chat_session.archived_at:
+        rehydrate_session(chat_session)
+
+    before = None
+    if request.GET.get('before'):
+        before = _parse_history_cursor(request.GET['before'])
+        if before is None:
+            return JsonResponse({'success': False, 'error': 'Invalid cursor'}, status=400)
+
+    try:
+        limit = min(max(int(request.GET.get('limit', HISTORY_PAGE_SIZE)), 1), HISTORY_MAX_PAGE_SIZE)
+    except ValueError:
+        limit = HISTORY_PAGE_SIZE
+
+    messages, cursor = _history_page(chat_session.pk, before=before, limit=limit)
+    return JsonResponse({'success': True, 'messages': messages, 'next_cursor': cursor})
+
 @login_required
 def get_chat_sessions(request):
     """Get user's chat sessions for the sidebar"""
-    sessions = ChatSession.objects.filter(user=request.user).order_by('-last_activity')[:20]
-    sessions_data = []
-
-    for session in sessions:
-        # Generate title if not set
-        if not session.title:
-            session.generate_title()
-
-        sessions_data.append({
-            'session_id': session.session_id,
-            'title': session.title or 'New Chat',
-            'last_activity': session.last_activity.isoformat(),
-            'message_count': session.get_message_count(),
-            'created_at': session.created_at.isoformat()
-        })
-
-    return JsonResponse({'sessions': sessions_data})
+    return JsonResponse({'sessions': get_session_listing(request.user)})
+
+@login_required
+def llm_usage(request):
+    """LLM tokens and time per user, session, intent or model over the last N hours (staff only)"""
+    if not request.user.is_staff:
+        return JsonResponse({'success': False, 'error': 'Staff only'}, status=403)
+
+    group_by = request.GET.get('group_by', 'user')
+    if group_by not in USAGE_GROUPS:
+        return JsonResponse({'success': False, 'error': f"group_by must be one of {', '.join(USAGE_GROUPS)}"}, status=400)
+    try:
+        hours = min(max(float(request.GET.get('hours', 24)), 0.1), 24 * 366)
+        limit = min(max(int(request.GET.get('limit', 20)), 1), 500)
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Invalid hours or limit'}, status=400)
+
+    since = timezone.now() - timedelta(hours=hours)
+    return JsonResponse({
+        'success': True,
+        'since': since.isoformat(),
+        'group_by': group_by,
+        'rows': usage_rollup(since, group_by=group_by, limit=limit),
+    })
+
+@login_required
+def profiles(request):
+    """Saved request profiles, newest first (staff only)"""
+    if not request.user.is_staff:
+        return JsonResponse({'success': False, 'error': 'Staff only'}, status=403)
+    return JsonResponse({'success': True, 'profiles': [
+        dict(profile, url=f"/api/profiles/{profile['name']}") for profile in list_profiles()
+    ]})
+
+@login_required
+def download_profile(request, name):
+    """Download a saved .prof file (staff only)"""
+    if not request.user.is_staff:
+        return JsonResponse({'success': False, 'error': 'Staff only'}, status=403)
+    path = profile_path(name)
+    if path is None:
+        raise Http404("Profile not found")
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=name, content_type='application/octet-stream')
+
+def metrics(request):
+    """Chat latency histograms in Prometheus text format, merged across workers (METRICS_TOKEN or staff)"""
+    token = settings.METRICS_TOKEN
+    scraper = token and constant_time_compare(request.headers.get('Authorization', ''), f"Bearer {token}")
+    # Without METRICS_TOKEN only logged-in staff can read it
+    if not (scraper or request.user.is_staff):
+        return HttpResponse(status=401)
+    return HttpResponse(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,364 @@
+"""
+Write-behind persistence for chat messages.
+
+process_message hands each finished exchange to a background writer instead
+of saving it on the request path. Entries are first appended to a per-process
+JSONL journal (fsynced unless CHAT_WRITE_BEHIND_FSYNC=False), then saved in
+batches with bulk_create. After each batch the process starts a new journal
+segment and deletes the segments whose records are all committed, so journals
+hold only the last batch or two however busy the worker is. A batch that
+still fails after CHAT_WRITE_BEHIND_MAX_ATTEMPTS is written record by record,
+and records that fail on their own go to a dead-letter file in the journal
+directory, so one bad message never holds up the ones behind it. Every message carries a unique message_uid, so
+replaying a journal after a crash or worker recycle never duplicates rows.
+
+The batch transaction also appends each exchange to its session's
+conversation context. Until its batch commits, a message is served from the
+journals: this process's from memory, other workers' by reading their journal
+files in the shared CHAT_WRITE_BEHIND_DIR. So the next turn's context and the history view
+include it whichever worker serves the follow-up request. Workers must share
+that directory, i.e. run on one host, as they share the file cache.
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import ChatSession, ChatMessage, LLMUsage
+from .llm_usage import usage_rows
+from .conversation_summary import conversation_summarizer
+from .request_cache import invalidate_chat_session
+from .session_listing import invalidate_session_listing
+import atexit
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, every other journal is treated as orphaned
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+DEAD_LETTER_FILE = 'dead-letter.jsonl'  # Not chat-*.jsonl, so it is never replayed by itself
+
+
+class WriteBehindQueue:
+    """Background batch writer for ChatMessage rows backed by a replayable journal"""
+
+    def __init__(self, journal_dir=None, batch_size=None, flush_interval=None):
+        self.journal_dir = journal_dir
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._pending = {}  # message_uid -> record not yet committed
+        self._segments = {}  # journal path -> message_uids in it not yet committed
+        self._segment_files = {}  # journal path -> open file, holding the segment's lock
+        self._lock = threading.Lock()
+        self._thread = None
+        self._journal = None
+        self._journal_path = None
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self.journal_dir = self.journal_dir or settings.CHAT_WRITE_BEHIND_DIR
+            self.batch_size = self.batch_size or settings.CHAT_WRITE_BEHIND_BATCH_SIZE
+            if self.flush_interval is None:
+                self.flush_interval = settings.CHAT_WRITE_BEHIND_FLUSH_INTERVAL
+
+            os.makedirs(self.journal_dir, exist_ok=True)
+            self._open_journal()
+
+            self._thread = threading.Thread(target=self._run, name='chat-write-behind', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def _open_journal(self):
+        """Start a new journal segment; called with the lock held"""
+        self._journal_path = os.path.join(
+            self.journal_dir, f"chat-{os.getpid()}-{uuid.uuid4().hex[:8]}.jsonl"
+        )
+        self._journal = open(self._journal_path, 'a', encoding='utf-8')
+        if fcntl:
+            # Held until the segment is deleted so other workers know this journal is live
+            fcntl.flock(self._journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._segments[self._journal_path] = set()
+        self._segment_files[self._journal_path] = self._journal
+
+    def enqueue(self, session, user_message, bot_response, intent, llm_usage=()):
+        """Journal a finished exchange and its LLM usage and queue it for the next batch; returns its message_uid"""
+        self._ensure_started()
+        record = {
+            'message_uid': str(uuid.uuid4()),
+            'session': session.pk,
+            'user': session.user_id,
+            'user_message': user_message,
+            'bot_response': bot_response,
+            'intent_detected': intent,
+            'created_at': timezone.now().isoformat(),
+            'llm_usage': list(llm_usage),
+        }
+        with self._lock:
+            self._journal.write(json.dumps(record) + '\n')
+            self._journal.flush()
+            if settings.CHAT_WRITE_BEHIND_FSYNC:
+                # On disk before the reply is sent, so a crash cannot lose it
+                os.fsync(self._journal.fileno())
+            self._pending[record['message_uid']] = record
+            self._segments[self._journal_path].add(record['message_uid'])
+        self._queue.put(record)
+        return record['message_uid']
+
+    def pending_messages(self, session_pk):
+        """Unsaved ChatMessage instances for a session queued by any worker, oldest first
+
+        Messages of other workers may have been committed already; callers drop
+        those by message_uid.
+        """
+        with self._lock:
+            records = {r['message_uid']: r for r in self._pending.values() if r['session'] == session_pk}
+        for record in self._journaled_elsewhere():
+            if record.get('session') == session_pk:
+                records.setdefault(record['message_uid'], record)
+        messages = [self._to_message(r) for r in records.values()]
+        return sorted(messages, key=lambda m: m.created_at)
+
+    def _journaled_elsewhere(self):
+        """Records in the journals of other workers; segments are deleted once committed, so only recent ones are read"""
+        journal_dir = self.journal_dir or settings.CHAT_WRITE_BEHIND_DIR
+        try:
+            entries = list(os.scandir(journal_dir))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            if entry.path in self._segments or not entry.name.startswith('chat-') or not entry.name.endswith('.jsonl'):
+                continue
+            try:
+                if not entry.stat().st_size:
+                    continue
+                with open(entry.path, encoding='utf-8') as journal:
+                    lines = journal.readlines()
+            except FileNotFoundError:
+                continue  # Replayed and removed meanwhile
+            for line in lines:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    pass  # Line being written or truncated right now
+
+    def stop(self, timeout=10):
+        """Flush everything queued and stop the writer; called at interpreter exit"""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        with self._lock:
+            self._journal = None
+            self._remove_committed_segments(keep=None)
+            # Segments with uncommitted records are unlocked, so the next process replays them
+            for journal in self._segment_files.values():
+                journal.close()
+            self._segment_files.clear()
+
+    def _run(self):
+        self._replay_orphaned_journals()
+        stopping = False
+        while not stopping:
+            batch, stopping = self._next_batch()
+            if batch:
+                self._write_with_retry(batch, give_up=stopping)
+        connection.close()
+
+    def _next_batch(self):
+        """Block for the first record, then collect more until the batch is full or flush_interval passes"""
+        try:
+            first = self._queue.get(timeout=1)
+        except queue.Empty:
+            return [], False
+        if first is _STOP:
+            return [], True
+
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                record = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if record is _STOP:
+                return batch, True
+            batch.append(record)
+        return batch, False
+
+    def _write_with_retry(self, records, give_up=False):
+        """Write a batch, retrying with backoff; records that still fail are moved to the dead-letter file"""
+        delay = 0.5
+        attempts = settings.CHAT_WRITE_BEHIND_MAX_ATTEMPTS
+        for attempt in range(1, attempts + 1):
+            try:
+                self._write(records)
+                break
+            except Exception as e:
+                logger.error(f"Write-behind batch of {len(records)} messages failed (attempt {attempt}/{attempts}): {str(e)}")
+                connection.close()
+                if give_up:
+                    # Left in the journal; the next process replays it
+                    return
+                if attempt < attempts:
+                    time.sleep(delay)
+                    delay = min(delay * 2, 30)
+        else:
+            # One bad record must not hold up every later message: save the others, set it aside
+            failed = self._write_one_by_one(records) if len(records) > 1 else records
+            if failed and not self._dead_letter(failed):
+                return
+
+        with self._lock:
+            for record in records:
+                self._pending.pop(record['message_uid'], None)
+                for uids in self._segments.values():
+                    uids.discard(record['message_uid'])
+            if self._journal and self._journal.tell():
+                # New records go to a fresh segment, so this one can go once its last record commits
+                self._open_journal()
+            self._remove_committed_segments(keep=self._journal_path)
+
+    def _write_one_by_one(self, records):
+        """Write records singly; returns those that still fail"""
+        failed = []
+        for record in records:
+            try:
+                self._write([record])
+            except Exception as e:
+                logger.error(f"Write-behind message {record['message_uid']} failed: {str(e)}")
+                connection.close()
+                failed.append(record)
+        return failed
+
+    def _dead_letter(self, records):
+        """Append records that cannot be saved to the dead-letter file; returns False if that failed too"""
+        path = os.path.join(self.journal_dir, DEAD_LETTER_FILE)
+        try:
+            with open(path, 'a', encoding='utf-8') as dead_letter:
+                dead_letter.write(''.join(json.dumps(record) + '\n' for record in records))
+                dead_letter.flush()
+                os.fsync(dead_letter.fileno())
+        except Exception as e:
+            logger.error(f"Failed to dead-letter {len(records)} chat messages, keeping them in the journal: {str(e)}")
+            return False
+        logger.error(
+            f"Moved {len(records)} unsaveable chat messages to {path}; "
+            f"rename it to chat-<name>.jsonl once fixed and the next worker start replays it"
+        )
+        return True
+
+    def _remove_committed_segments(self, keep):
+        """Delete closed journal segments whose records are all committed; called with the lock held"""
+        for path, uids in list(self._segments.items()):
+            if path != keep and not uids:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                self._segment_files.pop(path).close()
+                del self._segments[path]
+
+    def _write(self, records):
+        """Insert a batch of messages and apply the matching session updates in one transaction"""
+        connection.close_if_unusable_or_obsolete()
+        session_ids = {r['session'] for r in records}
+        with transaction.atomic():
+            # Sessions deleted while their messages were queued are skipped
+            existing = dict(ChatSession.objects.filter(pk__in=session_ids).values_list('pk', 'session_id'))
+            records = [r for r in records if r['session'] in existing]
+            # A replayed journal may hold messages that were committed before the crash
+            saved = {str(uid) for uid in ChatMessage.objects.filter(
+                message_uid__in=[r['message_uid'] for r in records]
+            ).values_list('message_uid', flat=True)}
+            ChatMessage.objects.bulk_create(
+                [self._to_message(r) for r in records], ignore_conflicts=True
+            )
+            LLMUsage.objects.bulk_create([
+                row for r in records for row in usage_rows(
+                    r.get('llm_usage', []), r['session'], r['user'], r['intent_detected'],
+                    r['message_uid'], parse_datetime(r['created_at'])
+                )
+            ], ignore_conflicts=True)
+
+            ChatSession.objects.filter(pk__in=existing).update(last_activity=timezone.now())
+            first_messages = {}
+            for record in records:
+                first_messages.setdefault(record['session'], record['user_message'])
+            for session_pk, user_message in first_messages.items():
+                ChatSession.objects.filter(pk=session_pk, title='').update(
+                    title=ChatSession.title_from_message(user_message)
+                )
+
+            exchanges = {}
+            for record in records:
+                if record['message_uid'] not in saved:
+                    exchanges.setdefault(record['session'], []).append(
+                        (record['message_uid'], record['user_message'], record['bot_response'])
+                    )
+            for session_pk, session_exchanges in exchanges.items():
+                conversation_summarizer.append_exchanges(session_pk, session_exchanges)
+
+        for session_pk in exchanges:
+            # Cached copies lack the turns that just left the journal
+            invalidate_chat_session(existing[session_pk])
+        for user_id in {r['user'] for r in records}:
+            invalidate_session_listing(user_id)
+
+    def _replay_orphaned_journals(self):
+        """Write out journals left behind by processes that exited before flushing"""
+        for path in glob.glob(os.path.join(self.journal_dir, 'chat-*.jsonl')):
+            if path in self._segments:
+                continue
+            try:
+                with open(path, 'r+', encoding='utf-8') as journal:
+                    if fcntl:
+                        try:
+                            fcntl.flock(journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        except OSError:
+                            continue  # Owned by a live worker
+                    records = []
+                    for line in journal:
+                        try:
+                            records.append(json.loads(line))
+                        except ValueError:
+                            pass  # Torn final line from a killed process
+                    for start in range(0, len(records), self.batch_size):
+                        self._write(records[start:start + self.batch_size])
+                    os.remove(path)
+                logger.info(f"Replayed {len(records)} chat messages from {os.path.basename(path)}")
+            except FileNotFoundError:
+                continue  # Replayed by another worker first
+            except Exception as e:
+                logger.error(f"Failed to replay write-behind journal {path}: {str(e)}")
+
+    @staticmethod
+    def _to_message(record):
+        return ChatMessage(
+            session_id=record['session'],
+            message_uid=uuid.UUID(record['message_uid']),
+            user_message=record['user_message'],
+            bot_response=record['bot_response'],
+            intent_detected=record['intent_detected'],
+            created_at=parse_datetime(record['created_at']),
+        )
+
+
+write_behind = WriteBehindQueue()
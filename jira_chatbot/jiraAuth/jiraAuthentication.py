@@ -2,12 +2,19 @@
 from django.contrib.auth.backends import BaseBackend
 from django.contrib.auth.models import User
 from django.conf import settings
+from django.utils import timezone
 from atlassian import Jira
 from .models import UserJiraProfile
+from ai_chat.cache import get_cache
+from ai_chat.request_cache import invalidate_jira_profile
+import hashlib
+import hmac
 import logging
 
 logger = logging.getLogger(__name__)
 
+auth_cache = get_cache('sessions')
+
 class JiraAuthenticationBackend(BaseBackend):
     """
     Authenticate users against Jira API
@@ -21,22 +28,13 @@ class JiraAuthenticationBackend(BaseBackend):
             return None
             
         try:
-            # Try to authenticate with Jira
-            jira = Jira(
-                url=settings.JIRA_URL,
-                username=username,
-                password=password,  # User's actual password or API token
-                cloud=True
-            )
-            
-            # Test the connection by getting user info
-            user_info = jira.myself()
-            
+            user_info = self.verify_credentials(username, password)
+
             if user_info:
                 # Authentication successful, get or create Django user
                 django_user = self.get_or_create_user(user_info, username)
-                # Create or update JIRA profile
-                self.update_jira_profile(django_user, username)
+                # Create or update JIRA profile from the same myself() response
+                self.update_jira_profile(django_user, username, user_info.get('accountId'), verified=not user_info.get('cached'))
                 return django_user
                 
         except Exception as e:
@@ -44,49 +42,74 @@ class JiraAuthenticationBackend(BaseBackend):
             return None
         
         return None
+
+    def verify_credentials(self, username, password):
+        """
+        Return the myself() response for valid credentials, reusing a recent
+        successful check for the same username and password when
+        JIRA_AUTH_CACHE_TTL is set
+        """
+        ttl = settings.JIRA_AUTH_CACHE_TTL
+        cache_key = None
+        if ttl:
+            # Keyed by an HMAC so neither the password nor a plain hash of it is stored
+            digest = hmac.new(
+                settings.SECRET_KEY.encode('utf-8'),
+                f"{settings.JIRA_URL}\0{username}\0{password}".encode('utf-8'),
+                hashlib.sha256
+            ).hexdigest()
+            cache_key = f"jira_auth:{digest}"
+            user_info = auth_cache.get(cache_key)
+            if user_info:
+                return dict(user_info, cached=True)
+
+        jira = Jira(
+            url=settings.JIRA_URL,
+            username=username,
+            password=password,  # User's actual password or API token
+            cloud=True
+        )
+        # Test the connection by getting user info
+        user_info = jira.myself()
+
+        if user_info and cache_key:
+            auth_cache.set(cache_key, user_info, ttl)
+        return user_info
     
     def get_or_create_user(self, jira_user_info, username):
         """
-        Get or create Django user based on Jira user info
+        Get or create Django user based on Jira user info, writing only changed fields
         """
+        display_name = jira_user_info.get('displayName', '')
+        fields = {
+            'email': jira_user_info.get('emailAddress', ''),
+            'first_name': display_name.split(' ')[0],
+            'last_name': ' '.join(display_name.split(' ')[1:]),
+            'is_active': jira_user_info.get('active', True),
+        }
+
         try:
             # Try to get existing user
             user = User.objects.get(username=username)
-            
-            # Update user info from Jira
-            user.email = jira_user_info.get('emailAddress', '')
-            user.first_name = jira_user_info.get('displayName', '').split(' ')[0]
-            user.last_name = ' '.join(jira_user_info.get('displayName', '').split(' ')[1:])
-            user.is_active = jira_user_info.get('active', True)
-            user.save()
+
+            # Update user info from Jira only if it changed
+            changed = [name for name, value in fields.items() if getattr(user, name) != value]
+            if changed:
+                for name in changed:
+                    setattr(user, name, fields[name])
+                user.save(update_fields=changed)
             
         except User.DoesNotExist:
             # Create new user
-            user = User.objects.create_user(
-                username=username,
-                email=jira_user_info.get('emailAddress', ''),
-                first_name=jira_user_info.get('displayName', '').split(' ')[0],
-                last_name=' '.join(jira_user_info.get('displayName', '').split(' ')[1:]),
-                is_active=jira_user_info.get('active', True)
-            )
+            user = User.objects.create_user(username=username, **fields)
             
             logger.info(f"Created new user from Jira: {username}")
         
         return user
 
-    def update_jira_profile(self, user, jira_username):
-        """Create or update user's JIRA profile"""
+    def update_jira_profile(self, user, jira_username, jira_account_id=None, verified=True):
+        """Create or update user's JIRA profile, skipping the write when nothing changed"""
         try:
-            # Get the user's account ID from JIRA using myself() API
-            jira_account_id = None
-            try:
-                # Use the same JIRA connection that was used for authentication
-                jira_user_info = self.jira.myself()
-                jira_account_id = jira_user_info.get('accountId')
-                logger.info(f"Retrieved account ID for {jira_username}: {jira_account_id}")
-            except Exception as e:
-                logger.warning(f"Could not get account ID for {jira_username}: {e}")
-
             profile, created = UserJiraProfile.objects.get_or_create(
                 user=user,
                 defaults={
@@ -95,15 +118,26 @@ class JiraAuthenticationBackend(BaseBackend):
                     'jira_server': settings.JIRA_URL,
                 }
             )
-            if not created:
-                # Update existing profile
-                profile.jira_username = jira_username
-                if jira_account_id:  # Only update if we got a valid account ID
-                    profile.jira_account_id = jira_account_id
-                profile.jira_server = settings.JIRA_URL
-                profile.save()
+            if created:
+                invalidate_jira_profile(user.pk)
+                logger.info(f"Created JIRA profile for user: {user.username} (Account ID: {jira_account_id})")
+                return
+
+            fields = {'jira_username': jira_username, 'jira_server': settings.JIRA_URL}
+            if jira_account_id:  # Only update if we got a valid account ID
+                fields['jira_account_id'] = jira_account_id
+            changed = [name for name, value in fields.items() if getattr(profile, name) != value]
 
-            logger.info(f"Updated JIRA profile for user: {user.username} (Account ID: {jira_account_id})")
+            if changed:
+                for name in changed:
+                    setattr(profile, name, fields[name])
+                # last_login_jira is auto_now and saved along with the changes
+                profile.save(update_fields=changed + ['last_login_jira'])
+                invalidate_jira_profile(user.pk)
+                logger.info(f"Updated JIRA profile for user: {user.username} (Account ID: {jira_account_id})")
+            elif verified:
+                # Credentials were checked against Jira just now
+                UserJiraProfile.objects.filter(pk=profile.pk).update(last_login_jira=timezone.now())
         except Exception as e:
             logger.warning(f"Failed to update JIRA profile for {user.username}: {e}")
 
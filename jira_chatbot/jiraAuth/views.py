@@ -2,6 +2,8 @@ from django.contrib.auth import authenticate, login, logout
 from django.shortcuts import render, redirect
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from ai_chat.jira_pool import jira_pool, store_session_token
+from ai_chat.request_cache import get_jira_profile
 
 # Create your views here.
 def login_view(request):
@@ -12,6 +14,9 @@ def login_view(request):
         user = authenticate(request, username=username, password=password)
         if user:
             login(request, user)
+            if user.backend == 'jiraAuth.jiraAuthentication.JiraAuthenticationBackend':
+                # Kept encrypted in the session for JIRA_TOKEN_SESSION_TTL so ticket changes are made as this user
+                store_session_token(request.session, password)
             return redirect('chat')
         else:
             messages.error(request, 'Authentication failed. Please check your JIRA email and API token. If you have MFA enabled, you must use an API token instead of your password.')
@@ -19,5 +24,10 @@ def login_view(request):
     return render(request, 'auth/login.html')
 
 def logout_view(request):
+    if request.user.is_authenticated:
+        profile = get_jira_profile(request.user)
+        if profile:
+            jira_pool.discard(profile.pk)
+    # logout() flushes the session, token included
     logout(request)
     return redirect('login')
\ No newline at end of file
@@ -37,11 +37,13 @@ AUTHENTICATION_BACKENDS = [
 ]
 
 MIDDLEWARE = [
+    'ai_chat.tracing.RequestTracingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'ai_chat.profiling.StaffProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -69,14 +71,92 @@ WSGI_APPLICATION = 'jira_chatbot.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DATABASE_PROFILE=sqlite (default) or postgres
+DATABASE_PROFILE = os.getenv('DATABASE_PROFILE', 'sqlite')
+
+if DATABASE_PROFILE == 'postgres':
+    # Persistent connections by default; set DB_POOL=True to use psycopg's pool instead
+    # (Django's pool does not combine with CONN_MAX_AGE, so it is forced to 0 then)
+    DB_POOL = os.getenv('DB_POOL') == 'True'
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('DB_NAME', 'jira_chatbot'),
+            'USER': os.getenv('DB_USER', 'jira_chatbot'),
+            'PASSWORD': os.getenv('DB_PASSWORD', ''),
+            'HOST': os.getenv('DB_HOST', 'localhost'),
+            'PORT': os.getenv('DB_PORT', '5432'),
+            'CONN_MAX_AGE': 0 if DB_POOL else int(os.getenv('DB_CONN_MAX_AGE', '300')),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'pool': {
+                    'min_size': int(os.getenv('DB_POOL_MIN_SIZE', '2')),
+                    'max_size': int(os.getenv('DB_POOL_MAX_SIZE', '10')),
+                    'timeout': 10,
+                }
+            } if DB_POOL else {},
+        }
     }
+else:
+    # WAL lets readers run alongside the single writer, IMMEDIATE takes the write lock at BEGIN
+    # (no lock upgrade deadlocks) and timeout waits for the lock instead of failing with
+    # "database is locked". synchronous=NORMAL is durable in WAL mode except on power loss.
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                'timeout': int(os.getenv('DB_BUSY_TIMEOUT', '20')),
+                'transaction_mode': 'IMMEDIATE',
+                'init_command': (
+                    'PRAGMA journal_mode=WAL;'
+                    'PRAGMA synchronous=NORMAL;'
+                    'PRAGMA temp_store=MEMORY;'
+                    'PRAGMA cache_size=-20000;'
+                    'PRAGMA mmap_size=134217728;'
+                ),
+            },
+        }
+    }
+
+
+# Cache
+# One alias per namespace, each with its own TTL and entry limit (see ai_chat/cache.py).
+# File-based by default so every worker on the host shares it; set CACHE_URL=redis://...
+# to share across hosts instead (entry limits then come from Redis maxmemory).
+CACHE_DIR = Path(os.getenv('CACHE_DIR', BASE_DIR / 'cache'))
+CACHE_URL = os.getenv('CACHE_URL')
+
+CACHE_NAMESPACES = {
+    # namespace: (default timeout in seconds, max entries)
+    'sessions': (300, 5000),      # Chat sessions, sidebar listings, Jira profiles and assignees
+    'jira': (60, 2000),           # Ticket search results, cleared whenever a ticket is changed
+    'confluence': (86400, 5000),  # Space lists and extracted page text
+    'llm': (86400, 2000),         # Answers to repeatable prompts (ticket solutions, next steps)
 }
 
 
+def _cache_alias(name, timeout=300, max_entries=1000):
+    if CACHE_URL:
+        return {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+            'KEY_PREFIX': name,
+            'TIMEOUT': timeout,
+        }
+    return {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': CACHE_DIR / name,
+        'TIMEOUT': timeout,
+        'OPTIONS': {'MAX_ENTRIES': max_entries},
+    }
+
+
+CACHES = {'default': _cache_alias('default')}
+for _name, (_timeout, _max_entries) in CACHE_NAMESPACES.items():
+    CACHES[_name] = _cache_alias(_name, _timeout, _max_entries)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -132,8 +212,117 @@ CONFLUENCE_SERVER = os.getenv('CONFLUENCE_SERVER', JIRA_SERVER)
 CONFLUENCE_USERNAME = os.getenv('CONFLUENCE_USERNAME', JIRA_USERNAME)
 CONFLUENCE_API_TOKEN = os.getenv('CONFLUENCE_API_TOKEN', JIRA_API_TOKEN)
 
+# Spaces mirrored into ConfluencePage by `python manage.py sync_confluence`.
+# Once a space has been synced, listing and searching documentation is served locally.
+CONFLUENCE_SYNC_SPACES = [s.strip() for s in os.getenv('CONFLUENCE_SYNC_SPACES', 'ITSUPPORT').split(',') if s.strip()]
+
+# Seconds the per-worker Confluence space registry is trusted before reloading
+CONFLUENCE_SPACE_CACHE_TTL = int(os.getenv('CONFLUENCE_SPACE_CACHE_TTL', '600'))
+# A lookup of an unknown space reloads the registry at most this often (seconds, across workers)
+CONFLUENCE_SPACE_MISS_REFRESH = int(os.getenv('CONFLUENCE_SPACE_MISS_REFRESH', '60'))
+
 # Ollama Configuration
 OLLAMA_API_URL = os.getenv('OLLAMA_API_URL', 'http://localhost:11434')
+OLLAMA_MODEL = os.getenv('OLLAMA_MODEL', 'llama3:latest')
+OLLAMA_EMBED_MODEL = os.getenv('OLLAMA_EMBED_MODEL', 'nomic-embed-text')
+
+# Retrieval index built by `python manage.py build_knowledge_index`
+KNOWLEDGE_INDEX_PATH = Path(os.getenv('KNOWLEDGE_INDEX_PATH', BASE_DIR / 'knowledge_index.npy'))
+KNOWLEDGE_MIN_SCORE = float(os.getenv('KNOWLEDGE_MIN_SCORE', '0.35'))
+
+# Write-behind persistence of chat messages: replies are journaled and saved in batches
+# on a background thread. Set CHAT_WRITE_BEHIND=False to write each message synchronously.
+CHAT_WRITE_BEHIND = os.getenv('CHAT_WRITE_BEHIND', 'True') == 'True'
+CHAT_WRITE_BEHIND_DIR = Path(os.getenv('CHAT_WRITE_BEHIND_DIR', BASE_DIR / 'write_behind'))
+CHAT_WRITE_BEHIND_BATCH_SIZE = int(os.getenv('CHAT_WRITE_BEHIND_BATCH_SIZE', '100'))
+CHAT_WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv('CHAT_WRITE_BEHIND_FLUSH_INTERVAL', '0.05'))
+# Tries per batch (about a minute of backoff) before failing records go to write_behind/dead-letter.jsonl
+CHAT_WRITE_BEHIND_MAX_ATTEMPTS = int(os.getenv('CHAT_WRITE_BEHIND_MAX_ATTEMPTS', '8'))
+# fsync the journal after every message; with False a machine crash can lose the last few seconds of replies
+CHAT_WRITE_BEHIND_FSYNC = os.getenv('CHAT_WRITE_BEHIND_FSYNC', 'True') == 'True'
+
+# Sessions idle for longer than this are moved to compressed cold storage by
+# `python manage.py archive_chat_sessions` and restored when reopened
+CHAT_ARCHIVE_AFTER_DAYS = int(os.getenv('CHAT_ARCHIVE_AFTER_DAYS', '90'))
+
+# Streamed replies are sent in chunks of up to CHAT_STREAM_CHUNK_SIZE characters, or whatever
+# has built up after CHAT_STREAM_MAX_DELAY_MS, cut at sentence boundaries. CHAT_STREAM_GZIP
+# compresses the stream for clients that accept it.
+CHAT_STREAM_CHUNK_SIZE = int(os.getenv('CHAT_STREAM_CHUNK_SIZE', '1024'))
+CHAT_STREAM_MAX_DELAY_MS = float(os.getenv('CHAT_STREAM_MAX_DELAY_MS', '50'))
+CHAT_STREAM_GZIP = os.getenv('CHAT_STREAM_GZIP', 'False') == 'True'
+
+# Offline stand-in (python manage.py run_standin) for benchmarks and CI perf runs.
+# When set, Jira, Confluence and Ollama all point at the recorded-fixture server.
+STANDIN_SERVER_URL = os.getenv('STANDIN_SERVER_URL')
+if STANDIN_SERVER_URL:
+    JIRA_SERVER = JIRA_URL = CONFLUENCE_SERVER = OLLAMA_API_URL = STANDIN_SERVER_URL
+    JIRA_USERNAME = CONFLUENCE_USERNAME = JIRA_USERNAME or 'standin@example.com'
+    JIRA_API_TOKEN = CONFLUENCE_API_TOKEN = JIRA_API_TOKEN or 'standin'
+
+# Seconds a successful Jira credential check is reused for repeat logins (0 disables)
+JIRA_AUTH_CACHE_TTL = int(os.getenv('JIRA_AUTH_CACHE_TTL', '0'))
+
+# The Jira token entered at login is kept in the session encrypted with this Fernet key
+# (derived from SECRET_KEY when unset) and used for at most JIRA_TOKEN_SESSION_TTL seconds
+JIRA_TOKEN_ENCRYPTION_KEY = os.getenv('JIRA_TOKEN_ENCRYPTION_KEY', '')
+JIRA_TOKEN_SESSION_TTL = int(os.getenv('JIRA_TOKEN_SESSION_TTL', '28800'))
+
+# Pooled Jira clients (ai_chat/jira_pool.py). Ticket changes are made with the
+# logged-in user's own token through an LRU of per-user clients; a process keeps
+# at most JIRA_POOL_MAX_CLIENTS x JIRA_POOL_CONNECTIONS_PER_CLIENT user sockets.
+JIRA_POOL_MAX_CLIENTS = int(os.getenv('JIRA_POOL_MAX_CLIENTS', '200'))
+JIRA_POOL_CONNECTIONS_PER_CLIENT = int(os.getenv('JIRA_POOL_CONNECTIONS_PER_CLIENT', '2'))
+JIRA_POOL_IDLE_TIMEOUT = int(os.getenv('JIRA_POOL_IDLE_TIMEOUT', '300'))
+# Requests per second to Jira across all clients of a process (0 disables the limit)
+JIRA_RATE_LIMIT = float(os.getenv('JIRA_RATE_LIMIT', '20'))
+JIRA_RATE_BURST = int(os.getenv('JIRA_RATE_BURST', '40'))
+
+# Bearer token for Prometheus scrapes of /metrics (unset: only logged-in staff can read it)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# Logging: records go through a queue to a background writer, tagged with the request's
+# correlation ID (X-Request-ID). LOG_FORMAT=json for log shippers, text for a terminal.
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text' if DEBUG else 'json')
+# Fraction of requests whose DEBUG records are kept when LOG_LEVEL=DEBUG
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '1.0'))
+# Requests slower than this are logged as warnings with their stage and HTTP call breakdown
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', '5000'))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'request_context': {'()': 'ai_chat.tracing.RequestContextFilter'},
+    },
+    'formatters': {
+        'json': {'()': 'ai_chat.tracing.JsonFormatter'},
+        'text': {'format': '%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s'},
+    },
+    'handlers': {
+        'console': {
+            '()': 'ai_chat.tracing.BackgroundStreamHandler',
+            'formatter': LOG_FORMAT,
+            'filters': ['request_context'],
+        },
+    },
+    'root': {'handlers': ['console'], 'level': LOG_LEVEL},
+    'loggers': {
+        # Django's own request logging is covered by RequestTracingMiddleware
+        'django': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+        'django.db.backends': {'level': 'INFO'},
+        'urllib3': {'level': 'WARNING'},
+        'httpx': {'level': 'WARNING'},
+        'httpcore': {'level': 'WARNING'},
+    },
+}
+
+# Staff can profile a request with an "X-Profile: 1" header or ?profile=1 (ai_chat/profiling.py);
+# .prof files are kept in PROFILE_DIR and downloadable from /api/profiles/
+PROFILE_DIR = Path(os.getenv('PROFILE_DIR', BASE_DIR / 'profiles'))
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', '50'))
+PROFILE_MAX_AGE_HOURS = float(os.getenv('PROFILE_MAX_AGE_HOURS', '72'))
 
 # Authentication Configuration
 LOGIN_URL = '/auth/login/'
@@ -109,6 +109,9 @@ document.addEventListener('DOMContentLoaded', function () {
     }
 
     // Chat history functions
+    let historyCursor = window.chatData ? window.chatData.historyCursor : null;
+    let loadingHistory = false;
+
     function initializeChatHistory() {
         if (window.chatData && window.chatData.chatHistory) {
             const history = window.chatData.chatHistory;
@@ -121,6 +124,41 @@ document.addEventListener('DOMContentLoaded', function () {
 
             scrollToBottom();
         }
+
+        // Fetch older pages when the user scrolls near the top
+        chatContainer.addEventListener('scroll', function() {
+            if (chatContainer.scrollTop < 80) {
+                loadOlderMessages();
+            }
+        });
+    }
+
+    function loadOlderMessages() {
+        if (!historyCursor || loadingHistory || !window.chatData.currentSessionId) return;
+        loadingHistory = true;
+
+        const url = `/api/chat-history/${window.chatData.currentSessionId}/?before=${encodeURIComponent(historyCursor)}`;
+        fetch(url)
+            .then(response => response.json())
+            .then(data => {
+                if (!data.success) return;
+
+                // Prepend older messages and keep the current view in place
+                const previousHeight = chatContainer.scrollHeight;
+                const fragment = document.createDocumentFragment();
+                data.messages.forEach(msg => {
+                    fragment.appendChild(buildUserMessage(msg.user_message));
+                    fragment.appendChild(buildBotMessage(msg.bot_response));
+                });
+                chatContainer.insertBefore(fragment, chatContainer.firstChild);
+                chatContainer.scrollTop += chatContainer.scrollHeight - previousHeight;
+
+                historyCursor = data.next_cursor;
+            })
+            .catch(error => console.error('Error loading older messages:', error))
+            .finally(() => {
+                loadingHistory = false;
+            });
     }
 
     function loadChatSessions() {
@@ -230,12 +268,17 @@ document.addEventListener('DOMContentLoaded', function () {
         }
     });
 
-    // Add user message to chat
-    function addUserMessage(message, scroll = true) {
+    // Build a user message element
+    function buildUserMessage(message) {
         const messageDiv = document.createElement('div');
         messageDiv.className = 'user-message';
         messageDiv.innerHTML = `<strong>You:</strong> ${escapeHtml(message)}`;
-        chatContainer.appendChild(messageDiv);
+        return messageDiv;
+    }
+
+    // Add user message to chat
+    function addUserMessage(message, scroll = true) {
+        chatContainer.appendChild(buildUserMessage(message));
         if (scroll) scrollToBottom();
     }
 
@@ -290,13 +333,18 @@ document.addEventListener('DOMContentLoaded', function () {
         return formatted;
     }
 
-    // Add bot message to chat (for loading history)
-    function addBotMessage(message, scroll = true) {
+    // Build a bot message element (for loading history)
+    function buildBotMessage(message) {
         const messageDiv = document.createElement('div');
         messageDiv.className = 'bot-message';
         const formattedMessage = formatBotMessage(message);
         messageDiv.innerHTML = `<strong>AI:</strong> <div class="response-content">${formattedMessage}</div>`;
-        chatContainer.appendChild(messageDiv);
+        return messageDiv;
+    }
+
+    // Add bot message to chat (for loading history)
+    function addBotMessage(message, scroll = true) {
+        chatContainer.appendChild(buildBotMessage(message));
         if (scroll) scrollToBottom();
     }
 
@@ -321,7 +369,7 @@ document.addEventListener('DOMContentLoaded', function () {
         scrollToBottom();
     }
 
-    // Send message and handle streaming response
+    // Send message and render the reply's server-sent events as they arrive
     async function sendMessageAndStream(message) {
         // Create FormData (matches Django expectation)
         const formData = new FormData();
@@ -333,7 +381,8 @@ document.addEventListener('DOMContentLoaded', function () {
             method: 'POST',
             body: formData,
             headers: {
-                'X-CSRFToken': getCsrfToken() // Django CSRF protection
+                'X-CSRFToken': getCsrfToken(), // Django CSRF protection
+                'Accept': 'text/event-stream'
             }
         });
 
@@ -341,17 +390,39 @@ document.addEventListener('DOMContentLoaded', function () {
             throw new Error(`HTTP error! status: ${response.status}`);
         }
 
-        // Create bot message container
+        // Create bot message container; it shows status updates until the first token
         const botResponseElement = createBotMessage();
-        botResponseElement.textContent = '';
-        botResponseElement.parentElement.classList.remove('message-loading');
+        const botMessageDiv = botResponseElement.parentElement;
+        let fullResponse = '';
+
+        function handleEvent(type, data) {
+            if (type === 'status') {
+                if (!fullResponse) botResponseElement.textContent = data.text;
+            } else if (type === 'token') {
+                if (!fullResponse) {
+                    botMessageDiv.classList.remove('message-loading');
+                }
+                fullResponse += data.text;
+                // Show raw text during streaming for real-time feedback
+                botResponseElement.textContent = fullResponse;
+            } else if (type === 'result_card') {
+                botMessageDiv.appendChild(buildResultCard(data));
+            } else if (type === 'error') {
+                if (!fullResponse) botMessageDiv.remove();
+                showErrorMessage(data.message);
+            } else if (type === 'done') {
+                botMessageDiv.classList.remove('message-loading');
+                botMessageDiv.dataset.messageId = data.message_id;
+                // Format the final response with enhanced styling
+                botResponseElement.innerHTML = formatBotMessage(fullResponse);
+            }
+            scrollToBottom();
+        }
 
-        // Get stream reader
+        // Events are separated by a blank line
         const reader = response.body.getReader();
         const decoder = new TextDecoder();
-        let fullResponse = '';
-
-        // Read stream chunks
+        let buffer = '';
         while (true) {
             const {
                 done,
@@ -360,25 +431,52 @@ document.addEventListener('DOMContentLoaded', function () {
 
             if (done) break;
 
-            // Decode chunk and add to response
-            const chunk = decoder.decode(value, {
+            buffer += decoder.decode(value, {
                 stream: true
             });
-            fullResponse += chunk;
-
-            // Show raw text during streaming for real-time feedback
-            botResponseElement.textContent = fullResponse;
-
-            // Auto-scroll to bottom
-            scrollToBottom();
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const event = parseServerSentEvent(buffer.slice(0, boundary));
+                buffer = buffer.slice(boundary + 2);
+                if (event) handleEvent(event.type, event.data);
+            }
         }
+    }
 
-        // Format the final response with enhanced styling
-        const formattedResponse = formatBotMessage(fullResponse);
-        botResponseElement.innerHTML = formattedResponse;
+    // Parse one "event: ...\ndata: {...}" block; comments (keep-alive pings) return null
+    function parseServerSentEvent(block) {
+        let type = 'message';
+        const dataLines = [];
+        for (const line of block.split('\n')) {
+            if (line.startsWith('event:')) {
+                type = line.slice(6).trim();
+            } else if (line.startsWith('data:')) {
+                dataLines.push(line.slice(5).trimStart());
+            }
+        }
+        if (!dataLines.length) return null;
+        return { type, data: JSON.parse(dataLines.join('\n')) };
+    }
 
-        // Final scroll
-        scrollToBottom();
+    // Build a card for a ticket or a list of tickets sent alongside the reply
+    function buildResultCard(card) {
+        const cardDiv = document.createElement('div');
+        cardDiv.className = 'result-card';
+        const tickets = card.type === 'ticket_list' ? card.items : [card];
+        cardDiv.innerHTML = tickets.map(ticket => {
+            const statusClass = (ticket.status || '').toLowerCase().replace(/\s+/g, '-');
+            const meta = [
+                ticket.status ? `<span class="status-badge status-${escapeHtml(statusClass)}">${escapeHtml(ticket.status)}</span>` : '',
+                ticket.priority ? `Priority: ${escapeHtml(ticket.priority)}` : '',
+                ticket.assignee ? `Assignee: ${escapeHtml(ticket.assignee)}` : ''
+            ].filter(Boolean).join(' | ');
+            return `<div class="result-card-item">
+                ${card.created ? '<span class="result-card-label">Created</span> ' : ''}<a href="${escapeHtml(ticket.url)}" target="_blank"><strong>${escapeHtml(ticket.key)}</strong></a>
+                ${escapeHtml(ticket.summary)}
+                <div class="result-card-meta">${meta}</div>
+            </div>`;
+        }).join('');
+        return cardDiv;
     }
 
     // Rename and delete functionality